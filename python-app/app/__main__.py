@@ -1,9 +1,31 @@
 """
 Точка входа для запуска VK Teams Bot как модуля
-python -m app
+python -m app                - запустить бота
+python -m app replay FILE... - воспроизвести записанные события
 """
+import argparse
+import sys
 
 from . import main
 
+def cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        main()
+        return
+
+    parser = argparse.ArgumentParser(prog="python -m app", description="VK Teams Bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="запустить бота")
+    from .replay import build_parser
+    build_parser(commands.add_parser("replay", help="воспроизвести записанные события"))
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        main()
+    elif args.command == "replay":
+        from .replay import run
+        run(args)
+
 if __name__ == "__main__":
-    main()
+    cli()
@@ -2,35 +2,63 @@
 API Server - FastAPI приложение с интеграцией N8N
 Упрощенная версия с сохранением всей функциональности
 """
-import json
+import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, List
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 
 from .config import Config
-from .webhook_handler import WebhookHandler, IncomingWebhookMessage
+from .webhook_handler import WebhookHandler, IncomingWebhookMessage, CallbackAnswerRequest, StatusCacheEntryRequest
+from .batch_sender import BatchSender, BatchSendRequest
+from .dead_letter import DeadLetterStore, DeadLetterReplayRequest
+from .event_bus import EVENT_TYPES, EventBusFullError, Subscription, format_sse
+from .keyboards import KeyboardTemplate, KeyboardTemplateRef, KeyboardTemplateError
+from .metrics import REGISTRY, WEBHOOK_HANDLE_DURATION, render as render_metrics
 
 logger = logging.getLogger(__name__)
 
 class APIServer:
     """FastAPI сервер для управления ботом и интеграцией с N8N"""
     
-    def __init__(self):
+    def __init__(self, webhook_handler: Optional[WebhookHandler] = None):
         self.app = FastAPI(
             title="VK Teams Bot with N8N Integration",
             description="VK Teams бот с интеграцией N8N для автоматизации",
             version="2.0.0"
         )
-        self.webhook_handler = WebhookHandler()
+        self.webhook_handler = webhook_handler or WebhookHandler()
         self.vk_bot_instance = None
+        self.batch_sender: Optional[BatchSender] = None
+        self.started_at = time.time()
+        REGISTRY.gauge("process_uptime_seconds", "Seconds since the API server was created",
+                       lambda: time.time() - self.started_at)
+        self._setup_lifecycle()
         self._setup_routes()
     
     def set_bot_instance(self, bot_instance):
         """Установить экземпляр бота"""
         self.vk_bot_instance = bot_instance
+        self.batch_sender = BatchSender(bot_instance)
+
+    def _setup_lifecycle(self):
+        """Запуск и остановка фоновых задач вместе с event loop uvicorn"""
+
+        @self.app.on_event("startup")
+        async def on_startup():
+            await self.webhook_handler.start()
+            if self.vk_bot_instance:
+                await self.vk_bot_instance.start()
+
+        @self.app.on_event("shutdown")
+        async def on_shutdown():
+            if self.vk_bot_instance:
+                await self.vk_bot_instance.shutdown()
+            await self.webhook_handler.shutdown()
         
     def _setup_routes(self):
         """Настроить маршруты API"""
@@ -38,21 +66,20 @@ class APIServer:
         @self.app.get("/")
         async def root():
             """Основная информация о системе"""
-            active_chats = self.vk_bot_instance.get_active_chats() if self.vk_bot_instance else {}
-            webhook_stats = self.webhook_handler.get_webhook_stats()
-            
             return {
                 "bot": "VK Teams Bot with N8N Integration",
                 "version": "2.0.0",
                 "status": "running" if self.vk_bot_instance and self.vk_bot_instance.bot_running else "stopped",
                 "environment": Config.ENVIRONMENT,
-                "active_chats": len(active_chats),
-                "n8n_integration": webhook_stats["n8n_webhook_configured"],
+                "active_chats": await self._probe_chat_count(),
+                "n8n_integration": bool(self.webhook_handler.n8n_webhook_url),
                 "endpoints": {
                     "health": "/health",
                      "chats": "/chats",
                      "webhook": "/api/webhook",
                      "send_message": "/api/send-message",
+                     "send_batch": "/api/send-batch",
+                     "events": "/api/events",
                      "docs": "/docs"
                 },
                 "timestamp": datetime.now().isoformat()
@@ -61,32 +88,42 @@ class APIServer:
         @self.app.get("/health")
         async def health_check():
             """Проверка здоровья всей системы"""
-            active_chats = self.vk_bot_instance.get_active_chats() if self.vk_bot_instance else {}
-            webhook_stats = self.webhook_handler.get_webhook_stats()
-            
+            # Только O(1) данные: проба здоровья не должна дорожать с ростом числа чатов.
+            # Недоступный hub (например, его перезапуск) не валит пробу: воркер жив, статус "degraded"
+            active_chats = await self._probe_chat_count()
+            hub_available = active_chats is not None
+            components = {
+                "vk_bot": {
+                    "running": self.vk_bot_instance.bot_running if self.vk_bot_instance else False,
+                    "token_configured": bool(Config.BOT_TOKEN),
+                    "polling_leader": self.vk_bot_instance.state.is_leader if self.vk_bot_instance else False,
+                    "active_chats": active_chats
+                },
+                "n8n_integration": {
+                    "webhook_configured": bool(self.webhook_handler.n8n_webhook_url),
+                    "stats": (await self._n8n_stats(Config.IPC_HEALTH_TIMEOUT))["stats"] if hub_available
+                    else self.webhook_handler.stats.copy()
+                },
+                "api_server": {
+                    "port": Config.SERVER_PORT,
+                    "environment": Config.ENVIRONMENT
+                }
+            }
+            if self.vk_bot_instance and self.vk_bot_instance.hub:
+                components["hub"] = {"status": "available" if hub_available else "unavailable"}
             return {
-                "status": "healthy",
+                "status": "healthy" if hub_available else "degraded",
                 "timestamp": datetime.now().isoformat(),
-                "components": {
-                    "vk_bot": {
-                        "running": self.vk_bot_instance.bot_running if self.vk_bot_instance else False,
-                        "token_configured": bool(Config.BOT_TOKEN),
-                        "active_chats": len(active_chats)
-                    },
-                    "n8n_integration": {
-                        "webhook_configured": webhook_stats["n8n_webhook_configured"],
-                        "stats": webhook_stats.get("stats", {})
-                    },
-                    "api_server": {
-                        "port": Config.SERVER_PORT,
-                        "environment": Config.ENVIRONMENT
-                    }
-                }
+                "components": components
             }
 
         @self.app.get("/chats")
-        async def get_active_chats():
-            """Получить информацию об активных чатах"""
+        async def get_active_chats(cursor: str = Query("0"),
+                                   limit: int = Query(Config.CHATS_PAGE_SIZE, ge=1, le=1000)):
+            """
+            Получить информацию об активных чатах постранично.
+            Следующая страница - /chats?cursor=<next_cursor>
+            """
             if not self.vk_bot_instance:
                 return {
                     "total_chats": 0,
@@ -94,11 +131,16 @@ class APIServer:
                     "error": "Bot instance not initialized"
                 }
             
-            active_chats = self.vk_bot_instance.get_active_chats()
+            state = self.vk_bot_instance.state
+            try:
+                chats, next_cursor = await state.chats_page(cursor, limit)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
             
             return {
-                "total_chats": len(active_chats),
-                "chats": active_chats,
+                "total_chats": await state.chat_count(),
+                "chats": chats,
+                "next_cursor": next_cursor,
                 "timestamp": datetime.now().isoformat()
             }
 
@@ -108,60 +150,85 @@ class APIServer:
             Принимать входящие сообщения от N8N
             и отправлять их пользователю в VK Teams с поддержкой кнопок
             """
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await self._process_webhook(message)
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            finally:
+                WEBHOOK_HANDLE_DURATION.labels(status).observe(time.perf_counter() - started)
+
+        @self.app.post("/api/callback-answer")
+        async def answer_callback(answer: CallbackAnswerRequest):
+            """Текст ответа на нажатие от N8N; принимается, пока бот ждёт его (CALLBACK_ANSWER_DEADLINE_MS)"""
             if not self.vk_bot_instance:
-                logger.error("❌ Бот не инициализирован")
                 raise HTTPException(status_code=500, detail="Bot not initialized")
+            if self.vk_bot_instance.hub:
+                # Воркер: ожидающие ответа нажатия хранятся в процессе long polling
+                accepted = await self.vk_bot_instance.hub.request(
+                    'callback_answer', query_id=answer.query_id, text=answer.text,
+                    show_alert=answer.show_alert, url=answer.url
+                )
+            else:
+                accepted = self.vk_bot_instance.callback_answers.resolve(
+                    answer.query_id, answer.text, answer.show_alert, answer.url
+                )
+            if not accepted:
+                raise HTTPException(status_code=409, detail="Callback already answered or deadline passed")
+            return {"status": "answered", "query_id": answer.query_id, "timestamp": datetime.now().isoformat()}
 
-            # Обработать webhook
-            result = self.webhook_handler.process_incoming_webhook(message)
-            
-            if result["status"] == "error":
-                raise HTTPException(status_code=400, detail=result["error"])
-
-            # Проверить активные чаты
-            active_chats = self.vk_bot_instance.get_active_chats()
-            if message.chat_id not in active_chats:
-                logger.warning(f"⚠️ Чат {message.chat_id} не найден в активных чатах")
-
-            # Отправить сообщение в VK Teams (с кнопками или без)
-            keyboard_json = None
-            if message.inline_keyboard_markup:
-                keyboard_json = json.dumps(message.inline_keyboard_markup)
-            
-            success = self.vk_bot_instance.send_text(
-                message.chat_id, 
-                message.message, 
-                keyboard_json
-            )
-
-            if success:
-                logger.info(f"✅ Webhook сообщение доставлено в чат {message.chat_id}")
-                return JSONResponse(content=result, status_code=200)
+        @self.app.get("/metrics")
+        async def get_metrics():
+            """Метрики в текстовом формате Prometheus"""
+            if self.vk_bot_instance and self.vk_bot_instance.hub:
+                # Воркер: добавляем метрики процесса long polling
+                sources = [(REGISTRY.collect(), {"process": f"worker-{self.vk_bot_instance.hub.worker_id}"})]
+                try:
+                    sources.append((await self.vk_bot_instance.hub.request('metrics'), {"process": "hub"}))
+                except Exception as e:
+                    logger.error("❌ Не удалось получить метрики hub: %r", e)
+                body = render_metrics(*sources)
             else:
-                logger.error(f"❌ Не удалось доставить сообщение в чат {message.chat_id}")
-                raise HTTPException(status_code=500, detail="Failed to send message to VK Teams")
+                body = render_metrics((REGISTRY.collect(), None))
+            return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
         @self.app.get("/api/stats")
         async def get_stats():
             """Получить детальную статистику системы"""
-            active_chats = self.vk_bot_instance.get_active_chats() if self.vk_bot_instance else {}
-            webhook_stats = self.webhook_handler.get_webhook_stats()
-            
-            # Подсчет статистики по чатам
-            total_messages = sum(chat.get('message_count', 0) for chat in active_chats.values())
+            # Очередь и пакеты - этого процесса, счётчики - по всем воркерам
+            webhook_stats = {**self.webhook_handler.get_webhook_stats(), **await self._n8n_stats()}
+            # Прежнее поле chats - только первая страница /chats: ответ не растёт с числом чатов
+            chats, next_cursor = (await self.vk_bot_instance.state.chats_page("0", Config.CHATS_PAGE_SIZE)
+                                  if self.vk_bot_instance else ({}, None))
             
             return {
                 "system_status": {
                     "bot_running": self.vk_bot_instance.bot_running if self.vk_bot_instance else False,
                     "environment": Config.ENVIRONMENT,
-                    "uptime": datetime.now().isoformat()
+                    "uptime": datetime.now().isoformat(),  # прежний формат (время ответа), оставлен для совместимости
+                    "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+                    "uptime_seconds": round(time.time() - self.started_at, 1)
                 },
+                "polling": self.vk_bot_instance.get_polling_stats() if self.vk_bot_instance else None,
+                "shared_state": await self.vk_bot_instance.state.get_stats() if self.vk_bot_instance else None,
                 "chat_stats": {
-                    "total_active_chats": len(active_chats),
-                    "total_messages_processed": total_messages,
-                    "chats": active_chats
+                    **(self.vk_bot_instance.chats.get_stats() if self.vk_bot_instance else {}),
+                    "chats": chats,
+                    "chats_url": f"/chats?cursor={next_cursor}" if next_cursor else "/chats"
                 },
                 "n8n_integration": webhook_stats,
+                "vk_api": {
+                    "rate_limiter": self.vk_bot_instance.rate_limiter.get_stats() if self.vk_bot_instance else None,
+                    "callback_answers": self.vk_bot_instance.callback_answers.get_stats() if self.vk_bot_instance else None,
+                    "message_slots": self.vk_bot_instance.message_slots.get_stats() if self.vk_bot_instance else None,
+                    "callback_debounce": self.vk_bot_instance.callback_debounce.get_stats() if self.vk_bot_instance else None,
+                    "status_cache": await self.vk_bot_instance.status_cache_stats() if self.vk_bot_instance else None
+                },
+                "event_stream": self.vk_bot_instance.events.get_stats() if self.vk_bot_instance else None,
                 "config": {
                     "server_host": Config.SERVER_HOST,
                     "server_port": Config.SERVER_PORT,
@@ -171,37 +238,334 @@ class APIServer:
                 "timestamp": datetime.now().isoformat()
             }
 
-            @self.app.post("/api/send-message")
-            async def send_message_endpoint(request: Dict[str, Any]):
-                """
-                Отправить сообщение напрямую через API
-                Пример: {"chat_id": "user@vkteam.ru", "message": "Текст", "inline_keyboard_markup": {"inlineKeyboard": [...]}}
-                """
-                if not self.vk_bot_instance:
-                    raise HTTPException(status_code=500, detail="Bot not initialized")
+        @self.app.post("/api/send-message")
+        async def send_message_endpoint(request: Dict[str, Any]):
+            """
+            Отправить сообщение напрямую через API
+            Пример: {"chat_id": "user@vkteam.ru", "message": "Текст", "inline_keyboard_markup": {"inlineKeyboard": [...]}}
+            С "edit_in_place": true и "keyboard_slot" обновляется последнее сообщение слота
+            """
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+
+            chat_id = request.get("chat_id")
+            message = request.get("message")
+            inline_keyboard_markup = request.get("inline_keyboard_markup")
+            keyboard_template = request.get("keyboard_template")
 
-                chat_id = request.get("chat_id")
-                message = request.get("message")
-                inline_keyboard_markup = request.get("inline_keyboard_markup")
+            if not chat_id or not message:
+                raise HTTPException(status_code=400, detail="chat_id and message are required")
 
-                if not chat_id or not message:
-                    raise HTTPException(status_code=400, detail="chat_id and message are required")
+            try:
+                template_ref = KeyboardTemplateRef(**keyboard_template) if keyboard_template else None
+            except (TypeError, ValidationError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid keyboard_template: {e}")
+            keyboard = await self._resolve_keyboard(inline_keyboard_markup, template_ref)
 
-                try:
-                    keyboard_json = None
-                    if inline_keyboard_markup:
-                        keyboard_json = json.dumps(inline_keyboard_markup)
-                    
-                    success = self.vk_bot_instance.send_text(chat_id, message, keyboard_json)
+            try:
+                success = await self.vk_bot_instance.send_text(
+                    chat_id, message, keyboard,
+                    slot=request.get("keyboard_slot"), edit_in_place=bool(request.get("edit_in_place", False))
+                )
 
-                    if success:
-                        return {"status": "success", "message": "Message sent"}
-                    else:
-                        raise HTTPException(status_code=500, detail="Failed to send message")
+                if success:
+                    return {"status": "success", "message": "Message sent"}
+                else:
+                    raise HTTPException(status_code=500, detail="Failed to send message")
 
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки сообщения: {e}")
-                    raise HTTPException(status_code=500, detail=str(e))
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.error("❌ Ошибка отправки сообщения: %s", e)
+                raise HTTPException(status_code=500, detail=str(e))
+
+        @self.app.post("/api/send-batch")
+        async def send_batch_endpoint(request: BatchSendRequest):
+            """
+            Массовая рассылка: {"items": [{"chat_id", "message", "inline_keyboard_markup"}, ...]}
+            или {"message": "Текст", "chat_ids": [...], "inline_keyboard_markup": {...}}.
+            Большие рассылки (или "background": true) выполняются в фоне - возвращается job_id
+            """
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+
+            items = self.batch_sender.expand_request(request)
+            if not items:
+                raise HTTPException(status_code=400, detail="items or message with chat_ids are required")
+
+            if request.background or len(items) > Config.SEND_BATCH_SYNC_LIMIT:
+                job = await self.batch_sender.submit_job(items)
+                return JSONResponse(
+                    content={
+                        "status": "accepted",
+                        "job_id": job["job_id"],
+                        "total": job["total"],
+                        "status_url": f"/api/send-batch/{job['job_id']}",
+                        "timestamp": datetime.now().isoformat()
+                    },
+                    status_code=202
+                )
+
+            results = await self.batch_sender.run(items)
+            sent = sum(1 for result in results if result["status"] == "sent")
+            return {
+                "status": "completed",
+                "total": len(results),
+                "sent": sent,
+                "failed": len(results) - sent,
+                "results": results,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        @self.app.get("/api/send-batch/{job_id}")
+        async def get_send_batch_job(job_id: str):
+            """Состояние фонового задания рассылки"""
+            job = await self.batch_sender.get_job(job_id) if self.batch_sender else None
+            if not job:
+                raise HTTPException(status_code=404, detail="Job not found")
+            return job
+
+        @self.app.put("/api/keyboards/{template_id}")
+        async def put_keyboard_template(template_id: str, template: KeyboardTemplate):
+            """
+            Зарегистрировать шаблон клавиатуры. Дальше N8N может передавать
+            {"keyboard_template": {"id": "...", "version": 1, "diff": {...}}} вместо всей клавиатуры
+            """
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            await self.vk_bot_instance.put_keyboard_template(template_id, template.version, template.inline_keyboard_markup)
+            return {"status": "stored", "template_id": template_id, "version": template.version}
+
+        @self.app.get("/api/keyboards")
+        async def get_keyboard_templates():
+            """Зарегистрированные шаблоны и статистика кэша клавиатур"""
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            return await self.vk_bot_instance.keyboard_stats()
+
+        @self.app.put("/api/status-cache/{audience}")
+        async def put_status_cache(audience: str, entry: StatusCacheEntryRequest):
+            """Заменить статус аудитории ("shared" или "user:<userId>"), например когда стенд сменил владельца"""
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            keyboard = await self._resolve_keyboard(entry.inline_keyboard_markup, entry.keyboard_template)
+            await self.vk_bot_instance.store_status(audience, entry.message, keyboard)
+            return {"status": "stored", "audience": audience, "timestamp": datetime.now().isoformat()}
+
+        @self.app.delete("/api/status-cache/{audience}")
+        async def invalidate_status_cache_entry(audience: str):
+            """Сбросить статус одной аудитории"""
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            removed = await self.vk_bot_instance.invalidate_status(audience)
+            return {"status": "invalidated", "removed": removed, "timestamp": datetime.now().isoformat()}
+
+        @self.app.delete("/api/status-cache")
+        async def invalidate_status_cache():
+            """Сбросить весь кэш статуса: следующий update снова уйдёт в N8N"""
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            removed = await self.vk_bot_instance.invalidate_status()
+            return {"status": "invalidated", "removed": removed, "timestamp": datetime.now().isoformat()}
+
+        @self.app.get("/api/status-cache")
+        async def get_status_cache():
+            """Счётчики попаданий, промахов и устаревших записей кэша статуса"""
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            return await self.vk_bot_instance.status_cache_stats()
+
+        @self.app.get("/api/traces/slow")
+        async def get_slow_traces(limit: int = Query(20, ge=1, le=200)):
+            """
+            Самые долгие из последних взаимодействий: получение события -> запрос в N8N ->
+            ответ N8N -> отправка в VK Teams (stages_ms - от получения события)
+            """
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            return {
+                **await self.vk_bot_instance.slow_traces(limit),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        @self.app.get("/api/events")
+        async def stream_events(types: Optional[str] = Query(None),
+                                chat_id: Optional[List[str]] = Query(None),
+                                buffer: int = Query(Config.EVENT_STREAM_BUFFER, ge=1, le=100000)):
+            """
+            Поток изменений (text/event-stream) вместо опроса /api/stats и /chats:
+            chat_new, chat_message, send, n8n_forward. Фильтры: ?types=send,n8n_forward&chat_id=...&chat_id=...
+            При переполнении буфера подписчика старые события отбрасываются, приходит событие dropped с их числом
+            """
+            if not self.vk_bot_instance:
+                raise HTTPException(status_code=500, detail="Bot not initialized")
+            type_filter = [name.strip() for name in types.split(",") if name.strip()] if types else None
+            unknown = set(type_filter or ()) - set(EVENT_TYPES)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown event types: {sorted(unknown)}, expected {list(EVENT_TYPES)}")
+            try:
+                subscription = self.vk_bot_instance.events.subscribe(type_filter, chat_id, buffer)
+            except EventBusFullError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            return StreamingResponse(
+                self._event_stream(subscription),
+                media_type="text/event-stream",
+                # X-Accel-Buffering: nginx отдаёт события сразу, без буферизации ответа
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        @self.app.get("/api/stands")
+        async def get_stands():
+            """Состояние встроенного реестра стендов"""
+            if self.vk_bot_instance and self.vk_bot_instance.hub:
+                # Воркер: реестр стендов живёт в процессе long polling
+                stands_state = await self.vk_bot_instance.hub.request('stands')
+            elif self.vk_bot_instance and self.vk_bot_instance.stands:
+                stands_state = self.vk_bot_instance.stands.get_state()
+            else:
+                stands_state = None
+            if not stands_state:
+                raise HTTPException(status_code=404, detail="Stand engine is disabled")
+            return {
+                **stands_state,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        @self.app.get("/api/admin/dead-letters")
+        async def list_dead_letters(limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+            """Список сообщений, которые не удалось доставить"""
+            store = self._get_dead_letters()
+            return {
+                "total": await store.count(),
+                "replay_in_progress": store.replay_in_progress,
+                "replay_stats": store.replay_stats,
+                "items": await store.list(limit, offset),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        @self.app.post("/api/admin/dead-letters/replay")
+        async def replay_dead_letters(request: Optional[DeadLetterReplayRequest] = None):
+            """
+            Переотправить сообщения в фоне через обычный конвейер отправки.
+            Пример: {"ids": [1, 2, 3]} или {"limit": 500} (без ids - первые limit сообщений)
+            """
+            store = self._get_dead_letters()
+            request = request or DeadLetterReplayRequest()
+            ids = request.ids or None
+            limit = request.limit or (len(ids) if ids else 100)
+            store.start_replay(self.vk_bot_instance.replay_dead_letter, ids, limit)
+            return JSONResponse(
+                content={"status": "accepted", "ids": ids, "limit": limit, "timestamp": datetime.now().isoformat()},
+                status_code=202
+            )
+
+        @self.app.delete("/api/admin/dead-letters")
+        async def purge_dead_letters(ids: Optional[List[int]] = Query(None)):
+            """Удалить выбранные (?ids=1&ids=2) или все сообщения"""
+            store = self._get_dead_letters()
+            deleted = await store.purge(ids)
+            return {"status": "purged", "deleted": deleted, "timestamp": datetime.now().isoformat()}
+
+    async def _process_webhook(self, message: IncomingWebhookMessage) -> JSONResponse:
+        """Отправить сообщение от N8N в VK Teams"""
+        if not self.vk_bot_instance:
+            logger.error("❌ Бот не инициализирован")
+            raise HTTPException(status_code=500, detail="Bot not initialized")
+        self.vk_bot_instance.trace_mark(message.trace_id, 'n8n_reply')
+
+        # Обработать webhook
+        result = self.webhook_handler.process_incoming_webhook(message)
+        
+        if result["status"] == "error":
+            raise HTTPException(status_code=400, detail=result["error"])
+
+        # Проверить активные чаты
+        if not await self.vk_bot_instance.state.has_chat(message.chat_id):
+            logger.warning("⚠️ Чат %s не найден в активных чатах", message.chat_id)
+
+        # Отправить сообщение в VK Teams (с кнопками или без)
+        keyboard = await self._resolve_keyboard(message.inline_keyboard_markup, message.keyboard_template)
+
+        # Статус стендов запоминается, чтобы следующие update в пределах STATUS_CACHE_TTL обошлись без N8N
+        if message.cache_as:
+            await self.vk_bot_instance.store_status(message.cache_as, message.message, keyboard)
+        
+        success = await self.vk_bot_instance.send_text(
+            message.chat_id, 
+            message.message, 
+            keyboard,
+            slot=message.keyboard_slot,
+            edit_in_place=message.edit_in_place
+        )
+
+        if success:
+            self.vk_bot_instance.trace_mark(message.trace_id, 'vk_sent')
+            logger.info("✅ Webhook сообщение доставлено в чат %s", message.chat_id)
+            return JSONResponse(content=result, status_code=200)
+        else:
+            logger.error("❌ Не удалось доставить сообщение в чат %s", message.chat_id)
+            raise HTTPException(status_code=500, detail="Failed to send message to VK Teams")
+
+    async def _event_stream(self, subscription: Subscription) -> AsyncIterator[str]:
+        """
+        Кадры SSE подписчика: hello с текущими агрегатами, затем только изменения.
+        Пинг-комментарий раз в EVENT_STREAM_HEARTBEAT секунд держит соединение через прокси
+        """
+        bot = self.vk_bot_instance
+        try:
+            yield format_sse("hello", {
+                "subscription_id": subscription.subscription_id,
+                "types": sorted(subscription.types) if subscription.types else list(EVENT_TYPES),
+                "active_chats": await bot.state.chat_count(),
+                "n8n": (await self._n8n_stats())["stats"],
+                "timestamp": datetime.now().isoformat()
+            })
+            while True:
+                events, dropped = await subscription.get(Config.EVENT_STREAM_HEARTBEAT)
+                if dropped:
+                    yield format_sse("dropped", {"count": dropped})
+                if events:
+                    yield "".join(format_sse(event["type"], event, event["seq"]) for event in events)
+                elif not dropped:
+                    yield ": ping\n\n"
+        finally:
+            bot.events.unsubscribe(subscription)
+
+    async def _resolve_keyboard(self, inline_keyboard_markup: Optional[Dict[str, Any]],
+                                keyboard_template: Optional[KeyboardTemplateRef]):
+        """Клавиатура из запроса: объект передаётся как есть, шаблон - готовой строкой из кэша"""
+        if keyboard_template:
+            try:
+                return await self.vk_bot_instance.render_keyboard(keyboard_template)
+            except KeyboardTemplateError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+        return inline_keyboard_markup
+
+    async def _probe_chat_count(self) -> Optional[int]:
+        """Число чатов для / и /health; None - hub не ответил за IPC_HEALTH_TIMEOUT"""
+        if not self.vk_bot_instance:
+            return 0
+        try:
+            return await asyncio.wait_for(self.vk_bot_instance.state.chat_count(), Config.IPC_HEALTH_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+            logger.warning("⚠️ Hub недоступен для проверки здоровья: %r", e)
+            return None
+
+    async def _n8n_stats(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Счётчики N8N: в режиме воркера - сумма по всем воркерам (из hub) и разбивка по воркерам"""
+        stats = self.webhook_handler.stats.copy()
+        if self.vk_bot_instance and self.vk_bot_instance.hub:
+            try:
+                return await asyncio.wait_for(self.vk_bot_instance.hub.n8n_stats(stats), timeout)
+            except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+                logger.error("❌ Не удалось получить счётчики N8N от hub: %r", e)
+        return {"stats": stats}
+
+    def _get_dead_letters(self) -> DeadLetterStore:
+        """Хранилище dead letters бота или 500, если оно не подключено"""
+        if not self.vk_bot_instance or not self.vk_bot_instance.dead_letters:
+            raise HTTPException(status_code=500, detail="Dead letter store not initialized")
+        return self.vk_bot_instance.dead_letters
 
     def get_app(self) -> FastAPI:
         """Получить FastAPI приложение"""
@@ -0,0 +1,141 @@
+"""
+Batch Sender - массовая рассылка сообщений в VK Teams
+Параллельно по чатам, последовательно внутри одного чата
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Union
+
+from pydantic import BaseModel
+
+from .config import Config
+from .keyboards import serialize_keyboard
+
+logger = logging.getLogger(__name__)
+
+class BatchSendItem(BaseModel):
+    """Одно сообщение рассылки"""
+    chat_id: str
+    message: str
+    # Объект {"inlineKeyboard": [...]} или готовая строка inlineKeyboardMarkup
+    inline_keyboard_markup: Optional[Union[Dict[str, Any], str]] = None
+
+class BatchSendRequest(BaseModel):
+    """
+    Запрос рассылки: список сообщений (items)
+    или одно сообщение (message) для списка чатов (chat_ids)
+    """
+    items: List[BatchSendItem] = []
+    message: Optional[str] = None
+    chat_ids: List[str] = []
+    inline_keyboard_markup: Optional[Dict[str, Any]] = None
+    background: bool = False  # Вернуть job_id сразу, не дожидаясь доставки
+
+class BatchSender:
+    """Рассылка сообщений с ограничением параллелизма и фоновыми заданиями"""
+
+    def __init__(self, bot_instance):
+        self.vk_bot_instance = bot_instance
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks: set = set()
+
+    @staticmethod
+    def expand_request(request: BatchSendRequest) -> List[BatchSendItem]:
+        """Развернуть запрос в плоский список сообщений"""
+        items = list(request.items)
+        if request.message and request.chat_ids:
+            # Общая клавиатура сериализуется один раз на всю рассылку
+            keyboard_json = serialize_keyboard(request.inline_keyboard_markup)
+            items.extend(
+                BatchSendItem(
+                    chat_id=chat_id,
+                    message=request.message,
+                    inline_keyboard_markup=keyboard_json
+                )
+                for chat_id in request.chat_ids
+            )
+        return items
+
+    async def run(self, items: List[BatchSendItem], job: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Доставить сообщения: чаты обрабатываются параллельно (не более SEND_BATCH_CONCURRENCY),
+        сообщения одного чата - строго по порядку
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        by_chat: "OrderedDict[str, List[int]]" = OrderedDict()
+        for index, item in enumerate(items):
+            by_chat.setdefault(item.chat_id, []).append(index)
+
+        semaphore = asyncio.Semaphore(Config.SEND_BATCH_CONCURRENCY)
+
+        async def send_chat(indexes: List[int]):
+            async with semaphore:
+                for index in indexes:
+                    item = items[index]
+                    try:
+                        success = await self.vk_bot_instance.send_text(item.chat_id, item.message, item.inline_keyboard_markup)
+                    except Exception as e:
+                        logger.error("❌ Ошибка рассылки в чат %s: %s", item.chat_id, e)
+                        success = False
+                    results[index] = {
+                        "index": index,
+                        "chat_id": item.chat_id,
+                        "status": "sent" if success else "failed"
+                    }
+                    if job is not None:
+                        job["sent" if success else "failed"] += 1
+
+        await asyncio.gather(*(send_chat(indexes) for indexes in by_chat.values()))
+        return results
+
+    async def submit_job(self, items: List[BatchSendItem]) -> Dict[str, Any]:
+        """
+        Запустить рассылку в фоне и вернуть описание задания.
+        В режиме воркера задание выполняет hub: его статус виден из любого воркера
+        """
+        if self.vk_bot_instance.hub:
+            return await self.vk_bot_instance.hub.request(
+                'batch_job', action='submit', items=[item.model_dump() for item in items]
+            )
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "running",
+            "total": len(items),
+            "sent": 0,
+            "failed": 0,
+            "results": None,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None
+        }
+        self.jobs[job_id] = job
+        while len(self.jobs) > Config.SEND_BATCH_MAX_JOBS:
+            self.jobs.popitem(last=False)
+
+        task = asyncio.create_task(self._run_job(job, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info("📨 Задание рассылки %s: %s сообщений", job_id, len(items))
+        return dict(job)
+
+    async def _run_job(self, job: Dict[str, Any], items: List[BatchSendItem]):
+        """Выполнить фоновое задание рассылки"""
+        try:
+            job["results"] = await self.run(items, job)
+            job["status"] = "completed"
+        except Exception as e:
+            logger.error("❌ Задание рассылки %s завершилось с ошибкой: %s", job['job_id'], e)
+            job["status"] = "error"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = datetime.now().isoformat()
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Получить состояние задания рассылки"""
+        if self.vk_bot_instance.hub:
+            return await self.vk_bot_instance.hub.request('batch_job', action='get', job_id=job_id)
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
@@ -0,0 +1,106 @@
+"""
+Callback Answers - ответы на нажатия кнопок (messages/answerCallbackQuery)
+Каждое нажатие подтверждается сразу, чтобы у пользователя пропал индикатор загрузки.
+Если задан CALLBACK_ANSWER_DEADLINE_MS, ответ ждёт текст от N8N не дольше этого срока
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Awaitable, Callable, Optional, Set
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+AnswerFunc = Callable[[str, str, bool, Optional[str]], Awaitable[bool]]
+
+class CallbackAnswer:
+    """Текст ответа на нажатие"""
+    __slots__ = ('text', 'show_alert', 'url')
+
+    def __init__(self, text: str = "", show_alert: bool = False, url: Optional[str] = None):
+        self.text = text
+        self.show_alert = show_alert
+        self.url = url
+
+class CallbackAnswerer:
+    """Ожидающие ответа нажатия по queryId; на каждое нажатие уходит ровно один ответ"""
+
+    def __init__(self, answer_func: AnswerFunc):
+        self._answer = answer_func
+        self._pending: Dict[str, "asyncio.Future[CallbackAnswer]"] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {
+            'answered_default': 0,
+            'answered_locally': 0,
+            'answered_by_n8n': 0,
+            'late_n8n_answers': 0,
+            'answer_errors': 0
+        }
+
+    def _spawn(self, coro):
+        # Ответ не задерживает обработку события и пересылку в N8N
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, query_id: str, answer: CallbackAnswer):
+        try:
+            if not await self._answer(query_id, answer.text, answer.show_alert, answer.url):
+                self.stats['answer_errors'] += 1
+        except Exception as e:
+            self.stats['answer_errors'] += 1
+            logger.error("❌ Не удалось ответить на нажатие %s: %s", query_id, e)
+
+    def answer_now(self, query_id: str, text: str, show_alert: bool = False):
+        """Ответить сразу (нажатие обработано локально, например стенд)"""
+        if not Config.CALLBACK_ANSWER_ENABLED or not query_id:
+            return
+        self.stats['answered_locally'] += 1
+        self._spawn(self._send(query_id, CallbackAnswer(text, show_alert)))
+
+    def expect(self, query_id: str):
+        """Нажатие уходит в N8N: подтвердить сразу или дождать ответа N8N до срока"""
+        if not Config.CALLBACK_ANSWER_ENABLED or not query_id:
+            return
+        if Config.CALLBACK_ANSWER_DEADLINE_MS <= 0:
+            self.stats['answered_default'] += 1
+            self._spawn(self._send(query_id, CallbackAnswer(Config.CALLBACK_ANSWER_TEXT)))
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending[query_id] = future
+        self._spawn(self._wait(query_id, future))
+
+    async def _wait(self, query_id: str, future: "asyncio.Future[CallbackAnswer]"):
+        try:
+            answer = await asyncio.wait_for(future, Config.CALLBACK_ANSWER_DEADLINE_MS / 1000)
+            self.stats['answered_by_n8n'] += 1
+        except asyncio.TimeoutError:
+            answer = CallbackAnswer(Config.CALLBACK_ANSWER_TEXT)
+            self.stats['answered_default'] += 1
+        finally:
+            self._pending.pop(query_id, None)
+        await self._send(query_id, answer)
+
+    def resolve(self, query_id: str, text: str, show_alert: bool = False, url: Optional[str] = None) -> bool:
+        """Ответ от N8N; False - срок вышел или на нажатие уже ответили"""
+        future = self._pending.get(query_id)
+        if future is None or future.done():
+            self.stats['late_n8n_answers'] += 1
+            return False
+        future.set_result(CallbackAnswer(text, show_alert, url))
+        return True
+
+    async def close(self):
+        """Дождаться отправки уже начатых ответов"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=Config.CALLBACK_ANSWER_DEADLINE_MS / 1000 + 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": Config.CALLBACK_ANSWER_ENABLED,
+            "deadline_ms": Config.CALLBACK_ANSWER_DEADLINE_MS,
+            "pending": len(self._pending),
+            **self.stats,
+            "timestamp": datetime.now().isoformat()
+        }
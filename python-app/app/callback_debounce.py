@@ -0,0 +1,52 @@
+"""
+Callback Debounce - отсев повторных нажатий одной и той же кнопки
+Первое нажатие (пользователь, чат, callbackData) обрабатывается, повторы в течение
+CALLBACK_DEBOUNCE_MS подавляются: в N8N не уходят и стенд не переключают
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+from .config import Config
+
+class CallbackDebouncer:
+    """Время последнего принятого нажатия по ключу; записи старше окна вычищаются с головы"""
+
+    def __init__(self, window_ms: Optional[int] = None, max_keys: Optional[int] = None):
+        self.window = (window_ms if window_ms is not None else Config.CALLBACK_DEBOUNCE_MS) / 1000
+        self.max_keys = max_keys if max_keys is not None else Config.CALLBACK_DEBOUNCE_MAX_KEYS
+        self._accepted: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self.stats = {'accepted': 0, 'suppressed': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def should_suppress(self, user_id: str, chat_id: str, callback_data: str) -> bool:
+        """True - такое же нажатие уже принято меньше окна назад"""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        # Порядок в _accepted - по времени принятия, поэтому устаревшие записи всегда в начале
+        while self._accepted:
+            key, accepted_at = next(iter(self._accepted.items()))
+            if now - accepted_at < self.window and len(self._accepted) < self.max_keys:
+                break
+            self._accepted.popitem(last=False)
+
+        key = (user_id, chat_id, callback_data)
+        if key in self._accepted:
+            self.stats['suppressed'] += 1
+            return True
+        self._accepted[key] = now
+        self.stats['accepted'] += 1
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": int(self.window * 1000),
+            "tracked_keys": len(self._accepted),
+            **self.stats,
+            "timestamp": datetime.now().isoformat()
+        }
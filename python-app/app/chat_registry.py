@@ -0,0 +1,150 @@
+"""
+Chat Registry - ограниченный реестр активных чатов
+LRU/TTL вытеснение, агрегаты за O(1) и постраничная выдача по курсору
+"""
+import bisect
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from .config import Config
+
+class ChatRecord:
+    """Компактная запись об активном чате"""
+    __slots__ = ('chat_id', 'user_name', 'user_id', 'last_message_ts', 'message_count', 'seq')
+
+    def __init__(self, chat_id: str, user_name: str, user_id: str, seq: int):
+        self.chat_id = chat_id
+        self.user_name = user_name
+        self.user_id = user_id
+        self.last_message_ts = 0.0
+        self.message_count = 0
+        self.seq = seq
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'user_name': self.user_name,
+            'user_id': self.user_id,
+            'last_message_time': datetime.fromtimestamp(self.last_message_ts).isoformat(),
+            'message_count': self.message_count
+        }
+
+class ChatRegistry:
+    """
+    Реестр активных чатов. Порядок в _chats - по последней активности (для LRU/TTL),
+    порядок _seqs - по времени появления чата (для стабильной пагинации)
+    """
+
+    def __init__(self, max_chats: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_chats = max_chats if max_chats is not None else Config.ACTIVE_CHATS_MAX
+        self.ttl = ttl if ttl is not None else Config.ACTIVE_CHATS_TTL
+        self._chats: "OrderedDict[str, ChatRecord]" = OrderedDict()
+        self._by_seq: Dict[int, ChatRecord] = {}
+        self._seqs: List[int] = []  # возрастающие seq, удалённые вычищаются лениво
+        self._next_seq = 1
+        self.total_messages = 0  # всего обработанных сообщений (включая вытесненные чаты)
+        self.evicted = 0
+        # Изменённые чаты и число новых сообщений в них, вытесненные чаты (для общего состояния в Redis)
+        self.track_dirty = False
+        self._dirty: Dict[str, int] = {}
+        self._evicted_ids: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self._chats
+
+    def get(self, chat_id: str) -> Optional[ChatRecord]:
+        """Запись чата без копирования"""
+        return self._chats.get(chat_id)
+
+    def touch(self, chat_id: str, user_name: str, user_id: str) -> Tuple[ChatRecord, bool]:
+        """Учесть сообщение в чате; возвращает запись и признак нового чата"""
+        now = time.time()
+        record = self._chats.get(chat_id)
+        created = record is None
+        if created:
+            record = ChatRecord(chat_id, user_name, user_id, self._next_seq)
+            self._next_seq += 1
+            self._chats[chat_id] = record
+            self._by_seq[record.seq] = record
+            self._seqs.append(record.seq)
+        else:
+            record.user_name = user_name
+            record.user_id = user_id
+            self._chats.move_to_end(chat_id)
+        record.last_message_ts = now
+        record.message_count += 1
+        self.total_messages += 1
+        if self.track_dirty:
+            self._dirty[chat_id] = self._dirty.get(chat_id, 0) + 1
+        self._evict(now)
+        return record, created
+
+    def _evict(self, now: float):
+        """Вытеснить давно неактивные (TTL) и лишние (LRU) чаты; амортизированно O(1)"""
+        while self._chats:
+            oldest = next(iter(self._chats.values()))
+            expired = self.ttl > 0 and now - oldest.last_message_ts > self.ttl
+            if not expired and len(self._chats) <= self.max_chats:
+                break
+            self._remove(oldest)
+
+    def _remove(self, record: ChatRecord):
+        del self._chats[record.chat_id]
+        del self._by_seq[record.seq]
+        self.evicted += 1
+        if self.track_dirty:
+            self._evicted_ids.add(record.chat_id)
+        # Компактируем индекс пагинации, когда удалённых seq становится больше половины
+        if len(self._seqs) > 2 * len(self._by_seq) + 64:
+            self._seqs = [seq for seq in self._seqs if seq in self._by_seq]
+
+    def page(self, cursor: int = 0, limit: int = 100) -> Tuple[List[ChatRecord], Optional[int]]:
+        """Страница чатов в порядке появления после курсора; возвращает записи и следующий курсор"""
+        self._evict(time.time())
+        records: List[ChatRecord] = []
+        index = bisect.bisect_right(self._seqs, cursor)
+        while index < len(self._seqs) and len(records) < limit:
+            record = self._by_seq.get(self._seqs[index])
+            if record is not None:
+                records.append(record)
+            index += 1
+        # Пропускаем удалённые seq, чтобы понять, есть ли следующая страница
+        while index < len(self._seqs) and self._seqs[index] not in self._by_seq:
+            index += 1
+        next_cursor = records[-1].seq if records and index < len(self._seqs) else None
+        return records, next_cursor
+
+    def drain_dirty(self) -> Dict[str, int]:
+        """Забрать накопленные изменения чатов"""
+        dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def restore_dirty(self, dirty: Dict[str, int], evicted: Optional[Set[str]] = None):
+        """Вернуть неотправленные изменения"""
+        for chat_id, delta in dirty.items():
+            self._dirty[chat_id] = self._dirty.get(chat_id, 0) + delta
+        if evicted:
+            self._evicted_ids |= evicted
+
+    def drain_evicted(self) -> Set[str]:
+        """Забрать вытесненные чаты, которые снова не появились в реестре"""
+        evicted, self._evicted_ids = self._evicted_ids, set()
+        return {chat_id for chat_id in evicted if chat_id not in self._chats}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Агрегаты за O(1)"""
+        return {
+            "total_active_chats": len(self._chats),
+            "total_messages_processed": self.total_messages,
+            "evicted_chats": self.evicted,
+            "max_chats": self.max_chats,
+            "ttl_seconds": self.ttl
+        }
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Полный снимок реестра (O(n), только для отладки и совместимости)"""
+        return {chat_id: record.to_dict() for chat_id, record in self._chats.items()}
@@ -0,0 +1,95 @@
+"""
+Event Checkpoint - сохранение lastEventId на диск между перезапусками
+Запись пачками: файл обновляется раз в N событий или раз в T секунд и при остановке
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class EventCheckpoint:
+    """Чекпоинт позиции long polling в небольшом JSON файле"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.enabled = Config.CHECKPOINT_ENABLED
+        self.path = path or Config.CHECKPOINT_PATH
+        self.saved_event_id = 0
+        self.pending_event_id = 0
+        self._pending_events = 0
+        self._last_flush = time.monotonic()
+        self.stats = {
+            'flushes': 0,
+            'last_flush': None
+        }
+
+    def load(self) -> int:
+        """Прочитать сохранённый lastEventId (0, если чекпоинта нет)"""
+        if not self.enabled:
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.saved_event_id = int(json.load(f).get('last_event_id', 0))
+        except FileNotFoundError:
+            self.saved_event_id = 0
+        except (ValueError, OSError) as e:
+            logger.error("❌ Не удалось прочитать чекпоинт %s: %s", self.path, e)
+            self.saved_event_id = 0
+        self.pending_event_id = self.saved_event_id
+        if self.saved_event_id:
+            logger.info("📍 Восстановлен lastEventId=%s из %s", self.saved_event_id, self.path)
+        return self.saved_event_id
+
+    def _write(self, event_id: int):
+        """Атомарно записать чекпоинт: временный файл + fsync + rename"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'last_event_id': event_id, 'saved_at': datetime.now().isoformat()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def advance(self, event_id: int, processed: int = 1):
+        """Учесть обработанные события; записать на диск, если набралась пачка или прошёл интервал"""
+        if not self.enabled or event_id <= self.pending_event_id:
+            return
+        self.pending_event_id = event_id
+        self._pending_events += processed
+        if (self._pending_events >= Config.CHECKPOINT_EVERY_EVENTS
+                or time.monotonic() - self._last_flush >= Config.CHECKPOINT_INTERVAL):
+            await self.flush()
+
+    async def flush(self):
+        """Записать накопленную позицию на диск (вне event loop)"""
+        if not self.enabled or self.pending_event_id == self.saved_event_id:
+            return
+        event_id = self.pending_event_id
+        try:
+            await asyncio.to_thread(self._write, event_id)
+        except OSError as e:
+            logger.error("❌ Не удалось записать чекпоинт %s: %s", self.path, e)
+            return
+        self.saved_event_id = event_id
+        self._pending_events = 0
+        self._last_flush = time.monotonic()
+        self.stats['flushes'] += 1
+        self.stats['last_flush'] = datetime.now().isoformat()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние чекпоинта"""
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "saved_event_id": self.saved_event_id,
+            "pending_event_id": self.pending_event_id,
+            **self.stats
+        }
@@ -0,0 +1,172 @@
+"""
+Command Router - таблица команд бота
+Команда ищется по первому слову сообщения за O(1). Для каждой команды задано, кто её
+обрабатывает: local - только бот, n8n - только N8N, both - бот отвечает и событие уходит в N8N.
+Статические ответы и /help собираются один раз при регистрации
+"""
+import logging
+from collections import Counter
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+MODE_LOCAL = "local"
+MODE_N8N = "n8n"
+MODE_BOTH = "both"
+MODES = (MODE_LOCAL, MODE_N8N, MODE_BOTH)
+
+# Ключи COMMAND_ROUTES для сообщений, не совпавших ни с одной командой
+UNKNOWN_COMMAND = "*"
+PLAIN_TEXT = "text"
+
+ReplyHandler = Callable[["CommandContext"], Awaitable[Optional[str]]]
+
+class CommandContext:
+    """Данные сообщения для обработчика команды"""
+    __slots__ = ('chat_id', 'user_id', 'user_name', 'text', 'args', 'event')
+
+    def __init__(self, chat_id: str, user_id: str, user_name: str, text: str, args: str, event: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.text = text
+        self.args = args
+        self.event = event
+
+class Route:
+    """Команда: статический ответ (text) или обработчик, режим и строка для /help"""
+    __slots__ = ('command', 'mode', 'text', 'handler', 'description', 'accepts_args')
+
+    def __init__(self, command: str, mode: str, text: Optional[str] = None, handler: Optional[ReplyHandler] = None,
+                 description: str = "", accepts_args: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown command mode '{mode}' for {command}, expected one of {MODES}")
+        self.command = command
+        self.mode = mode
+        self.text = text
+        self.handler = handler
+        self.description = description
+        self.accepts_args = accepts_args
+
+    @property
+    def replies_locally(self) -> bool:
+        return self.mode != MODE_N8N and (self.text is not None or self.handler is not None)
+
+    @property
+    def forwards_to_n8n(self) -> bool:
+        return self.mode != MODE_LOCAL
+
+    async def reply(self, context: CommandContext) -> Optional[str]:
+        if self.text is not None:
+            return self.text
+        return await self.handler(context)
+
+class CommandRouter:
+    """Маршруты по первому слову сообщения; неизвестные команды и обычный текст - отдельные маршруты"""
+
+    def __init__(self, help_footer: str = ""):
+        self._routes: Dict[str, Route] = {}
+        self.unknown_command = Route(UNKNOWN_COMMAND, MODE_N8N)
+        self.plain_text = Route(PLAIN_TEXT, MODE_N8N)
+        self.help_footer = help_footer
+        self.help_text = ""
+        self.hits: Counter = Counter()
+
+    def register(self, command: str, text: Optional[str] = None, handler: Optional[ReplyHandler] = None,
+                 mode: str = MODE_LOCAL, description: str = "", accepts_args: bool = False) -> Route:
+        """Добавить или заменить команду"""
+        route = Route(command.lower(), mode, text, handler, description, accepts_args)
+        self._routes[route.command] = route
+        self._render_help()
+        return route
+
+    def set_fallback(self, key: str, mode: str, handler: Optional[ReplyHandler] = None):
+        """Маршрут для неизвестных команд (*) или обычного текста (text)"""
+        route = Route(key, mode, handler=handler)
+        if key == UNKNOWN_COMMAND:
+            self.unknown_command = route
+        elif key == PLAIN_TEXT:
+            self.plain_text = route
+        else:
+            raise ValueError(f"Unknown fallback route '{key}'")
+
+    def apply_overrides(self, spec: str):
+        """
+        Режимы из строки вида "/status=both,/report=n8n,text=local".
+        Незарегистрированная команда добавляется как команда N8N
+        """
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            command, _, mode = item.partition("=")
+            command, mode = command.strip().lower(), mode.strip().lower()
+            if mode not in MODES:
+                logger.warning("⚠️ COMMAND_ROUTES: неизвестный режим '%s' для %s, пропущено", mode, command)
+                continue
+            if command == UNKNOWN_COMMAND:
+                self.unknown_command.mode = mode
+            elif command == PLAIN_TEXT:
+                self.plain_text.mode = mode
+            elif command in self._routes:
+                self._routes[command].mode = mode
+            else:
+                self.register(command, mode=mode, accepts_args=True)
+        self._render_help()
+
+    def resolve(self, text: str) -> Tuple[Route, str]:
+        """Маршрут и аргументы команды для текста сообщения"""
+        if not text.startswith("/"):
+            route, args = self.plain_text, text
+        else:
+            command, *rest = text.split(maxsplit=1)
+            args = rest[0] if rest else ""
+            route = self._routes.get(command.lower())
+            if route is None or (args and not route.accepts_args):
+                route, args = self.unknown_command, text
+        self.hits[route.command] += 1
+        return route, args
+
+    def _render_help(self):
+        """Справка из описаний команд в порядке регистрации; команды без описания в неё не попадают"""
+        lines = ["Доступные команды:"]
+        lines.extend(
+            f"{route.command} - {route.description}"
+            for route in self._routes.values() if route.description
+        )
+        self.help_text = "\n".join(lines) + (f"\n\n{self.help_footer}" if self.help_footer else "")
+        help_route = self._routes.get("/help")
+        if help_route is not None and help_route.handler is None:
+            help_route.text = self.help_text
+
+    def get_stats(self) -> Dict[str, Any]:
+        routes: List[Dict[str, Any]] = [
+            {"command": route.command, "mode": route.mode, "hits": self.hits[route.command]}
+            for route in (*self._routes.values(), self.unknown_command, self.plain_text)
+        ]
+        return {"routes": routes}
+
+HELP_FOOTER = (
+    "Логика работы\n"
+    "Я отправлю тебе группу кнопок для взаимодействие со стендами.\n"
+    "- Кнопка 'update' - обновит информацию о стендах и пришлет кнопки с актуальным состоянием.\n"
+    "- Кнопки с названием стенда отвечают за взаимодействие с ним и имеют цветовую индикацию.\n"
+    "- Если кнопка зеленая, то стенд доступен, и при клике на неё стенд занимает пользователь\n"
+    "- Если кнопка желтая, то стенд занят текущим пользователем, и при клике на неё стенд освобождается.\n"
+    "- Если кнопка красная, то стенд занят другим пользователем, и при клике на неё выведется сообщение о том, кем занят стенд.\n"
+)
+
+def create_default_router(status_handler: ReplyHandler, echo_handler: ReplyHandler) -> CommandRouter:
+    """Команды бота по умолчанию; режимы можно переопределить через COMMAND_ROUTES"""
+    router = CommandRouter(HELP_FOOTER)
+    router.register(
+        "/start",
+        text="Привет! Я VK Teams бот для распределения стендов под тестирование в команде фронтенда ВК Билетов",
+        description="начать работу с ботом"
+    )
+    router.register("/help", description="показать эту справку")
+    router.register("/status", handler=status_handler, description="показать статус бота")
+    # Обычный текст уходит в N8N, бот отвечает эхом; неизвестные команды - только в N8N
+    router.set_fallback(PLAIN_TEXT, MODE_BOTH, echo_handler)
+    router.set_fallback(UNKNOWN_COMMAND, MODE_N8N)
+    router.apply_overrides(Config.COMMAND_ROUTES)
+    return router
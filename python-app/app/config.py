@@ -5,16 +5,11 @@ import os
 import logging
 from dotenv import load_dotenv
 
+from .logging_setup import setup_logging
+
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настройка логирования
-log_level = logging.DEBUG if os.getenv("DEBUG", "false").lower() == "true" else logging.INFO
-logging.basicConfig(
-    level=log_level,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
 class Config:
     """Класс конфигурации приложения"""
     
@@ -24,6 +19,17 @@ class Config:
     
     # N8N интеграция
     N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL", "")
+    N8N_TIMEOUT = float(os.getenv("N8N_TIMEOUT", "10"))  # секунд
+    N8N_QUEUE_SIZE = int(os.getenv("N8N_QUEUE_SIZE", "1000"))  # событий в очереди пересылки
+    N8N_WORKERS = int(os.getenv("N8N_WORKERS", "4"))  # параллельных отправок в N8N
+    N8N_QUEUE_PUT_TIMEOUT = float(os.getenv("N8N_QUEUE_PUT_TIMEOUT", "0.5"))  # ожидание места в очереди, секунд
+    N8N_DRAIN_TIMEOUT = float(os.getenv("N8N_DRAIN_TIMEOUT", "5"))  # дослать очередь при остановке, секунд
+    
+    # Пакетная отправка в N8N: одна пачка = один JSON массив = одно выполнение workflow
+    N8N_BATCH_ENABLED = os.getenv("N8N_BATCH_ENABLED", "false").lower() == "true"
+    N8N_BATCH_MAX_SIZE = int(os.getenv("N8N_BATCH_MAX_SIZE", "50"))  # событий в пачке
+    N8N_BATCH_MAX_LINGER_MS = int(os.getenv("N8N_BATCH_MAX_LINGER_MS", "200"))  # ожидание добора пачки
+    N8N_GZIP = os.getenv("N8N_GZIP", "false").lower() == "true"  # сжимать тело запроса в N8N
     
     # HTTP сервер настройки
     SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
@@ -32,13 +38,132 @@ class Config:
     # Redis настройки (для интеграции с N8N)
     REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
     REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
+    REDIS_PREFIX = os.getenv("REDIS_PREFIX", "stands_bot")  # префикс ключей
+    REDIS_FLUSH_INTERVAL = float(os.getenv("REDIS_FLUSH_INTERVAL", "0.5"))  # секунд между пакетами записи
+    
+    # Общее состояние реплик: memory (один процесс) или redis (несколько реплик)
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+    LEADER_LOCK_TTL = float(os.getenv("LEADER_LOCK_TTL", "15"))  # секунд жизни блокировки лидера
+    LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", "5"))  # секунд между продлениями
+    
+    # Режим запуска: single - всё в одном процессе, multiprocess - процесс long polling + воркеры API
+    RUN_MODE = os.getenv("RUN_MODE", "single").lower()
+    API_WORKERS = int(os.getenv("API_WORKERS", "2"))  # процессов API (порт общий через SO_REUSEPORT)
+    IPC_SOCKET_PATH = os.getenv("IPC_SOCKET_PATH", os.path.join(os.getenv("DATA_DIR", "data"), "poller.sock"))
+    IPC_REQUEST_TIMEOUT = float(os.getenv("IPC_REQUEST_TIMEOUT", "30"))  # ожидание ответа hub, секунд
+    IPC_MAX_UNACKED = int(os.getenv("IPC_MAX_UNACKED", "1000"))  # событий у воркеров без подтверждения обработки
+    IPC_HEALTH_TIMEOUT = float(os.getenv("IPC_HEALTH_TIMEOUT", "2"))  # ожидание hub в / и /health, секунд
+    IPC_STATS_INTERVAL = float(os.getenv("IPC_STATS_INTERVAL", "5"))  # как часто воркер шлёт в hub счётчики N8N, секунд
+    SUPERVISOR_RESTART_DELAY = float(os.getenv("SUPERVISOR_RESTART_DELAY", "1"))  # начальная пауза перезапуска
+    SUPERVISOR_MAX_RESTART_DELAY = float(os.getenv("SUPERVISOR_MAX_RESTART_DELAY", "30"))  # секунд
     
     # Настройки long polling
     POLL_TIME = int(os.getenv("POLL_TIME", "30"))  # секунд
+    POLL_RETRY_BASE_DELAY = float(os.getenv("POLL_RETRY_BASE_DELAY", "1"))  # пауза после ошибки опроса, секунд
+    POLL_RETRY_MAX_DELAY = float(os.getenv("POLL_RETRY_MAX_DELAY", "30"))  # предел роста паузы, секунд
+    DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))  # недавних eventId для отсева повторов
+    DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))  # шардов обработки по chatId, 0 - последовательно
+    DISPATCH_SHARD_QUEUE_SIZE = int(os.getenv("DISPATCH_SHARD_QUEUE_SIZE", "100"))  # событий в очереди шарда
+    DISPATCH_DRAIN_TIMEOUT = float(os.getenv("DISPATCH_DRAIN_TIMEOUT", "5"))  # дообработать очереди при остановке
+    
+    # Исходящие запросы к VK Teams API
+    VK_HTTP_MAX_CONNECTIONS = int(os.getenv("VK_HTTP_MAX_CONNECTIONS", "20"))
+    VK_HTTP_TIMEOUT = float(os.getenv("VK_HTTP_TIMEOUT", "10"))  # секунд
+    VK_HTTP_CONNECT_TIMEOUT = float(os.getenv("VK_HTTP_CONNECT_TIMEOUT", "5"))  # секунд
+    VK_SEND_CONCURRENCY = int(os.getenv("VK_SEND_CONCURRENCY", "10"))  # одновременных отправок
+    
+    # Ограничение частоты вызовов Bot API (token bucket)
+    VK_RATE_LIMIT_ENABLED = os.getenv("VK_RATE_LIMIT_ENABLED", "true").lower() == "true"
+    VK_RATE_LIMIT_GLOBAL_RPS = float(os.getenv("VK_RATE_LIMIT_GLOBAL_RPS", "20"))  # запросов в секунду
+    VK_RATE_LIMIT_GLOBAL_BURST = float(os.getenv("VK_RATE_LIMIT_GLOBAL_BURST", "20"))
+    VK_RATE_LIMIT_CHAT_RPS = float(os.getenv("VK_RATE_LIMIT_CHAT_RPS", "1"))  # запросов в секунду на чат
+    VK_RATE_LIMIT_CHAT_BURST = float(os.getenv("VK_RATE_LIMIT_CHAT_BURST", "3"))
+    VK_RATE_LIMIT_MAX_CHATS = int(os.getenv("VK_RATE_LIMIT_MAX_CHATS", "10000"))  # вёдер чатов в памяти
+    VK_RATE_LIMIT_BACKOFF = float(os.getenv("VK_RATE_LIMIT_BACKOFF", "1"))  # пауза без Retry-After, секунд
+    VK_RATE_LIMIT_MAX_RETRIES = int(os.getenv("VK_RATE_LIMIT_MAX_RETRIES", "5"))  # повторов после 429
+    
+    # Повторы отправки и dead letters
+    SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # повторов при временных ошибках
+    SEND_RETRY_BASE_DELAY = float(os.getenv("SEND_RETRY_BASE_DELAY", "0.5"))  # секунд
+    SEND_RETRY_MAX_DELAY = float(os.getenv("SEND_RETRY_MAX_DELAY", "10"))  # секунд
+    DATA_DIR = os.getenv("DATA_DIR", "data")  # локальные файлы состояния
+    DEAD_LETTER_DB = os.getenv("DEAD_LETTER_DB", os.path.join(DATA_DIR, "dead_letters.db"))
+    DEAD_LETTER_REPLAY_CONCURRENCY = int(os.getenv("DEAD_LETTER_REPLAY_CONCURRENCY", "2"))
+    
+    # Чекпоинт lastEventId
+    CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+    CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(DATA_DIR, "checkpoint.json"))
+    CHECKPOINT_EVERY_EVENTS = int(os.getenv("CHECKPOINT_EVERY_EVENTS", "50"))  # событий между записями
+    CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "5"))  # секунд между записями
+    
+    # Сквозные trace_id событий, проходящих через N8N (/api/traces/slow)
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_MAX_OPEN = int(os.getenv("TRACE_MAX_OPEN", "10000"))  # трасс, ожидающих ответа
+    TRACE_TTL = float(os.getenv("TRACE_TTL", "300"))  # секунд ожидания ответа N8N
+    TRACE_RECENT = int(os.getenv("TRACE_RECENT", "1000"))  # последних завершённых трасс для /api/traces/slow
+    
+    # Поток изменений /api/events (SSE): новые чаты, сообщения, отправки, пересылки в N8N
+    EVENT_STREAM_BUFFER = int(os.getenv("EVENT_STREAM_BUFFER", "1000"))  # событий в буфере подписчика, старые отбрасываются
+    EVENT_STREAM_MAX_SUBSCRIBERS = int(os.getenv("EVENT_STREAM_MAX_SUBSCRIBERS", "50"))  # подписчиков на процесс
+    EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", "15"))  # секунд между пингами без событий
+    
+    # Запись событий long polling для воспроизведения (python -m app replay)
+    RECORD_EVENTS = os.getenv("RECORD_EVENTS", "false").lower() == "true"
+    RECORD_DIR = os.getenv("RECORD_DIR", os.path.join(DATA_DIR, "recordings"))
+    RECORD_MAX_BYTES = int(os.getenv("RECORD_MAX_BYTES", str(64 * 1024 * 1024)))  # байт без сжатия на файл
+    RECORD_MAX_FILES = int(os.getenv("RECORD_MAX_FILES", "20"))  # хранить последних файлов
+    RECORD_FLUSH_INTERVAL = float(os.getenv("RECORD_FLUSH_INTERVAL", "1"))  # секунд между записями на диск
+    
+    # Ответы на нажатия кнопок (answerCallbackQuery)
+    CALLBACK_ANSWER_ENABLED = os.getenv("CALLBACK_ANSWER_ENABLED", "true").lower() == "true"
+    CALLBACK_ANSWER_TEXT = os.getenv("CALLBACK_ANSWER_TEXT", "")  # текст подтверждения, пусто - без всплывающего окна
+    CALLBACK_ANSWER_DEADLINE_MS = int(os.getenv("CALLBACK_ANSWER_DEADLINE_MS", "0"))  # ждать ответ N8N, 0 - отвечать сразу
+    CALLBACK_DEBOUNCE_MS = int(os.getenv("CALLBACK_DEBOUNCE_MS", "1000"))  # окно отсева повторных нажатий, 0 - выкл
+    CALLBACK_DEBOUNCE_MAX_KEYS = int(os.getenv("CALLBACK_DEBOUNCE_MAX_KEYS", "10000"))  # запомненных нажатий
+    
+    # Встроенный движок бронирования стендов
+    STANDS_ENABLED = os.getenv("STANDS_ENABLED", "false").lower() == "true"
+    STANDS = [name.strip() for name in os.getenv("STANDS", "").split(",") if name.strip()]
+    STANDS_DB = os.getenv("STANDS_DB", os.path.join(DATA_DIR, "stands.db"))
+    STANDS_CALLBACK_PREFIX = os.getenv("STANDS_CALLBACK_PREFIX", "stand:")  # callbackData кнопки стенда
+    STANDS_UPDATE_CALLBACK = os.getenv("STANDS_UPDATE_CALLBACK", "update")  # callbackData кнопки update
+    STANDS_PER_ROW = int(os.getenv("STANDS_PER_ROW", "3"))  # кнопок стендов в ряду
+    STANDS_EDIT_IN_PLACE = os.getenv("STANDS_EDIT_IN_PLACE", "true").lower() == "true"  # обновлять нажатое сообщение
+    
+    # Редактирование сообщений вместо отправки новых (edit_in_place)
+    MESSAGE_SLOTS_MAX = int(os.getenv("MESSAGE_SLOTS_MAX", "10000"))  # запомненных сообщений (чат, слот)
+    
+    # Кэш статуса стендов, присланного N8N (ответ на update без N8N)
+    STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "30"))  # свежесть записи, секунд, 0 - выкл
+    STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "10000"))  # аудиторий в памяти
+    STATUS_CACHE_CALLBACK = os.getenv("STATUS_CACHE_CALLBACK", STANDS_UPDATE_CALLBACK)  # callbackData кнопки update
+    
+    # Режимы команд: local - отвечает бот, n8n - только N8N, both - и то и другое
+    # Например "/status=both,/report=n8n"; * - неизвестные команды, text - обычный текст
+    COMMAND_ROUTES = os.getenv("COMMAND_ROUTES", "")
+    
+    # Реестр активных чатов
+    ACTIVE_CHATS_MAX = int(os.getenv("ACTIVE_CHATS_MAX", "10000"))  # чатов в памяти (LRU)
+    ACTIVE_CHATS_TTL = float(os.getenv("ACTIVE_CHATS_TTL", str(30 * 24 * 3600)))  # секунд, 0 - без TTL
+    CHATS_PAGE_SIZE = int(os.getenv("CHATS_PAGE_SIZE", "100"))  # чатов на странице /chats
+    
+    # Кэш готовых клавиатур из шаблонов
+    KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "256"))
+    
+    # Массовая рассылка /api/send-batch
+    SEND_BATCH_CONCURRENCY = int(os.getenv("SEND_BATCH_CONCURRENCY", "10"))  # чатов параллельно
+    SEND_BATCH_SYNC_LIMIT = int(os.getenv("SEND_BATCH_SYNC_LIMIT", "100"))  # больше - фоновое задание
+    SEND_BATCH_MAX_JOBS = int(os.getenv("SEND_BATCH_MAX_JOBS", "100"))  # хранимых заданий
     
     # Окружение
     ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
     
+    # Логирование: запись в фоновом потоке, прореживание частых отладочных записей
+    LOG_LEVEL = "DEBUG" if os.getenv("DEBUG", "false").lower() == "true" else os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text или json
+    # Доля отладочных записей по категориям, например "app.vk_teams_bot.poll=0.01,app.webhook_handler.n8n=0.1"
+    LOG_DEBUG_SAMPLING = os.getenv("LOG_DEBUG_SAMPLING", "")
+    
     @classmethod
     def validate(cls) -> bool:
         """Проверить корректность конфигурации"""
@@ -56,15 +181,29 @@ class Config:
     def log_config(cls):
         """Вывести информацию о конфигурации"""
         logging.info("🚀 Запуск VK Teams Bot с интеграцией N8N...")
-        logging.info(f"🔗 Токен: {cls.BOT_TOKEN[:10]}...{cls.BOT_TOKEN[-4:] if len(cls.BOT_TOKEN) > 14 else 'короткий'}")
-        logging.info(f"🔗 API URL: {cls.BOT_API_URL}")
+        logging.info("🔗 Токен: %s...%s", cls.BOT_TOKEN[:10],
+                     cls.BOT_TOKEN[-4:] if len(cls.BOT_TOKEN) > 14 else 'короткий')
+        logging.info("🔗 API URL: %s", cls.BOT_API_URL)
         
         if cls.N8N_WEBHOOK_URL:
-            logging.info(f"📡 N8N Webhook: {cls.N8N_WEBHOOK_URL}")
+            logging.info("📡 N8N Webhook: %s", cls.N8N_WEBHOOK_URL)
         else:
             logging.info("📡 N8N Webhook: НЕ НАСТРОЕН")
             
-        logging.info(f"🌐 HTTP порт: {cls.SERVER_PORT}")
-        logging.info(f"🗃️ Redis: {cls.REDIS_URL}")
-        logging.info(f"🎯 Окружение: {cls.ENVIRONMENT}")
+        logging.info("🌐 HTTP порт: %s", cls.SERVER_PORT)
+        logging.info("🗃️ Redis: %s", cls.REDIS_URL)
+        logging.info("🧠 Общее состояние: %s", cls.STATE_BACKEND)
+        if cls.RUN_MODE == "multiprocess":
+            logging.info("🧵 Режим запуска: %s (%s воркеров API)", cls.RUN_MODE, cls.API_WORKERS)
+        else:
+            logging.info("🧵 Режим запуска: %s", cls.RUN_MODE)
+        logging.info("🎯 Окружение: %s", cls.ENVIRONMENT)
         logging.info("✅ Система готова к запуску")
+
+# Настройка логирования (токены и пароли маскируются в выводе)
+setup_logging(
+    level=Config.LOG_LEVEL,
+    json_format=Config.LOG_FORMAT == "json",
+    sampling=Config.LOG_DEBUG_SAMPLING,
+    secrets=[Config.BOT_TOKEN, Config.REDIS_PASSWORD]
+)
@@ -0,0 +1,182 @@
+"""
+Dead Letter Store - локальное хранилище неотправленных сообщений (SQLite)
+Сообщения, которые не удалось доставить после всех повторов, можно переотправить или удалить
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from pydantic import BaseModel, Field
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class DeadLetterReplayRequest(BaseModel):
+    """Запрос переотправки: выбранные ids или первые limit сообщений"""
+    ids: Optional[List[int]] = Field(None, max_length=1000)
+    limit: Optional[int] = Field(None, ge=1, le=1000)  # по умолчанию - число ids или 100
+
+class DeadLetterStore:
+    """SQLite хранилище dead letters; запросы к БД выполняются вне event loop"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or Config.DEAD_LETTER_DB
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                method TEXT NOT NULL,
+                chat_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+        self._replay_tasks: set = set()
+        self.replay_stats = {
+            'replays_started': 0,
+            'replayed_ok': 0,
+            'replayed_failed': 0,
+            'last_replay': None
+        }
+
+    # --- синхронные операции с БД (вызываются через asyncio.to_thread) ---
+
+    def _add(self, method: str, chat_id: str, payload: Dict[str, Any], error: str, attempts: int) -> int:
+        now = datetime.now().isoformat()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO dead_letters (created_at, updated_at, method, chat_id, payload, error, attempts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (now, now, method, chat_id, json.dumps(payload, ensure_ascii=False), error, attempts)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _list(self, limit: int, offset: int, ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        query = "SELECT id, created_at, updated_at, method, chat_id, payload, error, attempts FROM dead_letters"
+        params: List[Any] = []
+        if ids:
+            query += f" WHERE id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        query += " ORDER BY id LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {
+                "id": row[0],
+                "created_at": row[1],
+                "updated_at": row[2],
+                "method": row[3],
+                "chat_id": row[4],
+                "payload": json.loads(row[5]),
+                "error": row[6],
+                "attempts": row[7]
+            }
+            for row in rows
+        ]
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def _mark_failed(self, entry_id: int, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE dead_letters SET attempts = attempts + 1, error = ?, updated_at = ? WHERE id = ?",
+                (error, datetime.now().isoformat(), entry_id)
+            )
+            self._conn.commit()
+
+    def _delete(self, ids: Optional[List[int]] = None) -> int:
+        with self._lock:
+            if ids:
+                cursor = self._conn.execute(
+                    f"DELETE FROM dead_letters WHERE id IN ({','.join('?' * len(ids))})", ids
+                )
+            else:
+                cursor = self._conn.execute("DELETE FROM dead_letters")
+            self._conn.commit()
+            return cursor.rowcount
+
+    # --- асинхронный интерфейс ---
+
+    async def add(self, method: str, chat_id: str, payload: Dict[str, Any], error: str, attempts: int) -> int:
+        """Сохранить неотправленное сообщение, вернуть его id"""
+        entry_id = await asyncio.to_thread(self._add, method, chat_id, payload, error, attempts)
+        logger.warning("📮 Сообщение в чат %s сохранено в dead letters (id=%s): %s", chat_id, entry_id, error)
+        return entry_id
+
+    async def list(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Получить сохранённые сообщения"""
+        return await asyncio.to_thread(self._list, limit, offset)
+
+    async def count(self) -> int:
+        """Количество сохранённых сообщений"""
+        return await asyncio.to_thread(self._count)
+
+    async def purge(self, ids: Optional[List[int]] = None) -> int:
+        """Удалить выбранные (или все) сообщения, вернуть количество удалённых"""
+        deleted = await asyncio.to_thread(self._delete, ids)
+        logger.info("🧹 Удалено dead letters: %s", deleted)
+        return deleted
+
+    def start_replay(self, send_func: Callable[[Dict[str, Any]], Awaitable[bool]],
+                     ids: Optional[List[int]] = None, limit: int = 100):
+        """Запустить переотправку в фоне, не блокируя обработку запросов"""
+        self.replay_stats['replays_started'] += 1
+        task = asyncio.create_task(self._replay(send_func, ids, limit))
+        self._replay_tasks.add(task)
+        task.add_done_callback(self._replay_tasks.discard)
+
+    async def _replay(self, send_func: Callable[[Dict[str, Any]], Awaitable[bool]],
+                      ids: Optional[List[int]], limit: int):
+        """
+        Переотправить сообщения через обычный конвейер отправки.
+        Параллельность ограничена DEAD_LETTER_REPLAY_CONCURRENCY, чтобы не вытеснять живой трафик
+        """
+        entries = await asyncio.to_thread(self._list, limit, 0, ids)
+        semaphore = asyncio.Semaphore(Config.DEAD_LETTER_REPLAY_CONCURRENCY)
+        logger.info("🔁 Переотправка dead letters: %s", len(entries))
+
+        async def replay_one(entry: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    success = await send_func(entry)
+                except Exception as e:
+                    logger.error("❌ Ошибка переотправки dead letter %s: %s", entry['id'], e)
+                    success = False
+                if success:
+                    await asyncio.to_thread(self._delete, [entry['id']])
+                    self.replay_stats['replayed_ok'] += 1
+                else:
+                    await asyncio.to_thread(self._mark_failed, entry['id'], "replay failed")
+                    self.replay_stats['replayed_failed'] += 1
+
+        await asyncio.gather(*(replay_one(entry) for entry in entries))
+        self.replay_stats['last_replay'] = datetime.now().isoformat()
+
+    @property
+    def replay_in_progress(self) -> bool:
+        return bool(self._replay_tasks)
+
+    def close(self):
+        """Закрыть соединение с БД"""
+        with self._lock:
+            self._conn.close()
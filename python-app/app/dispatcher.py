@@ -0,0 +1,162 @@
+"""
+Event Dispatcher - параллельная обработка событий разных чатов
+События шардируются по chatId: внутри чата порядок сохраняется, чаты обрабатываются параллельно
+"""
+import asyncio
+import logging
+import time
+import zlib
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+from .config import Config
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[..., Awaitable[Any]]
+
+def event_chat_id(event: Dict[str, Any]) -> str:
+    """chatId события (у callbackQuery он внутри message)"""
+    payload = event.get('payload', {})
+    chat = payload.get('chat') or payload.get('message', {}).get('chat', {})
+    return chat.get('chatId', '')
+
+class _Shard:
+    __slots__ = ('index', 'queue', 'in_flight', 'task', 'processed', 'errors', 'max_lag', 'last_lag', 'busy_since')
+
+    def __init__(self, index: int, maxsize: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # eventId в порядке поступления: голова - самое старое необработанное событие шарда
+        self.in_flight: Deque[int] = deque()
+        self.task: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.errors = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.busy_since = 0.0
+
+class EventDispatcher:
+    """Пул из DISPATCH_WORKERS шардов с ограниченной очередью у каждого"""
+
+    def __init__(self, handler: EventHandler, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        self.handler = handler
+        self.workers = workers if workers is not None else Config.DISPATCH_WORKERS
+        self.queue_size = queue_size if queue_size is not None else Config.DISPATCH_SHARD_QUEUE_SIZE
+        self.shards: List[_Shard] = [_Shard(index, self.queue_size) for index in range(max(1, self.workers))]
+        self.last_submitted_id = 0
+        self.submit_waits = 0  # сколько раз polling loop ждал места в очереди шарда
+        REGISTRY.gauge("vk_dispatch_queue_depth", "Events waiting in dispatcher shard queues",
+                       lambda: sum(shard.queue.qsize() for shard in self.shards))
+        REGISTRY.gauge("vk_dispatch_max_lag_seconds", "Age of the oldest event waiting in any shard",
+                       lambda: max(self._shard_lag(shard) for shard in self.shards))
+
+    async def start(self):
+        for shard in self.shards:
+            if shard.task is None or shard.task.done():
+                shard.task = asyncio.create_task(self._worker(shard))
+        logger.info("🧵 Диспетчер событий: %s шардов, очередь %s на шард", len(self.shards), self.queue_size)
+
+    async def submit(self, event: Dict[str, Any], *args):
+        """
+        Поставить событие в очередь шарда его чата. Если очередь полна - ждём:
+        polling loop притормаживает вместо потери событий
+        """
+        shard = self.shards[zlib.crc32(event_chat_id(event).encode('utf-8')) % len(self.shards)]
+        event_id = event.get('eventId', 0)
+        item = (time.monotonic(), event, args)
+        if shard.queue.full():
+            self.submit_waits += 1
+        shard.in_flight.append(event_id)
+        try:
+            await shard.queue.put(item)
+        except asyncio.CancelledError:
+            # Событие так и не попало в очередь (остановка при полной очереди): его id не должен держать чекпоинт
+            shard.in_flight.remove(event_id)
+            raise
+        if event_id > self.last_submitted_id:
+            self.last_submitted_id = event_id
+
+    async def _worker(self, shard: _Shard):
+        while True:
+            enqueued_at, event, args = await shard.queue.get()
+            shard.busy_since = time.monotonic()
+            shard.last_lag = shard.busy_since - enqueued_at
+            if shard.last_lag > shard.max_lag:
+                shard.max_lag = shard.last_lag
+            try:
+                await self.handler(event, *args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                shard.errors += 1
+                logger.error("❌ Ошибка обработки события в шарде %s: %s", shard.index, e)
+            finally:
+                shard.busy_since = 0.0
+                shard.processed += 1
+                if shard.in_flight:
+                    shard.in_flight.popleft()
+                shard.queue.task_done()
+
+    def safe_event_id(self, last_event_id: int) -> int:
+        """
+        Позиция для чекпоинта: все события до неё обработаны.
+        Пока в каком-то шарде есть необработанное событие, чекпоинт не уходит дальше него
+        """
+        pending = [shard.in_flight[0] for shard in self.shards if shard.in_flight and shard.in_flight[0]]
+        if pending:
+            return min(pending) - 1
+        return last_event_id
+
+    async def close(self, timeout: Optional[float] = None):
+        """Дообработать очереди (не дольше timeout) и остановить воркеры"""
+        timeout = Config.DISPATCH_DRAIN_TIMEOUT if timeout is None else timeout
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.queue.join() for shard in self.shards)), timeout
+            )
+        except asyncio.TimeoutError:
+            left = sum(shard.queue.qsize() for shard in self.shards)
+            logger.warning("⚠️ Диспетчер остановлен, не обработано событий: %s (будут получены повторно)", left)
+        for shard in self.shards:
+            if shard.task:
+                shard.task.cancel()
+        await asyncio.gather(*(shard.task for shard in self.shards if shard.task), return_exceptions=True)
+        for shard in self.shards:
+            shard.task = None
+
+    @staticmethod
+    def _shard_lag(shard: _Shard) -> float:
+        """Сколько ждёт самое старое событие шарда (включая обрабатываемое сейчас)"""
+        now = time.monotonic()
+        if shard.busy_since:
+            return now - shard.busy_since + shard.last_lag
+        if not shard.queue.empty():
+            return now - shard.queue._queue[0][0]
+        return 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Нагрузка по шардам; hot_chats - чаты с наибольшим числом ждущих событий"""
+        shards = []
+        for shard in self.shards:
+            waiting: List[Tuple[float, Dict[str, Any], tuple]] = list(shard.queue._queue)
+            hot = Counter(event_chat_id(event) for _, event, _ in waiting).most_common(3)
+            shards.append({
+                "shard": shard.index,
+                "queue_depth": len(waiting),
+                "lag_ms": round(self._shard_lag(shard) * 1000, 1),
+                "last_lag_ms": round(shard.last_lag * 1000, 1),
+                "max_lag_ms": round(shard.max_lag * 1000, 1),
+                "processed": shard.processed,
+                "errors": shard.errors,
+                "hot_chats": [{"chat_id": chat_id, "waiting": count} for chat_id, count in hot]
+            })
+        return {
+            "workers": len(self.shards),
+            "shard_queue_size": self.queue_size,
+            "submit_waits": self.submit_waits,
+            "shards": shards,
+            "timestamp": datetime.now().isoformat()
+        }
@@ -0,0 +1,158 @@
+"""
+Event Bus - поток изменений для дашбордов и помощников N8N (/api/events, SSE)
+Бот публикует события по мере изменений: новый чат, новое сообщение в чате (со счётчиком),
+результат отправки в VK Teams и результат пересылки в N8N. Без подписчиков публикация ничего не стоит.
+У каждого подписчика свой фильтр и ограниченный буфер: медленный подписчик теряет самые старые
+события (и узнаёт, сколько потерял), остальных он не задерживает
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Callable, Deque, Iterable, List, Optional, Tuple
+
+from .config import Config
+from .metrics import EVENT_STREAM_DROPPED
+
+EVENT_TYPES = ("chat_new", "chat_message", "send", "n8n_forward")
+
+class EventBusFullError(Exception):
+    """Достигнут предел EVENT_STREAM_MAX_SUBSCRIBERS"""
+
+class Subscription:
+    """Буфер событий одного подписчика с фильтром по типам и чатам (None - без фильтра)"""
+    __slots__ = ('subscription_id', 'types', 'chat_ids', '_buffer', '_ready', 'pending_dropped',
+                 'dropped', 'delivered', 'created_at')
+
+    def __init__(self, subscription_id: int, types: Optional[Iterable[str]], chat_ids: Optional[Iterable[str]],
+                 buffer_size: int):
+        self.subscription_id = subscription_id
+        self.types = frozenset(types) if types else None
+        self.chat_ids = frozenset(chat_ids) if chat_ids else None
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=max(1, buffer_size))
+        self._ready = asyncio.Event()
+        self.pending_dropped = 0  # потеряно с последнего get()
+        self.dropped = 0
+        self.delivered = 0
+        self.created_at = time.time()
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.types is not None and event['type'] not in self.types:
+            return False
+        if self.chat_ids is not None:
+            data = event['data']
+            if data.get('chat_id') not in self.chat_ids and self.chat_ids.isdisjoint(data.get('chat_ids', ())):
+                return False
+        return True
+
+    def put(self, event: Dict[str, Any]):
+        """Добавить событие; при полном буфере вытесняется самое старое"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.lose(1)
+        self._buffer.append(event)
+        self._ready.set()
+
+    def lose(self, count: int):
+        """Учесть потерянные события (переполнение буфера здесь или выше по цепочке)"""
+        self.pending_dropped += count
+        self.dropped += count
+        EVENT_STREAM_DROPPED.inc(count)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Tuple[List[Dict[str, Any]], int]:
+        """Накопленные события и число потерянных с прошлого вызова; ([], 0) - за timeout ничего не случилось"""
+        if not self._buffer and not self.pending_dropped:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        events = list(self._buffer)
+        self._buffer.clear()
+        dropped, self.pending_dropped = self.pending_dropped, 0
+        self.delivered += len(events)
+        return events, dropped
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "id": self.subscription_id,
+            "types": sorted(self.types) if self.types else None,
+            "chat_ids": len(self.chat_ids) if self.chat_ids else None,
+            "buffered": len(self._buffer),
+            "buffer_size": self._buffer.maxlen,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "connected_at": datetime.fromtimestamp(self.created_at).isoformat()
+        }
+
+class EventBus:
+    """Раздача событий подписчикам; seq - сквозной номер события в потоке"""
+
+    def __init__(self, max_subscribers: Optional[int] = None):
+        self.max_subscribers = max_subscribers if max_subscribers is not None else Config.EVENT_STREAM_MAX_SUBSCRIBERS
+        self._subscribers: Dict[int, Subscription] = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count(1)
+        # Вызывается при появлении первого и уходе последнего подписчика (режим multiprocess)
+        self.on_activity: Optional[Callable[[bool], None]] = None
+        self.stats = {'published': 0, 'subscriptions': 0}
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, event_type: str, **data):
+        """Опубликовать событие; без подписчиков - ничего не делает"""
+        if not self._subscribers:
+            return
+        self.deliver({"seq": next(self._seq), "type": event_type, "ts": round(time.time(), 3), "data": data})
+
+    def deliver(self, event: Dict[str, Any]):
+        """Раздать готовое событие (в том числе полученное от hub) подходящим подписчикам"""
+        self.stats['published'] += 1
+        for subscription in self._subscribers.values():
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def lose(self, count: int):
+        """События потеряны до этой шины (буфер hub для воркера переполнен) - сообщить всем подписчикам"""
+        for subscription in self._subscribers.values():
+            subscription.lose(count)
+
+    def subscribe(self, types: Optional[Iterable[str]] = None, chat_ids: Optional[Iterable[str]] = None,
+                  buffer_size: Optional[int] = None) -> Subscription:
+        if len(self._subscribers) >= self.max_subscribers:
+            raise EventBusFullError(f"Too many event stream subscribers (max {self.max_subscribers})")
+        subscription = Subscription(
+            next(self._ids), types, chat_ids,
+            buffer_size if buffer_size is not None else Config.EVENT_STREAM_BUFFER
+        )
+        self._subscribers[subscription.subscription_id] = subscription
+        self.stats['subscriptions'] += 1
+        if len(self._subscribers) == 1 and self.on_activity:
+            self.on_activity(True)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if self._subscribers.pop(subscription.subscription_id, None) is None:
+            return
+        if not self._subscribers and self.on_activity:
+            self.on_activity(False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": [subscription.get_stats() for subscription in self._subscribers.values()],
+            "max_subscribers": self.max_subscribers,
+            **self.stats,
+            "timestamp": datetime.now().isoformat()
+        }
+
+def format_sse(event_type: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """Кадр text/event-stream"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
@@ -0,0 +1,550 @@
+"""
+IPC - обмен между процессом long polling (hub) и процессами API (workers)
+Unix socket, кадры: 4 байта длины (big-endian) + компактный JSON
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from .batch_sender import BatchSender, BatchSendItem
+from .config import Config
+from .event_bus import Subscription
+from .keyboards import KeyboardTemplateError, KeyboardTemplateRef
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """Кадр: длина + JSON без пробелов"""
+    body = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _HEADER.pack(len(body)) + body
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Прочитать кадр; None - соединение закрыто"""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        (length,) = _HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"IPC frame too large: {length}")
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+def merge_counters(sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сложить счётчики нескольких процессов; для меток времени берётся самая поздняя"""
+    merged: Dict[str, Any] = {}
+    for source in sources:
+        for key, value in source.items():
+            if isinstance(value, (int, float)):
+                merged[key] = merged.get(key, 0) + value
+            elif value is not None:
+                merged[key] = max(merged.get(key) or value, value)
+            else:
+                merged.setdefault(key, None)
+    return merged
+
+class HubServer:
+    """
+    Сторона процесса long polling: раздаёт события воркерам (чат всегда попадает
+    в один и тот же воркер, порядок сообщений чата сохраняется) и выполняет
+    их исходящие отправки через общий пул соединений и лимитер.
+    Событие считается обработанным после подтверждения (ack) воркера; события
+    отключившегося воркера передаются повторно (доставка "хотя бы один раз").
+    Общее для воркеров состояние API (шаблоны клавиатур, фоновые рассылки,
+    счётчики N8N) тоже хранится здесь
+    """
+
+    def __init__(self, bot, socket_path: Optional[str] = None):
+        self.bot = bot
+        self.socket_path = socket_path or Config.IPC_SOCKET_PATH
+        self.workers: Dict[int, asyncio.StreamWriter] = {}
+        self._handlers = set()
+        self._requests: set = set()  # выполняющиеся запросы воркеров
+        # Переданные воркерам и не подтверждённые события: delivery_id -> (соединение, событие, local_action)
+        self._unacked: "OrderedDict[int, Tuple[asyncio.StreamWriter, Dict[str, Any], Optional[Dict[str, Any]]]]" = OrderedDict()
+        # Доставки, которые сейчас передаёт dispatch_event: их не забирает повторная передача
+        self._dispatching: set = set()
+        self._redeliveries: set = set()  # задачи повторной передачи (ждут подключения воркера)
+        self._unacked_slots = asyncio.Semaphore(Config.IPC_MAX_UNACKED)
+        self._delivery_ids = itertools.count(1)
+        self.batch_sender = BatchSender(bot)
+        # Последние счётчики N8N каждого воркера
+        self.worker_n8n_stats: Dict[int, Dict[str, Any]] = {}
+        self._connected = asyncio.Event()
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Воркеры с подписчиками /api/events: подписка на шину hub и задача пересылки
+        self._event_pumps: Dict[asyncio.StreamWriter, Tuple[Subscription, asyncio.Task]] = {}
+        bot.events.on_activity = self._broadcast_events_state
+        self.stats = {
+            'events_dispatched': 0,
+            'events_acked': 0,
+            'events_redelivered': 0,
+            'sends_proxied': 0,
+            'worker_connects': 0
+        }
+
+    async def start(self):
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_worker, path=self.socket_path)
+        logger.info("🔌 IPC hub слушает %s", self.socket_path)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._event_pumps):
+            self._stop_event_pump(writer)
+        for writer in list(self.workers.values()):
+            writer.close()
+        # Обработчики соединений завершатся сами, получив конец потока
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        # Повторной передаче некого ждать: неподтверждённые события снова придут после рестарта (чекпоинт их не прошёл)
+        for task in self._redeliveries:
+            task.cancel()
+        await asyncio.gather(*self._requests, *self._redeliveries, return_exceptions=True)
+        self.workers.clear()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            await self._serve_worker(reader, writer)
+        finally:
+            self._handlers.discard(task)
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_frame(reader)
+        if not hello or hello.get('op') != 'hello':
+            writer.close()
+            return
+        worker_id = int(hello.get('worker', 0))
+        self.workers[worker_id] = writer
+        self._connected.set()
+        self.stats['worker_connects'] += 1
+        logger.info("🔌 Воркер %s подключился к hub", worker_id)
+        writer.write(encode_frame({'op': 'events_state', 'active': self.bot.events.active}))
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                if message.get('op') == 'ack':
+                    self._ack(message.get('delivery_id'))
+                    continue
+                # Каждый запрос - отдельная задача: долгая отправка не задерживает остальные
+                task = asyncio.create_task(self._handle_request(writer, message))
+                self._requests.add(task)
+                task.add_done_callback(self._requests.discard)
+        except (ConnectionError, ValueError) as e:
+            logger.error("❌ Ошибка IPC с воркером %s: %s", worker_id, e)
+        finally:
+            if self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+            if not self.workers:
+                self._connected.clear()
+            self._stop_event_pump(writer)
+            writer.close()
+            logger.warning("⚠️ Воркер %s отключился от hub", worker_id)
+            self._redeliver(worker_id, writer)
+
+    async def _handle_request(self, writer: asyncio.StreamWriter, message: Dict[str, Any]):
+        op = message.get('op')
+        try:
+            if op == 'send':
+                self.stats['sends_proxied'] += 1
+                result = await self.bot.send_text(
+                    message['chat_id'], message['text'], message.get('keyboard'),
+                    dead_letter=message.get('dead_letter', True), slot=message.get('slot'),
+                    edit_in_place=message.get('edit_in_place', False), msg_id=message.get('msg_id')
+                )
+            elif op == 'chat_count':
+                result = await self.bot.state.chat_count()
+            elif op == 'has_chat':
+                result = await self.bot.state.has_chat(message['chat_id'])
+            elif op == 'chats_page':
+                result = list(await self.bot.state.chats_page(message.get('cursor', '0'), message.get('limit', 100)))
+            elif op == 'stats':
+                result = self.get_stats()
+            elif op == 'callback_answer':
+                result = self.bot.callback_answers.resolve(
+                    message['query_id'], message.get('text', ''), message.get('show_alert', False), message.get('url')
+                )
+            elif op == 'trace':
+                result = self.bot.traces.mark(message.get('trace_id'), message['stage'], message.get('at'))
+            elif op == 'traces':
+                result = await self.bot.slow_traces(message.get('limit', 20))
+            elif op == 'publish':
+                result = self.bot.events.publish(message['event_type'], **message.get('data', {}))
+            elif op == 'events_subscribe':
+                result = self._start_event_pump(writer)
+            elif op == 'events_unsubscribe':
+                result = self._stop_event_pump(writer)
+            elif op == 'status_cache':
+                action = message.get('action')
+                if action == 'store':
+                    result = self.bot.status_cache.store(message['audience'], message['text'], message.get('keyboard'))
+                elif action == 'invalidate':
+                    result = self.bot.status_cache.invalidate(message.get('audience'))
+                else:
+                    result = self.bot.status_cache.get_stats()
+            elif op == 'keyboards':
+                action = message.get('action')
+                if action == 'put':
+                    result = self.bot.keyboards.put_template(message['template_id'], message['version'], message['markup'])
+                elif action == 'render':
+                    try:
+                        result = {'keyboard': self.bot.keyboards.render(KeyboardTemplateRef(**message['ref']))}
+                    except KeyboardTemplateError as e:
+                        result = {'error': str(e)}
+                else:
+                    result = self.bot.keyboards.get_stats()
+            elif op == 'batch_job':
+                if message.get('action') == 'submit':
+                    result = await self.batch_sender.submit_job([BatchSendItem(**item) for item in message['items']])
+                else:
+                    result = await self.batch_sender.get_job(message['job_id'])
+            elif op == 'n8n_stats':
+                self.worker_n8n_stats[int(message['worker'])] = message['stats']
+                result = {
+                    "stats": merge_counters(list(self.worker_n8n_stats.values())),
+                    "workers": {str(worker_id): stats for worker_id, stats in sorted(self.worker_n8n_stats.items())}
+                }
+            elif op == 'metrics':
+                result = REGISTRY.collect()
+            elif op == 'stands':
+                result = self.bot.stands.get_state() if self.bot.stands else None
+            else:
+                raise ValueError(f"Unknown IPC op: {op}")
+            reply = {'op': 'result', 'id': message.get('id'), 'result': result}
+        except Exception as e:
+            reply = {'op': 'result', 'id': message.get('id'), 'error': str(e)}
+        if message.get('id') is None:
+            # Уведомление (notify): ответ не ждут, ошибку видно только в логе
+            if 'error' in reply:
+                logger.error("❌ Ошибка IPC уведомления %s: %s", op, reply['error'])
+            return
+        try:
+            writer.write(encode_frame(reply))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _start_event_pump(self, writer: asyncio.StreamWriter):
+        """Подписать воркер на шину событий hub (без фильтра: фильтруют подписчики воркера)"""
+        if writer not in self._event_pumps:
+            subscription = self.bot.events.subscribe()
+            self._event_pumps[writer] = (subscription, asyncio.create_task(self._pump_events(writer, subscription)))
+
+    def _stop_event_pump(self, writer: asyncio.StreamWriter):
+        pump = self._event_pumps.pop(writer, None)
+        if pump:
+            subscription, task = pump
+            task.cancel()
+            self.bot.events.unsubscribe(subscription)
+
+    async def _pump_events(self, writer: asyncio.StreamWriter, subscription: Subscription):
+        """Пересылать накопленные события воркеру пачками; потери буфера передаются числом"""
+        try:
+            while True:
+                events, dropped = await subscription.get(Config.EVENT_STREAM_HEARTBEAT)
+                if events or dropped:
+                    writer.write(encode_frame({'op': 'events', 'events': events, 'dropped': dropped}))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _broadcast_events_state(self, active: bool):
+        """Воркеры публикуют свои события в hub, только пока на шину кто-то подписан"""
+        frame = encode_frame({'op': 'events_state', 'active': active})
+        for writer in self.workers.values():
+            writer.write(frame)
+
+    async def dispatch_event(self, event: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None,
+                             delivery_id: Optional[int] = None):
+        """
+        Передать событие воркеру, который обслуживает его чат. Если неподтверждённых
+        событий IPC_MAX_UNACKED, ждём подтверждений (long polling притормаживает)
+        """
+        if delivery_id is None:
+            await self._unacked_slots.acquire()
+            delivery_id = next(self._delivery_ids)
+        self._dispatching.add(delivery_id)
+        try:
+            await self._deliver(delivery_id, event, local_action)
+        finally:
+            self._dispatching.discard(delivery_id)
+
+    async def _deliver(self, delivery_id: int, event: Dict[str, Any], local_action: Optional[Dict[str, Any]]):
+        payload = event.get('payload', {})
+        chat_id = payload.get('chat', payload.get('message', {}).get('chat', {})).get('chatId', '')
+        frame = encode_frame({'op': 'event', 'event': event, 'local_action': local_action, 'delivery_id': delivery_id})
+        while True:
+            # Пока нет ни одного воркера, событие ждёт (и lastEventId не сдвигается)
+            await self._connected.wait()
+            worker_id = zlib.crc32(chat_id.encode('utf-8')) % Config.API_WORKERS
+            if worker_id not in self.workers:
+                worker_id = next(iter(self.workers), None)
+            writer = self.workers.get(worker_id)
+            if writer is None:
+                continue
+            # Запоминаем до записи: подтверждение может прийти раньше, чем завершится drain
+            self._unacked[delivery_id] = (writer, event, local_action)
+            try:
+                writer.write(frame)
+                await writer.drain()
+            except ConnectionError:
+                await asyncio.sleep(0.1)
+                continue
+            if writer.is_closing():
+                # Соединение закрылось во время записи, а его повторная передача эту доставку пропустила
+                await asyncio.sleep(0.1)
+                continue
+            self.stats['events_dispatched'] += 1
+            return
+
+    def _ack(self, delivery_id: Optional[int]):
+        if self._unacked.pop(delivery_id, None) is not None:
+            self._unacked_slots.release()
+            self.stats['events_acked'] += 1
+
+    def _redeliver(self, worker_id: int, writer: asyncio.StreamWriter):
+        """
+        Повторно передать события, которые не подтвердило закрытое соединение воркера.
+        События, уже переданные новому соединению того же воркера или передаваемые
+        dispatch_event прямо сейчас, не трогаем - иначе их обработают дважды
+        """
+        lost = [(delivery_id, event, local_action)
+                for delivery_id, (owner, event, local_action) in self._unacked.items()
+                if owner is writer and delivery_id not in self._dispatching]
+        if not lost:
+            return
+        self._dispatching.update(delivery_id for delivery_id, _, _ in lost)
+        logger.warning("🔁 Повторная передача %s неподтверждённых событий воркера %s", len(lost), worker_id)
+        self.stats['events_redelivered'] += len(lost)
+        task = asyncio.create_task(self._redeliver_events(lost))
+        self._redeliveries.add(task)
+        task.add_done_callback(self._redeliveries.discard)
+
+    async def _redeliver_events(self, lost: List[Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]]):
+        for delivery_id, event, local_action in lost:
+            if delivery_id in self._unacked:
+                await self.dispatch_event(event, local_action, delivery_id)
+            else:
+                self._dispatching.discard(delivery_id)
+
+    def oldest_unacked_event_id(self) -> Optional[int]:
+        """Самый ранний eventId, обработку которого воркер не подтвердил (граница чекпоинта)"""
+        return min((event.get('eventId', 0) for _, event, _ in self._unacked.values()), default=None) or None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers_connected": sorted(self.workers),
+            "events_unacked": len(self._unacked),
+            **self.stats,
+            "polling": self.bot.get_polling_stats(),
+            "rate_limiter": self.bot.rate_limiter.get_stats()
+        }
+
+class HubClient:
+    """Сторона воркера: принимает события от hub и проксирует запросы к нему"""
+
+    def __init__(self, worker_id: int, socket_path: Optional[str] = None):
+        self.worker_id = worker_id
+        self.socket_path = socket_path or Config.IPC_SOCKET_PATH
+        self.bot = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._tasks = []
+        self._connected = asyncio.Event()
+        # На шину событий hub подписан хотя бы один воркер - свои события нужно отправлять в hub
+        self.events_active = False
+        self.stats = {'events_received': 0, 'reconnects': 0, 'notifications_dropped': 0}
+
+    def attach(self, bot):
+        self.bot = bot
+        bot.events.on_activity = self._on_events_activity
+
+    def _on_events_activity(self, active: bool):
+        """Первый подписчик /api/events в воркере подписывает его на шину hub, последний - отписывает"""
+        self.notify('events_subscribe' if active else 'events_unsubscribe')
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._connection_loop()),
+            asyncio.create_task(self._event_loop()),
+            asyncio.create_task(self._report_loop())
+        ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer:
+            self._writer.close()
+
+    async def _connection_loop(self):
+        """Подключаться к hub и читать кадры; при обрыве переподключаться"""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except (FileNotFoundError, ConnectionError):
+                await asyncio.sleep(0.5)
+                continue
+            writer.write(encode_frame({'op': 'hello', 'worker': self.worker_id}))
+            await writer.drain()
+            self._writer = writer
+            self._connected.set()
+            logger.info("🔌 Воркер %s подключён к hub", self.worker_id)
+            if self.bot and self.bot.events.active:
+                self.notify('events_subscribe')
+            try:
+                while True:
+                    message = await read_frame(reader)
+                    if message is None:
+                        break
+                    if message.get('op') == 'event':
+                        event = message['event']
+                        event['deliveryId'] = message.get('delivery_id')
+                        self._events.put_nowait((event, message.get('local_action')))
+                    elif message.get('op') == 'events':
+                        if message.get('dropped'):
+                            self.bot.events.lose(message['dropped'])
+                        for event in message['events']:
+                            self.bot.events.deliver(event)
+                    elif message.get('op') == 'events_state':
+                        self.events_active = bool(message.get('active'))
+                    elif message.get('op') == 'result':
+                        future = self._pending.pop(message.get('id'), None)
+                        if future and not future.done():
+                            if 'error' in message:
+                                future.set_exception(RuntimeError(message['error']))
+                            else:
+                                future.set_result(message.get('result'))
+            except (ConnectionError, ValueError) as e:
+                logger.error("❌ Ошибка IPC с hub: %s", e)
+            self._connected.clear()
+            self._writer = None
+            self.events_active = False
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("IPC hub disconnected"))
+            self._pending.clear()
+            self.stats['reconnects'] += 1
+            logger.warning("⚠️ Воркер %s потерял связь с hub, переподключаемся", self.worker_id)
+            await asyncio.sleep(0.5)
+
+    async def _event_loop(self):
+        """События передаются в диспетчер бота (порядок внутри чата сохраняется)"""
+        while True:
+            event, local_action = await self._events.get()
+            self.stats['events_received'] += 1
+            await self.bot.dispatch(event, local_action)
+
+    async def _report_loop(self):
+        """Периодически отдавать hub свои счётчики N8N, чтобы любой воркер показывал общие"""
+        while True:
+            await asyncio.sleep(Config.IPC_STATS_INTERVAL)
+            if self.bot and self.bot.webhook_handler:
+                self.notify('n8n_stats', worker=self.worker_id, stats=self.bot.webhook_handler.stats)
+
+    async def n8n_stats(self, stats: Dict[str, Any]) -> Dict[str, Any]:
+        """Передать свежие счётчики N8N этого воркера и получить сумму по всем воркерам"""
+        return await self.request('n8n_stats', worker=self.worker_id, stats=stats)
+
+    async def request(self, op: str, **params) -> Any:
+        """Запрос к hub с ожиданием ответа"""
+        await asyncio.wait_for(self._connected.wait(), Config.IPC_REQUEST_TIMEOUT)
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode_frame({'op': op, 'id': request_id, **params}))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, Config.IPC_REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def ack(self, event: Dict[str, Any]):
+        """Подтвердить hub обработку события (без связи подтверждение теряется - hub передаст событие повторно)"""
+        delivery_id = event.get('deliveryId')
+        if delivery_id is not None:
+            self.notify('ack', delivery_id=delivery_id)
+
+    def notify(self, op: str, **params):
+        """Сообщение hub без ответа; без связи с hub теряется"""
+        if not self._connected.is_set() or self._writer is None:
+            self.stats['notifications_dropped'] += 1
+            return
+        self._writer.write(encode_frame({'op': op, **params}))
+
+    async def send_text(self, chat_id: str, text: str, keyboard_json: Optional[str], dead_letter: bool,
+                        slot: Optional[str] = None, edit_in_place: bool = False, msg_id: Optional[str] = None) -> bool:
+        """sendText/editText через hub (общий пул соединений, лимитер, слоты сообщений и dead letters)"""
+        try:
+            return bool(await self.request(
+                'send', chat_id=chat_id, text=text, keyboard=keyboard_json, dead_letter=dead_letter,
+                slot=slot, edit_in_place=edit_in_place, msg_id=msg_id
+            ))
+        except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+            logger.error("❌ Не удалось отправить сообщение через hub: %r", e)
+            return False
+
+class HubStateBackend:
+    """Состояние чатов воркера читается из hub: он видит все события"""
+
+    requires_election = False
+    is_leader = False
+
+    def __init__(self, client: HubClient):
+        self.client = client
+
+    def attach(self, chats, counters, offset_getter):
+        pass
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def load_offset(self) -> int:
+        return 0
+
+    async def chat_count(self) -> int:
+        return await self.client.request('chat_count')
+
+    async def has_chat(self, chat_id: str) -> bool:
+        return await self.client.request('has_chat', chat_id=chat_id)
+
+    async def chats_page(self, cursor: str, limit: int) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+        chats, next_cursor = await self.client.request('chats_page', cursor=cursor, limit=limit)
+        return chats, next_cursor
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "hub",
+            "worker_id": self.client.worker_id,
+            "worker": dict(self.client.stats),
+            "hub": await self.client.request('stats'),
+            "timestamp": datetime.now().isoformat()
+        }
@@ -0,0 +1,106 @@
+"""
+Keyboards - сериализация inline клавиатур и кэш шаблонов клавиатур
+Клавиатура сериализуется в строку inlineKeyboardMarkup ровно один раз
+"""
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+KeyboardMarkup = Union[str, Dict[str, Any], List[Any]]
+
+class KeyboardTemplateRef(BaseModel):
+    """Ссылка на шаблон клавиатуры с опциональными правками кнопок"""
+    id: str
+    version: Optional[int] = None
+    # Правки по callbackData: {"stand:s1": {"text": "🟡 s1"}}
+    diff: Optional[Dict[str, Dict[str, Any]]] = None
+
+class KeyboardTemplate(BaseModel):
+    """Шаблон клавиатуры, который N8N регистрирует один раз"""
+    version: int
+    inline_keyboard_markup: Dict[str, Any]
+
+class KeyboardTemplateError(Exception):
+    """Шаблон не найден или его версия устарела"""
+
+def serialize_keyboard(markup: Optional[KeyboardMarkup]) -> Optional[str]:
+    """
+    Привести клавиатуру к строке для поля inlineKeyboardMarkup.
+    Объект {"inlineKeyboard": [...]} или массив рядов сериализуется один раз;
+    строка считается уже готовым значением (старый формат с объектом в JSON тоже поддерживается)
+    """
+    if not markup:
+        return None
+    if isinstance(markup, str):
+        if not markup.lstrip().startswith('{'):
+            return markup
+        markup = json.loads(markup)
+    rows = markup.get('inlineKeyboard') if isinstance(markup, dict) else markup
+    if rows is None:
+        return None
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':'))
+
+def apply_diff(rows: List[List[Dict[str, Any]]], diff: Dict[str, Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Применить правки к кнопкам шаблона, не изменяя сам шаблон"""
+    return [
+        [{**button, **diff[button.get('callbackData')]} if button.get('callbackData') in diff else button for button in row]
+        for row in rows
+    ]
+
+class KeyboardTemplateCache:
+    """Шаблоны клавиатур и LRU кэш готовых строк inlineKeyboardMarkup"""
+
+    def __init__(self):
+        self.templates: Dict[str, Tuple[int, List[List[Dict[str, Any]]]]] = {}
+        self.rendered: "OrderedDict[Tuple[str, int, Optional[str]], str]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def put_template(self, template_id: str, version: int, markup: Dict[str, Any]):
+        """Зарегистрировать (или обновить) шаблон"""
+        rows = markup.get('inlineKeyboard', [])
+        self.templates[template_id] = (version, rows)
+        # Готовые строки старых версий больше не нужны
+        for key in [key for key in self.rendered if key[0] == template_id and key[1] != version]:
+            del self.rendered[key]
+        logger.info("🧩 Шаблон клавиатуры %s v%s: %s рядов", template_id, version, len(rows))
+
+    def render(self, ref: KeyboardTemplateRef) -> str:
+        """Готовая строка inlineKeyboardMarkup по ссылке на шаблон"""
+        template = self.templates.get(ref.id)
+        if not template:
+            raise KeyboardTemplateError(f"Keyboard template '{ref.id}' not found")
+        version, rows = template
+        if ref.version is not None and ref.version != version:
+            raise KeyboardTemplateError(f"Keyboard template '{ref.id}' version {ref.version} != {version}")
+
+        diff_key = json.dumps(ref.diff, sort_keys=True, ensure_ascii=False) if ref.diff else None
+        key = (ref.id, version, diff_key)
+        cached = self.rendered.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            self.rendered.move_to_end(key)
+            return cached
+
+        self.stats['misses'] += 1
+        keyboard_json = serialize_keyboard(apply_diff(rows, ref.diff) if ref.diff else rows)
+        self.rendered[key] = keyboard_json
+        if len(self.rendered) > Config.KEYBOARD_CACHE_SIZE:
+            self.rendered.popitem(last=False)
+        return keyboard_json
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние кэша шаблонов"""
+        return {
+            "templates": {template_id: version for template_id, (version, _) in self.templates.items()},
+            "rendered_cached": len(self.rendered),
+            **self.stats,
+            "timestamp": datetime.now().isoformat()
+        }
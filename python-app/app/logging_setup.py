@@ -0,0 +1,152 @@
+"""
+Logging Setup - асинхронный вывод логов
+Логгеры кладут записи в очередь (QueueHandler), форматирование, маскирование токенов
+и запись в stderr выполняет фоновый поток (QueueListener). Частые отладочные записи
+отдельных категорий можно прореживать (LOG_DEBUG_SAMPLING)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# token=... в URL и form data, "token": "..." в JSON и repr словарей
+_TOKEN_PATTERNS = [
+    re.compile(r'(token=)[^&\s\'"]+'),
+    re.compile(r'([\'"]token[\'"]\s*:\s*[\'"])[^\'"]+'),
+]
+
+# uvicorn запускается с log_level=None: его логгеры наследуют уровень корневого (LOG_LEVEL)
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "uvicorn.asgi")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Запись уходит в очередь без форматирования: сообщение с аргументами собирается
+    в фоновом потоке. Поэтому аргументы логов не должны меняться после вызова
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую N-ю отладочную запись категории (логгера и его дочерних)"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Категория -> шаг прореживания; длинные имена проверяются первыми
+        self._steps = {
+            name: max(1, round(1 / rate)) if rate > 0 else 0
+            for name, rate in sorted(rates.items(), key=lambda item: -len(item[0]))
+        }
+        self._seen: Dict[str, int] = {name: 0 for name in self._steps}
+        self._cache: Dict[str, Optional[str]] = {}
+
+    def _category(self, logger_name: str) -> Optional[str]:
+        category = self._cache.get(logger_name, "")
+        if category == "":
+            category = next(
+                (name for name in self._steps if logger_name == name or logger_name.startswith(name + ".")), None
+            )
+            self._cache[logger_name] = category
+        return category
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not self._steps:
+            return True
+        category = self._category(record.name)
+        if category is None:
+            return True
+        step = self._steps[category]
+        if step == 0:
+            return False
+        self._seen[category] += 1
+        return (self._seen[category] - 1) % step == 0
+
+class RedactingFormatter(logging.Formatter):
+    """Маскирует токены и секреты в готовой строке (включая traceback)"""
+
+    def __init__(self, base: logging.Formatter, secrets: Iterable[str] = ()):
+        super().__init__()
+        self.base = base
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 6]
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(self.base.format(record), self.secrets)
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.processName
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def redact(text: str, secrets: List[str]) -> str:
+    for secret in secrets:
+        if secret in text:
+            text = text.replace(secret, "***")
+    for pattern in _TOKEN_PATTERNS:
+        text = pattern.sub(r'\1***', text)
+    return text
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """"app.vk_teams_bot.poll=0.01,app.webhook_handler.n8n=0.1" -> {категория: доля}"""
+    rates: Dict[str, float] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            print(f"LOG_DEBUG_SAMPLING: пропущено '{item}'", file=sys.stderr)
+    return rates
+
+def setup_logging(level: str = "INFO", json_format: bool = False, sampling: str = "",
+                  secrets: Iterable[str] = ()):
+    """Заменить обработчики корневого логгера на очередь с фоновой записью (повторный вызов перенастраивает)"""
+    global _listener
+    stop_logging()
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(RedactingFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT), secrets))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    rates = parse_sampling(sampling)
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    numeric_level = logging.getLevelName(level.upper())
+    root.setLevel(numeric_level if isinstance(numeric_level, int) else logging.INFO)
+    for name in UVICORN_LOGGERS:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+def stop_logging():
+    """Дописать очередь и остановить фоновый поток (вызывается и при выходе из процесса)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
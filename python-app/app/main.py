@@ -3,10 +3,12 @@ VK Teams Bot - Система с интеграцией N8N
 Координирует работу VK Teams бота, API сервера и интеграцию с N8N
 """
 import logging
-import threading
 import uvicorn
 
 from .config import Config
+from .dead_letter import DeadLetterStore
+from .stands import StandRegistry
+from .state_backend import create_state_backend
 from .vk_teams_bot import VKTeamsBot
 from .webhook_handler import WebhookHandler
 from .api_server import APIServer
@@ -24,22 +26,28 @@ def main():
     # Выводим информацию о конфигурации
     Config.log_config()
     
+    if Config.RUN_MODE == "multiprocess":
+        # Long polling и HTTP API в отдельных процессах
+        from .supervisor import run_supervisor
+        run_supervisor()
+        return
+    
     # Создаем компоненты системы
     webhook_handler = WebhookHandler()
-    vk_bot = VKTeamsBot(webhook_handler)
-    api_server = APIServer()
+    dead_letters = DeadLetterStore()
+    stands = StandRegistry() if Config.STANDS_ENABLED else None
+    state = create_state_backend()
+    vk_bot = VKTeamsBot(webhook_handler, dead_letters, stands, state)
+    api_server = APIServer(webhook_handler)
     
     # Связываем компоненты
     api_server.set_bot_instance(vk_bot)
     
-    # Запускаем long polling в отдельном потоке
-    logger.info("🔄 Запускаем long polling...")
-    polling_thread = threading.Thread(target=vk_bot.polling_loop, daemon=True)
-    polling_thread.start()
-    logger.info("🤖 VK Teams бот запущен в фоновом режиме")
+    # Long polling запускается в event loop uvicorn при старте приложения
+    logger.info("🔄 Long polling стартует вместе с HTTP сервером...")
     
     # Запускаем HTTP сервер
-    logger.info(f"🌐 Запускаем HTTP сервер на порту {Config.SERVER_PORT}...")
+    logger.info("🌐 Запускаем HTTP сервер на порту %s...", Config.SERVER_PORT)
     
     try:
         app = api_server.get_app()
@@ -47,12 +55,16 @@ def main():
             app,
             host=Config.SERVER_HOST,
             port=Config.SERVER_PORT,
-            log_level="info"
+            log_level=None,  # уровень логов uvicorn - общий LOG_LEVEL
+            log_config=None  # логи uvicorn идут через общую очередь логирования
         )
     except KeyboardInterrupt:
         logger.info("🛑 Получен сигнал остановки")
     finally:
         vk_bot.stop()
+        dead_letters.close()
+        if stands:
+            stands.close()
         logger.info("👋 Система остановлена")
 
 if __name__ == "__main__":
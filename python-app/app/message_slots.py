@@ -0,0 +1,56 @@
+"""
+Message Slots - последние сообщения бота по чатам и слотам клавиатуры
+Слот - имя "места" в чате (например stands): обновление слота редактирует
+его сообщение через messages/editText вместо отправки нового
+"""
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from .config import Config
+
+DEFAULT_SLOT = "default"
+
+class MessageSlots:
+    """msgId последнего сообщения бота для (chat_id, слот); LRU с ограничением размера"""
+
+    def __init__(self, max_slots: Optional[int] = None):
+        self.max_slots = max_slots if max_slots is not None else Config.MESSAGE_SLOTS_MAX
+        self._slots: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.evicted = 0
+        self.stats = {
+            'edits': 0,
+            'edit_fallbacks': 0,  # editText не удался или msgId неизвестен - отправлено новое сообщение
+            'sends_tracked': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get(self, chat_id: str, slot: str = DEFAULT_SLOT) -> Optional[str]:
+        msg_id = self._slots.get((chat_id, slot))
+        if msg_id is not None:
+            self._slots.move_to_end((chat_id, slot))
+        return msg_id
+
+    def set(self, chat_id: str, slot: str, msg_id: str):
+        """Запомнить сообщение слота; самые давно использованные слоты вытесняются"""
+        if not msg_id:
+            return
+        key = (chat_id, slot)
+        self._slots[key] = msg_id
+        self._slots.move_to_end(key)
+        while self.max_slots > 0 and len(self._slots) > self.max_slots:
+            self._slots.popitem(last=False)
+            self.evicted += 1
+
+    def forget(self, chat_id: str, slot: str = DEFAULT_SLOT):
+        """Сообщение слота больше не редактируется (например, удалено в чате)"""
+        self._slots.pop((chat_id, slot), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self._slots),
+            "max_slots": self.max_slots,
+            "evicted": self.evicted,
+            **self.stats
+        }
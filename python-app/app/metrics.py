@@ -0,0 +1,221 @@
+"""
+Metrics - метрики в текстовом формате Prometheus
+Обновление метрики - несколько операций со списком/числом без блокировок:
+все обновления идут из одного event loop
+"""
+import bisect
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+class _Metric(ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any):
+        """Дочерняя метрика для набора значений меток (создаётся один раз)"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Значение метрики для одного набора меток"""
+
+    def _label_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    @abstractmethod
+    def collect(self) -> List[Sample]:
+        """Сэмплы для выдачи в формате Prometheus"""
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._default.value += amount
+
+    def collect(self) -> List[Sample]:
+        return [(f"{self.name}_total", self._label_dict(key), child.value) for key, child in self._children.items()]
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    """Гистограмма; накопленные значения по бакетам считаются только при выдаче"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def collect(self) -> List[Sample]:
+        samples: List[Sample] = []
+        for key, child in self._children.items():
+            labels = self._label_dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, child.sum))
+            samples.append((f"{self.name}_count", labels, child.count))
+        return samples
+
+class Gauge(_Metric):
+    """Текущее значение, вычисляемое функцией при выдаче метрик (на горячем пути ничего не стоит)"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.func = func
+
+    def _new_child(self):
+        raise TypeError(f"Gauge {self.name} has no labels")
+
+    def collect(self) -> List[Sample]:
+        try:
+            return [(self.name, {}, float(self.func()))]
+        except Exception:
+            return []
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]) -> Gauge:
+        """Зарегистрировать (или заменить) gauge с функцией значения"""
+        return self.register(Gauge(name, help_text, func))
+
+    def collect(self) -> List[Dict[str, Any]]:
+        """Снимок всех метрик (сериализуется в JSON для передачи между процессами)"""
+        return [
+            {"name": metric.name, "help": metric.help, "type": metric.type_name, "samples": metric.collect()}
+            for metric in self._metrics.values()
+        ]
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def render(*sources: Tuple[List[Dict[str, Any]], Optional[Dict[str, str]]]) -> str:
+    """
+    Текстовый формат Prometheus. Источник - снимок collect() и дополнительные метки
+    (например, process); семейства с одинаковым именем из разных процессов объединяются
+    """
+    families: Dict[str, Dict[str, Any]] = {}
+    for snapshot, extra_labels in sources:
+        for family in snapshot:
+            merged = families.setdefault(family["name"], {"help": family["help"], "type": family["type"], "samples": []})
+            for name, labels, value in family["samples"]:
+                merged["samples"].append((name, {**(extra_labels or {}), **labels}, value))
+
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in family["samples"]:
+            label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}" if label_text
+                         else f"{sample_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# Long polling
+GET_EVENTS_DURATION = REGISTRY.register(Histogram(
+    "vk_get_events_duration_seconds", "Duration of events/get long poll requests"))
+EVENTS_PER_POLL = REGISTRY.register(Histogram(
+    "vk_events_per_poll", "Events returned by one events/get call", buckets=SIZE_BUCKETS))
+EVENTS_TOTAL = REGISTRY.register(Counter(
+    "vk_events", "Events received from VK Teams by type", ("type",)))
+CALLBACKS_SUPPRESSED = REGISTRY.register(Counter(
+    "vk_callbacks_suppressed", "Repeated button clicks dropped by the debounce window"))
+
+# Исходящие сообщения
+SEND_TEXT_DURATION = REGISTRY.register(Histogram(
+    "vk_send_text_duration_seconds", "sendText latency including retries by outcome", ("outcome",)))
+EDIT_TEXT_TOTAL = REGISTRY.register(Counter(
+    "vk_edit_text", "Edit-in-place attempts: edited or fell back to sendText", ("outcome",)))
+
+# Кэш статуса стендов от N8N
+STATUS_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "status_cache_lookups", "Status cache lookups for update clicks by result", ("result",)))
+
+# Поток изменений /api/events
+EVENT_STREAM_DROPPED = REGISTRY.register(Counter(
+    "event_stream_dropped", "Events dropped from full buffers of slow /api/events subscribers"))
+
+# N8N
+N8N_FORWARD_DURATION = REGISTRY.register(Histogram(
+    "n8n_forward_duration_seconds", "Latency of requests to the N8N webhook by status", ("status",)))
+
+# Сквозные трассы: получение события -> N8N -> ответ в VK Teams
+TRACE_ROUNDTRIP = REGISTRY.register(Histogram(
+    "vk_roundtrip_seconds", "Event received -> reply sent to VK Teams, by path (n8n or local)", ("path",)))
+TRACE_STAGE = REGISTRY.register(Histogram(
+    "vk_trace_stage_seconds", "Latency of traced stages: received_to_forward, n8n, reply_to_vk", ("stage",)))
+
+# HTTP API
+WEBHOOK_HANDLE_DURATION = REGISTRY.register(Histogram(
+    "api_webhook_duration_seconds", "Handling time of POST /api/webhook by status", ("status",)))
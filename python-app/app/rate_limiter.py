@@ -0,0 +1,119 @@
+"""
+Rate Limiter - token bucket для исходящих вызовов VK Teams Bot API
+Глобальное ведро + ведро на каждый чат, вызовы ждут своей очереди, а не отклоняются
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Ведро токенов в виде GCRA: вместо счётчика токенов хранится теоретическое время
+    следующего вызова (tat). Вызов резервирует слот на собственной шкале ведра:
+    вызовы расходятся с шагом 1/rate, до capacity вызовов допускаются сразу.
+    Будущее время не даёт токенов авансом: tat сдвигается только на шаг от max(tat, at).
+    Работает в одном event loop, блокировки не нужны.
+    """
+    __slots__ = ('rate', 'capacity', 'interval', 'tat')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.interval = 1 / rate
+        self.tat = 0.0
+
+    def reserve(self, at: float) -> float:
+        """Зарезервировать слот не раньше at, вернуть момент, когда вызов разрешён"""
+        self.tat = max(self.tat, at) + self.interval
+        return max(at, self.tat - self.capacity * self.interval)
+
+class RateLimiter:
+    """Ограничитель исходящих вызовов: глобальный и по чатам, с паузой по Retry-After"""
+
+    def __init__(self):
+        self.enabled = Config.VK_RATE_LIMIT_ENABLED
+        self.global_bucket = TokenBucket(Config.VK_RATE_LIMIT_GLOBAL_RPS, Config.VK_RATE_LIMIT_GLOBAL_BURST)
+        self.chat_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.paused_until = 0.0
+        self._recent_waits = deque(maxlen=1000)  # мс ожидания вызовов, которым пришлось ждать
+        self.stats = {
+            'calls': 0,
+            'delayed_calls': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'throttled_responses': 0
+        }
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        """Ведро чата; давно не использованные чаты вытесняются (LRU)"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(Config.VK_RATE_LIMIT_CHAT_RPS, Config.VK_RATE_LIMIT_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > Config.VK_RATE_LIMIT_MAX_CHATS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: Optional[str] = None) -> float:
+        """Дождаться разрешения на вызов, вернуть время ожидания в секундах"""
+        self.stats['calls'] += 1
+        if not self.enabled:
+            return 0.0
+
+        now = time.monotonic()
+        delayed = False
+        # Сначала слот чата: вызов, который придержал лимит чата, не занимает глобальные слоты заранее
+        if chat_id:
+            chat_allowed_at = self._chat_bucket(chat_id).reserve(max(now, self.paused_until))
+            if chat_allowed_at > now:
+                delayed = True
+                await asyncio.sleep(chat_allowed_at - now)
+        # Глобальный слот - в момент, когда вызов действительно может уйти: шкала общего ведра
+        # идёт только вперёд, и будущие вызовы одного чата не задерживают остальные чаты
+        allowed_at = self.global_bucket.reserve(max(time.monotonic(), self.paused_until))
+        delay = allowed_at - time.monotonic()
+        if delay > 0:
+            delayed = True
+            await asyncio.sleep(delay)
+        if not delayed:
+            return 0.0
+
+        wait = time.monotonic() - now
+        wait_ms = wait * 1000
+        self.stats['delayed_calls'] += 1
+        self.stats['total_wait_ms'] += wait_ms
+        if wait_ms > self.stats['max_wait_ms']:
+            self.stats['max_wait_ms'] = wait_ms
+        self._recent_waits.append(wait_ms)
+        return wait
+
+    def penalize(self, delay: float):
+        """Приостановить все вызовы на delay секунд (ответ 429 / Retry-After)"""
+        self.stats['throttled_responses'] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logger.warning("⏳ VK Teams API ограничил частоту запросов, пауза %.1f с", delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики ожидания в лимитере"""
+        waits = sorted(self._recent_waits)
+        return {
+            "enabled": self.enabled,
+            "global_rps": Config.VK_RATE_LIMIT_GLOBAL_RPS,
+            "chat_rps": Config.VK_RATE_LIMIT_CHAT_RPS,
+            "tracked_chats": len(self.chat_buckets),
+            "paused_for_ms": round(max(0.0, self.paused_until - time.monotonic()) * 1000, 2),
+            **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "recent_wait_ms": {
+                "samples": len(waits),
+                "p50": round(waits[len(waits) // 2], 2) if waits else 0.0,
+                "p95": round(waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0
+            }
+        }
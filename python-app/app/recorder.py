@@ -0,0 +1,108 @@
+"""
+Event Recorder - запись сырых событий long polling в сжатый JSONL
+Файлы events-<время>.jsonl.gz ротируются по размеру; запись на диск идёт вне event loop
+"""
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class EventRecorder:
+    """Копит строки в памяти и дописывает их в текущий файл раз в RECORD_FLUSH_INTERVAL"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.enabled = Config.RECORD_EVENTS
+        self.directory = directory or Config.RECORD_DIR
+        self._buffer: List[str] = []
+        self._file = None
+        self._path: Optional[str] = None
+        self._written = 0  # байт без сжатия в текущем файле
+        self._last_flush = time.monotonic()
+        self._flush_lock = asyncio.Lock()
+        self.stats = {'events_recorded': 0, 'files_rotated': 0, 'write_errors': 0}
+
+    async def record(self, events: List[Dict[str, Any]]):
+        """Добавить события (как их вернул events/get) в запись"""
+        if not self.enabled or not events:
+            return
+        now = time.time()
+        self._buffer.extend(
+            json.dumps({"t": now, "event": event}, ensure_ascii=False, separators=(',', ':'))
+            for event in events
+        )
+        self.stats['events_recorded'] += len(events)
+        if time.monotonic() - self._last_flush >= Config.RECORD_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        """Записать накопленное в файл (в отдельном потоке)"""
+        if not self._buffer:
+            return
+        async with self._flush_lock:
+            lines, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            try:
+                await asyncio.to_thread(self._write, lines)
+            except OSError as e:
+                self.stats['write_errors'] += 1
+                logger.error("❌ Не удалось записать события в %s: %s", self._path, e)
+
+    def _write(self, lines: List[str]):
+        if self._file is None or self._written >= Config.RECORD_MAX_BYTES:
+            self._rotate()
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        self._file.write(data)
+        self._file.flush()
+        self._written += len(data)
+
+    def _rotate(self):
+        """Закрыть текущий файл, открыть новый и удалить самые старые сверх RECORD_MAX_FILES"""
+        if self._file is not None:
+            self._file.close()
+            self.stats['files_rotated'] += 1
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"events-{datetime.now():%Y%m%d-%H%M%S-%f}.jsonl.gz")
+        self._file = gzip.open(self._path, 'ab', compresslevel=5)
+        self._written = 0
+        logger.info("📼 Запись событий в %s", self._path)
+        files = sorted(glob.glob(os.path.join(self.directory, "events-*.jsonl.gz")))
+        for path in files[:-Config.RECORD_MAX_FILES] if Config.RECORD_MAX_FILES > 0 else []:
+            os.remove(path)
+
+    async def close(self):
+        """Дописать буфер и закрыть файл"""
+        await self.flush()
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "current_file": self._path,
+            **self.stats
+        }
+
+def read_recording(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Записи {"t": время получения, "event": событие} из файлов по порядку"""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Последняя строка могла оборваться при аварийной остановке
+                    logger.warning("⚠️ Пропущена повреждённая строка в %s", path)
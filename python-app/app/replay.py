@@ -0,0 +1,152 @@
+"""
+Replay - воспроизведение записанных событий через обработчики бота
+python -m app replay data/recordings/events-*.jsonl.gz --speed 10
+"""
+import argparse
+import asyncio
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import tempfile
+import time
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from .config import Config
+from .recorder import read_recording
+
+logger = logging.getLogger(__name__)
+
+def build_parser(parser: Optional[argparse.ArgumentParser] = None) -> argparse.ArgumentParser:
+    parser = parser or argparse.ArgumentParser(prog="python -m app replay")
+    parser.add_argument("paths", nargs="+", help="файлы записи (*.jsonl.gz), можно маской")
+    parser.add_argument("--speed", default="1",
+                        help="скорость: 1 - как в записи, N - в N раз быстрее, max - без пауз")
+    parser.add_argument("--real", action="store_true",
+                        help="отправлять в настоящие VK Teams API и N8N (по умолчанию - заглушки)")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="оставить лимитер частоты VK Teams включённым при работе с заглушками")
+    parser.add_argument("--mock-latency-ms", type=float, default=0, help="задержка ответов заглушек")
+    parser.add_argument("--profile", metavar="FILE", help="сохранить профиль cProfile и вывести топ функций")
+    parser.add_argument("--log-level", default="WARNING", help="уровень логов во время воспроизведения")
+    return parser
+
+def _mock_transport(latency_ms: float) -> httpx.MockTransport:
+    """Заглушка исходящих запросов: VK Teams и N8N всегда отвечают ok"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json={"ok": True, "msgId": "replay"})
+    return httpx.MockTransport(handler)
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+async def replay(paths: List[str], speed: float, real: bool = False, mock_latency_ms: float = 0,
+                 rate_limit: bool = False) -> Dict[str, Any]:
+    """
+    Прогнать записанные события через handle_message / handle_callback_query.
+    speed=0 - без пауз; иначе паузы между событиями как в записи, делённые на speed
+    """
+    from .stands import StandRegistry
+    from .vk_teams_bot import VKTeamsBot
+    from .webhook_handler import WebhookHandler
+
+    # Воспроизведение не должно сдвигать чекпоинт и дописывать новую запись
+    Config.CHECKPOINT_ENABLED = False
+    Config.RECORD_EVENTS = False
+    if not real and not rate_limit:
+        # Заглушки не ограничивают частоту; иначе замер покажет только настройки лимитера
+        Config.VK_RATE_LIMIT_ENABLED = False
+
+    webhook_handler = WebhookHandler()
+    stands = None
+    if Config.STANDS_ENABLED:
+        # С заглушками брони пишутся во временную БД, а не в рабочую
+        stands = StandRegistry(None if real else os.path.join(tempfile.mkdtemp(prefix="replay-"), "stands.db"))
+    bot = VKTeamsBot(webhook_handler, None, stands)
+    if not real:
+        transport = _mock_transport(mock_latency_ms)
+        await bot.client.aclose()
+        bot.client = httpx.AsyncClient(transport=transport)
+        await webhook_handler.client.aclose()
+        webhook_handler.client = httpx.AsyncClient(transport=transport)
+        webhook_handler.n8n_webhook_url = webhook_handler.n8n_webhook_url or "http://n8n.replay/webhook"
+    await webhook_handler.start()
+
+    latencies: Dict[str, List[float]] = {}
+    replayed = skipped = 0
+    first_t: Optional[float] = None
+    started = time.monotonic()
+    try:
+        for record in read_recording(paths):
+            event, t = record.get("event", {}), record.get("t", 0)
+            if speed > 0:
+                if first_t is None:
+                    first_t = t
+                delay = (t - first_t) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if bot._is_duplicate(event.get("eventId", 0)):
+                skipped += 1
+                continue
+            event_type = event.get("type", "")
+            handled_at = time.perf_counter()
+            if event_type == "newMessage":
+                await bot.handle_message(event)
+            elif event_type == "callbackQuery":
+                await bot.handle_callback_query(event)
+            else:
+                skipped += 1
+                continue
+            latencies.setdefault(event_type, []).append(time.perf_counter() - handled_at)
+            replayed += 1
+    finally:
+        # Тот же порядок остановки, что и у сервера: бот (ответы на нажатия, клиенты), затем очередь N8N
+        await bot.shutdown()
+        await webhook_handler.shutdown()
+        if stands:
+            stands.close()
+
+    elapsed = time.monotonic() - started
+    return {
+        "events_replayed": replayed,
+        "events_skipped": skipped,
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(replayed / elapsed, 2) if elapsed else 0,
+        "handler_latency": {event_type: _percentiles(samples) for event_type, samples in latencies.items()},
+        "n8n": webhook_handler.stats
+    }
+
+def run(args: argparse.Namespace):
+    """Точка входа команды replay"""
+    logging.getLogger().setLevel(args.log_level.upper())
+    paths = sorted(path for pattern in args.paths for path in (glob.glob(pattern) or [pattern]))
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    result = asyncio.run(replay(paths, speed, args.real, args.mock_latency_ms, args.rate_limit))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    print(f"▶️ Воспроизведено {result['events_replayed']} событий за {result['elapsed_s']} с "
+          f"({result['events_per_s']}/с), пропущено {result['events_skipped']}")
+    for event_type, stats in result["handler_latency"].items():
+        print(f"   {event_type:14} n={stats['count']} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    if profiler:
+        print(f"📊 Профиль сохранён в {args.profile}")
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(20)
@@ -119,16 +119,16 @@ class APIServer:
             # Проверить активные чаты
             active_chats = self.vk_bot_instance.get_active_chats()
             if message.chat_id not in active_chats:
-                logger.warning(f"⚠️ Чат {message.chat_id} не найден в активных чатах")
+                logger.warning("⚠️ Чат %s не найден в активных чатах", message.chat_id)
 
             # Отправить сообщение в VK Teams
             success = self.vk_bot_instance.send_text(message.chat_id, message.message)
 
             if success:
-                logger.info(f"✅ Webhook сообщение доставлено в чат {message.chat_id}")
+                logger.info("✅ Webhook сообщение доставлено в чат %s", message.chat_id)
                 return JSONResponse(content=result, status_code=200)
             else:
-                logger.error(f"❌ Не удалось доставить сообщение в чат {message.chat_id}")
+                logger.error("❌ Не удалось доставить сообщение в чат %s", message.chat_id)
                 raise HTTPException(status_code=500, detail="Failed to send message to VK Teams")
 
         @self.app.get("/api/stats")
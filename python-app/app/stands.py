@@ -0,0 +1,229 @@
+"""
+Stand Registry - встроенный движок бронирования стендов
+Отвечает на нажатия кнопок стендов локально, без похода в N8N.
+Состояние хранится в памяти (O(1) поиск по стенду и по пользователю) и в SQLite
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, FrozenSet, List, Optional, Set
+
+from .config import Config
+from .keyboards import serialize_keyboard
+
+logger = logging.getLogger(__name__)
+
+class StandState:
+    """Состояние одного стенда"""
+    __slots__ = ('name', 'holder_id', 'holder_name', 'taken_at')
+
+    def __init__(self, name: str, holder_id: str = "", holder_name: str = "", taken_at: Optional[str] = None):
+        self.name = name
+        self.holder_id = holder_id
+        self.holder_name = holder_name
+        self.taken_at = taken_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "free": not self.holder_id,
+            "holder_id": self.holder_id or None,
+            "holder_name": self.holder_name or None,
+            "taken_at": self.taken_at
+        }
+
+class StandActionResult:
+    """Результат обработки нажатия: текст ответа, клавиатура и описание действия для N8N"""
+    __slots__ = ('action', 'stand', 'text', 'keyboard')
+
+    def __init__(self, action: str, stand: Optional[str], text: str, keyboard: str):
+        self.action = action
+        self.stand = stand
+        self.text = text
+        self.keyboard = keyboard
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"action": self.action, "stand": self.stand}
+
+class StandRegistry:
+    """Реестр стендов и их владельцев"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or Config.STANDS_DB
+        self.stands: Dict[str, StandState] = {}
+        self.by_user: Dict[str, Set[str]] = {}
+        self.version = 0  # растёт при каждом изменении владельцев
+        # Готовые строки клавиатур текущей версии: у всех, кто ничего не занял, она одна
+        self._keyboard_cache: Dict[FrozenSet[str], str] = {}
+        self._keyboard_cache_version = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stands (
+                name TEXT PRIMARY KEY,
+                holder_id TEXT NOT NULL DEFAULT '',
+                holder_name TEXT NOT NULL DEFAULT '',
+                taken_at TEXT
+            )
+            """
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Загрузить стенды из конфигурации и сохранённых владельцев из БД"""
+        for name in Config.STANDS:
+            self.stands[name] = StandState(name)
+        rows = self._conn.execute("SELECT name, holder_id, holder_name, taken_at FROM stands").fetchall()
+        for name, holder_id, holder_name, taken_at in rows:
+            if name not in self.stands:
+                continue
+            self.stands[name] = StandState(name, holder_id, holder_name, taken_at)
+            if holder_id:
+                self.by_user.setdefault(holder_id, set()).add(name)
+        logger.info("🧪 Реестр стендов: %s стендов, занято: %s",
+                    len(self.stands), sum(1 for s in self.stands.values() if s.holder_id))
+
+    def _persist(self, stand: StandState):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO stands (name, holder_id, holder_name, taken_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder_id = excluded.holder_id, "
+                "holder_name = excluded.holder_name, taken_at = excluded.taken_at",
+                (stand.name, stand.holder_id, stand.holder_name, stand.taken_at)
+            )
+            self._conn.commit()
+
+    # --- операции над стендами ---
+
+    def get(self, name: str) -> Optional[StandState]:
+        """Стенд по имени"""
+        return self.stands.get(name)
+
+    def held_by(self, user_id: str) -> Set[str]:
+        """Стенды, занятые пользователем"""
+        return self.by_user.get(user_id, set())
+
+    async def take(self, name: str, user_id: str, user_name: str) -> bool:
+        """Занять свободный стенд"""
+        stand = self.stands.get(name)
+        if not stand or stand.holder_id:
+            return False
+        stand.holder_id = user_id
+        stand.holder_name = user_name
+        stand.taken_at = datetime.now().isoformat()
+        self.by_user.setdefault(user_id, set()).add(name)
+        self.version += 1
+        await asyncio.to_thread(self._persist, stand)
+        return True
+
+    async def release(self, name: str, user_id: Optional[str] = None) -> bool:
+        """Освободить стенд (если указан user_id - только своим владельцем)"""
+        stand = self.stands.get(name)
+        if not stand or not stand.holder_id or (user_id and stand.holder_id != user_id):
+            return False
+        held = self.by_user.get(stand.holder_id)
+        if held:
+            held.discard(name)
+            if not held:
+                del self.by_user[stand.holder_id]
+        stand.holder_id = ""
+        stand.holder_name = ""
+        stand.taken_at = None
+        self.version += 1
+        await asyncio.to_thread(self._persist, stand)
+        return True
+
+    # --- обработка кнопок ---
+
+    def handles(self, callback_data: str) -> bool:
+        """Нажатие относится к стендам и может быть обработано локально"""
+        return callback_data == Config.STANDS_UPDATE_CALLBACK or callback_data.startswith(Config.STANDS_CALLBACK_PREFIX)
+
+    async def handle_callback(self, callback_data: str, user_id: str, user_name: str) -> StandActionResult:
+        """
+        Обработать нажатие: update - показать состояние,
+        зелёный стенд - занять, жёлтый - освободить, красный - сообщить, кем занят
+        """
+        if callback_data == Config.STANDS_UPDATE_CALLBACK:
+            return StandActionResult("update", None, self.render_status_text(), self.render_keyboard_json(user_id))
+
+        name = callback_data[len(Config.STANDS_CALLBACK_PREFIX):]
+        stand = self.stands.get(name)
+        if not stand:
+            action, text = "unknown", f"❓ Стенд {name} не найден"
+        elif not stand.holder_id:
+            await self.take(name, user_id, user_name)
+            action, text = "take", f"✅ Стенд {name} занят вами"
+        elif stand.holder_id == user_id:
+            await self.release(name, user_id)
+            action, text = "release", f"🔓 Стенд {name} освобождён"
+        else:
+            taken_at = stand.taken_at[11:16] if stand.taken_at else "?"
+            action, text = "busy", f"⛔ Стенд {name} занят: {stand.holder_name or stand.holder_id} (с {taken_at})"
+
+        return StandActionResult(action, name, f"{text}\n\n{self.render_status_text()}", self.render_keyboard_json(user_id))
+
+    def render_status_text(self) -> str:
+        """Текстовый список стендов"""
+        lines = ["Стенды:"]
+        for stand in self.stands.values():
+            if stand.holder_id:
+                lines.append(f"🔴 {stand.name} — {stand.holder_name or stand.holder_id}")
+            else:
+                lines.append(f"🟢 {stand.name} — свободен")
+        return "\n".join(lines)
+
+    def render_keyboard(self, user_id: str) -> Dict[str, Any]:
+        """Цветная клавиатура стендов для пользователя: 🟢 свободен, 🟡 ваш, 🔴 занят другим"""
+        buttons = []
+        for stand in self.stands.values():
+            if not stand.holder_id:
+                mark, style = "🟢", "primary"
+            elif stand.holder_id == user_id:
+                mark, style = "🟡", "base"
+            else:
+                mark, style = "🔴", "attention"
+            buttons.append({
+                "text": f"{mark} {stand.name}",
+                "callbackData": f"{Config.STANDS_CALLBACK_PREFIX}{stand.name}",
+                "style": style
+            })
+        per_row = max(1, Config.STANDS_PER_ROW)
+        rows: List[List[Dict[str, Any]]] = [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+        rows.append([{"text": "🔄 update", "callbackData": Config.STANDS_UPDATE_CALLBACK, "style": "base"}])
+        return {"inlineKeyboard": rows}
+
+    def render_keyboard_json(self, user_id: str) -> str:
+        """Готовая строка inlineKeyboardMarkup; кэшируется по версии реестра и стендам пользователя"""
+        if self._keyboard_cache_version != self.version:
+            self._keyboard_cache.clear()
+            self._keyboard_cache_version = self.version
+        key = frozenset(self.by_user.get(user_id, ()))
+        keyboard_json = self._keyboard_cache.get(key)
+        if keyboard_json is None:
+            keyboard_json = serialize_keyboard(self.render_keyboard(user_id))
+            self._keyboard_cache[key] = keyboard_json
+        return keyboard_json
+
+    def get_state(self) -> Dict[str, Any]:
+        """Состояние всех стендов"""
+        return {
+            "version": self.version,
+            "total": len(self.stands),
+            "taken": sum(1 for stand in self.stands.values() if stand.holder_id),
+            "stands": [stand.to_dict() for stand in self.stands.values()]
+        }
+
+    def close(self):
+        """Закрыть соединение с БД"""
+        with self._lock:
+            self._conn.close()
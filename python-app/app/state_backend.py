@@ -0,0 +1,304 @@
+"""
+State Backend - общее состояние бота: в памяти процесса или в Redis
+Redis позволяет запускать несколько реплик API: long polling ведёт только лидер,
+а /api/webhook обслуживают все реплики
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from .chat_registry import ChatRegistry
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class InMemoryStateBackend:
+    """Состояние в памяти процесса: одна реплика, она же всегда лидер"""
+
+    requires_election = False
+
+    def __init__(self):
+        self.chats: Optional[ChatRegistry] = None
+        self.is_leader = True
+
+    def attach(self, chats: ChatRegistry, counters: Dict[str, Dict[str, Any]], offset_getter: Callable[[], int]):
+        """Подключить локальные структуры, состояние которых нужно разделять"""
+        self.chats = chats
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def try_acquire_leadership(self) -> bool:
+        return True
+
+    async def renew_leadership(self) -> bool:
+        return True
+
+    async def release_leadership(self):
+        pass
+
+    async def load_offset(self) -> int:
+        return 0
+
+    async def chat_count(self) -> int:
+        return len(self.chats) if self.chats else 0
+
+    async def has_chat(self, chat_id: str) -> bool:
+        return bool(self.chats) and chat_id in self.chats
+
+    async def chats_page(self, cursor: str, limit: int) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+        """Страница чатов и следующий курсор"""
+        if not self.chats:
+            return {}, None
+        records, next_cursor = self.chats.page(int(cursor or 0), limit)
+        return {record.chat_id: record.to_dict() for record in records}, (
+            str(next_cursor) if next_cursor is not None else None
+        )
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "is_leader": True}
+
+class RedisStateBackend:
+    """
+    Состояние в Redis. Изменения копятся локально и отправляются одним pipeline
+    раз в REDIS_FLUSH_INTERVAL; лидер long polling выбирается через блокировку SET NX PX
+    """
+
+    requires_election = True
+
+    # Продлить блокировку, только если она всё ещё наша
+    _RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    _RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis требует пакет redis (pip install redis)") from e
+
+        self.redis = aioredis.from_url(
+            Config.REDIS_URL,
+            password=Config.REDIS_PASSWORD or None,
+            decode_responses=True
+        )
+        prefix = Config.REDIS_PREFIX
+        self.keys = {
+            'leader': f"{prefix}:poller_leader",
+            'offset': f"{prefix}:last_event_id",
+            'chats': f"{prefix}:chats",
+            'chat_counts': f"{prefix}:chat_message_counts",
+            'stats': f"{prefix}:stats"
+        }
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.chats: Optional[ChatRegistry] = None
+        self._counters: Dict[str, Dict[str, Any]] = {}
+        self._sent_counters: Dict[str, int] = {}
+        self._offset_getter: Optional[Callable[[], int]] = None
+        self._sent_offset = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flush_stats = {'flushes': 0, 'flush_errors': 0, 'last_flush': None}
+
+    def attach(self, chats: ChatRegistry, counters: Dict[str, Dict[str, Any]], offset_getter: Callable[[], int]):
+        """
+        Подключить локальные структуры: реестр чатов (отслеживаются изменённые чаты),
+        словари счётчиков (в Redis уходят приращения) и текущую позицию long polling
+        """
+        self.chats = chats
+        chats.track_dirty = True
+        self._counters = counters
+        self._offset_getter = offset_getter
+
+    async def start(self):
+        """Проверить соединение и запустить фоновую отправку изменений"""
+        await self.redis.ping()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("🗃️ Общее состояние в Redis: %s, реплика %s", Config.REDIS_URL, self.instance_id)
+
+    async def close(self):
+        """Отправить накопленные изменения, отдать лидерство и закрыть соединение"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        await self.release_leadership()
+        await self.redis.close()
+
+    # --- выбор лидера ---
+
+    async def try_acquire_leadership(self) -> bool:
+        """Попробовать стать лидером long polling"""
+        try:
+            acquired = await self.redis.set(
+                self.keys['leader'], self.instance_id, nx=True, px=int(Config.LEADER_LOCK_TTL * 1000)
+            )
+        except Exception as e:
+            logger.error("❌ Ошибка выбора лидера в Redis: %s", e)
+            return False
+        if acquired:
+            self.is_leader = True
+            logger.info("👑 Реплика %s стала лидером long polling", self.instance_id)
+        return bool(acquired)
+
+    async def renew_leadership(self) -> bool:
+        """Продлить блокировку лидера; False - лидерство потеряно"""
+        try:
+            renewed = await self.redis.eval(
+                self._RENEW_SCRIPT, 1, self.keys['leader'], self.instance_id, int(Config.LEADER_LOCK_TTL * 1000)
+            )
+        except Exception as e:
+            logger.error("❌ Не удалось продлить лидерство: %s", e)
+            renewed = 0
+        self.is_leader = bool(renewed)
+        return self.is_leader
+
+    async def release_leadership(self):
+        """Отдать лидерство (при остановке)"""
+        if not self.is_leader:
+            return
+        try:
+            await self.redis.eval(self._RELEASE_SCRIPT, 1, self.keys['leader'], self.instance_id)
+        except Exception as e:
+            logger.error("❌ Не удалось освободить лидерство: %s", e)
+        self.is_leader = False
+
+    async def load_offset(self) -> int:
+        """Позиция long polling, сохранённая предыдущим лидером"""
+        value = await self.redis.get(self.keys['offset'])
+        self._sent_offset = int(value or 0)
+        return self._sent_offset
+
+    # --- пакетная отправка изменений ---
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(Config.REDIS_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        """Отправить накопленные изменения одним pipeline"""
+        pipe = self.redis.pipeline(transaction=False)
+        pending = 0
+
+        # Счётчики: отправляем только приращения с прошлой отправки
+        sent_deltas: List[Tuple[str, int]] = []
+        for group, counters in self._counters.items():
+            for name, value in counters.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                key = f"{group}.{name}"
+                delta = int(value) - self._sent_counters.get(key, 0)
+                if delta:
+                    pipe.hincrby(self.keys['stats'], key, delta)
+                    sent_deltas.append((key, int(value)))
+                    pending += 1
+
+        # Изменённые чаты: карточка чата и приращение числа сообщений
+        dirty = self.chats.drain_dirty() if self.chats else {}
+        if dirty:
+            pipe.hincrby(self.keys['stats'], 'chats.total_messages', sum(dirty.values()))
+        for chat_id, delta in dirty.items():
+            record = self.chats.get(chat_id)
+            if record is None:
+                continue
+            pipe.hset(self.keys['chats'], chat_id, json.dumps(
+                {'user_name': record.user_name, 'user_id': record.user_id, 'last_message_ts': record.last_message_ts},
+                ensure_ascii=False
+            ))
+            pipe.hincrby(self.keys['chat_counts'], chat_id, delta)
+            pending += 1
+
+        # Вытесненные из реестра чаты удаляются и из Redis: размер общего состояния ограничен так же
+        evicted = self.chats.drain_evicted() if self.chats else set()
+        if evicted:
+            pipe.hdel(self.keys['chats'], *evicted)
+            pipe.hdel(self.keys['chat_counts'], *evicted)
+            pending += 1
+
+        offset = self._offset_getter() if self._offset_getter and self.is_leader else 0
+        if offset > self._sent_offset:
+            pipe.set(self.keys['offset'], offset)
+            pending += 1
+
+        if not pending:
+            return
+        try:
+            await pipe.execute()
+        except Exception as e:
+            self.flush_stats['flush_errors'] += 1
+            logger.error("❌ Ошибка записи состояния в Redis: %s", e)
+            # Вернём изменения чатов, чтобы отправить их при следующей попытке
+            if self.chats:
+                self.chats.restore_dirty(dirty, evicted)
+            return
+        for key, value in sent_deltas:
+            self._sent_counters[key] = value
+        if offset > self._sent_offset:
+            self._sent_offset = offset
+        self.flush_stats['flushes'] += 1
+        self.flush_stats['last_flush'] = datetime.now().isoformat()
+
+    # --- чтение общего состояния ---
+
+    async def chat_count(self) -> int:
+        return await self.redis.hlen(self.keys['chats'])
+
+    async def has_chat(self, chat_id: str) -> bool:
+        if self.chats and chat_id in self.chats:
+            return True
+        return bool(await self.redis.hexists(self.keys['chats'], chat_id))
+
+    async def chats_page(self, cursor: str, limit: int) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+        """Страница чатов через HSCAN; курсор Redis передаётся клиенту как есть"""
+        next_cursor, items = await self.redis.hscan(self.keys['chats'], cursor=int(cursor or 0), count=limit)
+        chat_ids = list(items.keys())
+        counts = await self.redis.hmget(self.keys['chat_counts'], chat_ids) if chat_ids else []
+        chats = {}
+        for chat_id, count in zip(chat_ids, counts):
+            info = json.loads(items[chat_id])
+            chats[chat_id] = {
+                'user_name': info.get('user_name', ''),
+                'user_id': info.get('user_id', ''),
+                'last_message_time': datetime.fromtimestamp(info.get('last_message_ts', 0)).isoformat(),
+                'message_count': int(count or 0)
+            }
+        return chats, (str(next_cursor) if next_cursor else None)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Общие счётчики всех реплик"""
+        stats = await self.redis.hgetall(self.keys['stats'])
+        return {
+            "backend": "redis",
+            "instance_id": self.instance_id,
+            "is_leader": self.is_leader,
+            "leader": await self.redis.get(self.keys['leader']),
+            "last_event_id": int(await self.redis.get(self.keys['offset']) or 0),
+            "total_chats": await self.chat_count(),
+            "counters": {key: int(value) for key, value in stats.items()},
+            "flush": dict(self.flush_stats)
+        }
+
+def create_state_backend():
+    """Создать backend состояния по STATE_BACKEND (memory | redis)"""
+    if Config.STATE_BACKEND == "redis":
+        return RedisStateBackend()
+    return InMemoryStateBackend()
@@ -0,0 +1,95 @@
+"""
+Status Cache - последний ответ N8N со статусом стендов для каждой аудитории
+Аудитория - "shared" (общий ответ) или "user:<userId>" (персональная клавиатура).
+Повторное нажатие update в пределах STATUS_CACHE_TTL отвечается из кэша без N8N;
+N8N заменяет или сбрасывает записи, когда стенд меняет владельца
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from .config import Config
+from .metrics import STATUS_CACHE_LOOKUPS
+
+SHARED_AUDIENCE = "shared"
+
+def user_audience(user_id: str) -> str:
+    return f"user:{user_id}"
+
+class StatusEntry:
+    """Текст статуса и готовая строка inlineKeyboardMarkup"""
+    __slots__ = ('text', 'keyboard', 'stored_at')
+
+    def __init__(self, text: str, keyboard: Optional[str]):
+        self.text = text
+        self.keyboard = keyboard
+        self.stored_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+class StatusCache:
+    """Записи по аудиториям; LRU с ограничением размера, свежесть - STATUS_CACHE_TTL секунд"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else Config.STATUS_CACHE_TTL
+        self.max_entries = max_entries if max_entries is not None else Config.STATUS_CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[str, StatusEntry]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stores': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def lookup(self, user_id: str) -> Optional[StatusEntry]:
+        """Свежий ответ для пользователя: сначала персональный, затем общий"""
+        if not self.enabled:
+            return None
+        for audience in (user_audience(user_id), SHARED_AUDIENCE):
+            entry = self._entries.get(audience)
+            if entry is None:
+                continue
+            if entry.age() >= self.ttl:
+                del self._entries[audience]
+                self.stats['stale'] += 1
+                STATUS_CACHE_LOOKUPS.labels("stale").inc()
+                continue
+            self._entries.move_to_end(audience)
+            self.stats['hits'] += 1
+            STATUS_CACHE_LOOKUPS.labels("hit").inc()
+            return entry
+        self.stats['misses'] += 1
+        STATUS_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def store(self, audience: str, text: str, keyboard: Optional[str]):
+        """Заменить запись аудитории"""
+        if not self.enabled:
+            return
+        self._entries[audience] = StatusEntry(text, keyboard)
+        self._entries.move_to_end(audience)
+        self.stats['stores'] += 1
+        while self.max_entries > 0 and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, audience: Optional[str] = None) -> int:
+        """Сбросить запись аудитории или весь кэш (audience=None); возвращает число удалённых"""
+        if audience is None:
+            removed = len(self._entries)
+            self._entries.clear()
+        else:
+            removed = 1 if self._entries.pop(audience, None) is not None else 0
+        self.stats['invalidations'] += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl,
+            "entries": len(self._entries),
+            **self.stats,
+            "hit_ratio": round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+            "timestamp": datetime.now().isoformat()
+        }
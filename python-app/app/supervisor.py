@@ -0,0 +1,139 @@
+"""
+Supervisor - многопроцессный режим (RUN_MODE=multiprocess)
+Процесс hub ведёт long polling и исходящие отправки, воркеры обслуживают HTTP API
+и обрабатывают события; упавшие процессы перезапускаются
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+import time
+from typing import Dict, Any, Callable, Tuple
+
+import uvicorn
+
+from .api_server import APIServer
+from .config import Config
+from .dead_letter import DeadLetterStore
+from .ipc import HubClient, HubServer, HubStateBackend
+from .stands import StandRegistry
+from .state_backend import create_state_backend
+from .vk_teams_bot import VKTeamsBot
+from .webhook_handler import WebhookHandler
+
+logger = logging.getLogger(__name__)
+
+async def _run_hub():
+    """Процесс long polling: события раздаются воркерам через Unix socket"""
+    dead_letters = DeadLetterStore()
+    stands = StandRegistry() if Config.STANDS_ENABLED else None
+    vk_bot = VKTeamsBot(None, dead_letters, stands, create_state_backend())
+    hub = HubServer(vk_bot)
+    vk_bot.event_sink = hub.dispatch_event
+    vk_bot.event_sink_pending = hub.oldest_unacked_event_id
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await hub.start()
+    await vk_bot.start()
+    try:
+        await stop.wait()
+    finally:
+        await vk_bot.shutdown()
+        await hub.close()
+        dead_letters.close()
+        if stands:
+            stands.close()
+        logger.info("👋 Процесс long polling остановлен")
+
+def hub_process():
+    asyncio.run(_run_hub())
+
+def _reuseport_socket() -> socket.socket:
+    """Слушающий сокет с SO_REUSEPORT: ядро распределяет соединения между воркерами"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((Config.SERVER_HOST, Config.SERVER_PORT))
+    sock.set_inheritable(True)
+    return sock
+
+def worker_process(worker_id: int):
+    """Процесс API: HTTP сервер и обработка событий своей доли чатов"""
+    webhook_handler = WebhookHandler()
+    dead_letters = DeadLetterStore()
+    hub = HubClient(worker_id)
+    vk_bot = VKTeamsBot(webhook_handler, dead_letters, None, HubStateBackend(hub), hub)
+    api_server = APIServer(webhook_handler)
+    api_server.set_bot_instance(vk_bot)
+
+    try:
+        server = uvicorn.Server(uvicorn.Config(api_server.get_app(), log_level=None, log_config=None))
+        server.run(sockets=[_reuseport_socket()])
+    finally:
+        dead_letters.close()
+        logger.info("👋 Воркер %s остановлен", worker_id)
+
+def run_supervisor():
+    """Запустить hub и API_WORKERS воркеров и следить за ними"""
+    context = multiprocessing.get_context("spawn")
+    specs: Dict[str, Tuple[Callable, tuple]] = {"hub": (hub_process, ())}
+    for worker_id in range(Config.API_WORKERS):
+        specs[f"worker-{worker_id}"] = (worker_process, (worker_id,))
+
+    processes: Dict[str, Any] = {}
+    restart_delay = {name: Config.SUPERVISOR_RESTART_DELAY for name in specs}
+    restart_at = {name: 0.0 for name in specs}
+    started_at = {name: 0.0 for name in specs}
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    def spawn(name: str):
+        target, args = specs[name]
+        process = context.Process(target=target, args=args, name=name, daemon=False)
+        process.start()
+        processes[name] = process
+        started_at[name] = time.monotonic()
+        logger.info("🚀 Запущен процесс %s (pid %s)", name, process.pid)
+
+    for name in specs:
+        spawn(name)
+
+    while not stopping:
+        now = time.monotonic()
+        for name, process in list(processes.items()):
+            if process.is_alive():
+                # Процесс, проработавший минуту, при следующем падении перезапускается без долгой паузы
+                if now - started_at[name] > 60:
+                    restart_delay[name] = Config.SUPERVISOR_RESTART_DELAY
+                continue
+            if process.exitcode is not None and restart_at[name] == 0.0:
+                # Растущая пауза, чтобы процесс, падающий при старте, не крутился впустую
+                logger.error("💥 Процесс %s завершился с кодом %s, перезапуск через %.1f с",
+                             name, process.exitcode, restart_delay[name])
+                restart_at[name] = now + restart_delay[name]
+                restart_delay[name] = min(restart_delay[name] * 2, Config.SUPERVISOR_MAX_RESTART_DELAY)
+            elif restart_at[name] and now >= restart_at[name]:
+                restart_at[name] = 0.0
+                spawn(name)
+        time.sleep(0.5)
+
+    logger.info("🛑 Останавливаем процессы...")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+    logger.info("👋 Система остановлена")
@@ -0,0 +1,131 @@
+"""
+Tracing - сквозной trace_id для событий, проходящих через N8N
+Событие получает trace_id при получении из events/get, trace_id уходит в N8N вместе с событием
+и возвращается в /api/webhook. По отметкам этапов считается, сколько пользователь ждал ответа:
+received -> forwarded (запрос в N8N) -> n8n_reply (ответ N8N) -> vk_sent (сообщение в VK Teams).
+Событие, на которое бот ответил сам, закрывается его ответом; событие без ответа (повторное нажатие,
+N8N не настроен) отбрасывается отметкой discarded и не попадает в статистику
+"""
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Any, Deque, List, Optional
+
+from .config import Config
+from .metrics import TRACE_ROUNDTRIP, TRACE_STAGE
+
+STAGES = ("received", "forwarded", "n8n_reply", "vk_sent")
+DISCARDED = "discarded"
+
+class Trace:
+    """Отметки времени этапов одного взаимодействия (time.time(), общие для процессов)"""
+    __slots__ = ('trace_id', 'event_type', 'chat_id', 'label', 'marks')
+
+    def __init__(self, trace_id: str, event_type: str, chat_id: str, label: str, received_at: float):
+        self.trace_id = trace_id
+        self.event_type = event_type
+        self.chat_id = chat_id
+        self.label = label
+        self.marks: Dict[str, float] = {"received": received_at}
+
+    @property
+    def total(self) -> float:
+        return self.marks.get("vk_sent", self.marks["received"]) - self.marks["received"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        received = self.marks["received"]
+        return {
+            "trace_id": self.trace_id,
+            "event_type": self.event_type,
+            "chat_id": self.chat_id,
+            "label": self.label,
+            "path": "n8n" if "n8n_reply" in self.marks else "local",
+            "received_at": datetime.fromtimestamp(received).isoformat(),
+            "total_ms": round(self.total * 1000, 1),
+            "stages_ms": {
+                stage: round((self.marks[stage] - received) * 1000, 1)
+                for stage in STAGES[1:] if stage in self.marks
+            }
+        }
+
+class TraceStore:
+    """
+    Открытые трассы по trace_id (LRU, не дольше TRACE_TTL) и последние завершённые
+    для /api/traces/slow. Завершается трасса первой отправкой ответа в VK Teams
+    """
+
+    def __init__(self, max_open: Optional[int] = None, ttl: Optional[float] = None, recent: Optional[int] = None):
+        self.enabled = Config.TRACING_ENABLED
+        self.max_open = max_open if max_open is not None else Config.TRACE_MAX_OPEN
+        self.ttl = ttl if ttl is not None else Config.TRACE_TTL
+        self._open: "OrderedDict[str, Trace]" = OrderedDict()
+        self._completed: Deque[Trace] = deque(maxlen=recent if recent is not None else Config.TRACE_RECENT)
+        self.stats = {'started': 0, 'completed': 0, 'discarded': 0, 'expired': 0, 'unknown': 0}
+
+    def start(self, event: Dict[str, Any]) -> Optional[str]:
+        """Открыть трассу для события; None - трассировка выключена"""
+        if not self.enabled:
+            return None
+        payload = event.get('payload', {})
+        chat = payload.get('chat') or payload.get('message', {}).get('chat', {})
+        label = payload.get('callbackData') or payload.get('text', '')
+        trace_id = uuid.uuid4().hex[:16]
+        self._open[trace_id] = Trace(trace_id, event.get('type', ''), chat.get('chatId', ''), label[:64], time.time())
+        self.stats['started'] += 1
+        self._expire()
+        return trace_id
+
+    def mark(self, trace_id: Optional[str], stage: str, at: Optional[float] = None):
+        """Отметить этап; vk_sent завершает трассу, discarded - удаляет без учёта"""
+        if not trace_id or not self.enabled:
+            return
+        if stage == DISCARDED:
+            if self._open.pop(trace_id, None) is not None:
+                self.stats['discarded'] += 1
+            return
+        trace = self._open.get(trace_id)
+        if trace is None:
+            self.stats['unknown'] += 1
+            return
+        at = at if at is not None else time.time()
+        if stage in trace.marks:
+            return
+        trace.marks[stage] = at
+        if stage == "vk_sent":
+            self._complete(trace)
+
+    def _complete(self, trace: Trace):
+        del self._open[trace.trace_id]
+        self._completed.append(trace)
+        self.stats['completed'] += 1
+        marks = trace.marks
+        TRACE_ROUNDTRIP.labels("n8n" if "n8n_reply" in marks else "local").observe(trace.total)
+        if "forwarded" in marks:
+            TRACE_STAGE.labels("received_to_forward").observe(marks["forwarded"] - marks["received"])
+            if "n8n_reply" in marks:
+                TRACE_STAGE.labels("n8n").observe(marks["n8n_reply"] - marks["forwarded"])
+        if "n8n_reply" in marks:
+            TRACE_STAGE.labels("reply_to_vk").observe(marks["vk_sent"] - marks["n8n_reply"])
+
+    def _expire(self):
+        """Трассы без ответа дольше TRACE_TTL и сверх TRACE_MAX_OPEN удаляются"""
+        deadline = time.time() - self.ttl
+        while self._open:
+            trace = next(iter(self._open.values()))
+            if trace.marks["received"] >= deadline and len(self._open) <= self.max_open:
+                break
+            self._open.popitem(last=False)
+            self.stats['expired'] += 1
+
+    def slowest(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Самые долгие из последних завершённых взаимодействий"""
+        return [trace.to_dict() for trace in sorted(self._completed, key=lambda trace: trace.total, reverse=True)[:limit]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "open": len(self._open),
+            "recent_completed": len(self._completed),
+            **self.stats
+        }
@@ -1,32 +1,120 @@
 """
 VK Teams Bot - основной класс для работы с VK Teams API
 """
+import asyncio
 import logging
-import requests
+import httpx
 import json
+import random
 import time
-from datetime import datetime
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Tuple
 
+from .callback_answers import CallbackAnswerer
+from .callback_debounce import CallbackDebouncer
+from .chat_registry import ChatRegistry
+from .checkpoint import EventCheckpoint
+from .commands import CommandContext, create_default_router
 from .config import Config
+from .dead_letter import DeadLetterStore
+from .dispatcher import EventDispatcher
+from .event_bus import EventBus
+from .keyboards import KeyboardMarkup, KeyboardTemplateCache, KeyboardTemplateError, KeyboardTemplateRef, serialize_keyboard
+from .message_slots import MessageSlots, DEFAULT_SLOT
+from .metrics import REGISTRY, CALLBACKS_SUPPRESSED, EDIT_TEXT_TOTAL, EVENTS_PER_POLL, EVENTS_TOTAL, GET_EVENTS_DURATION, SEND_TEXT_DURATION
+from .rate_limiter import RateLimiter
+from .recorder import EventRecorder
+from .stands import StandRegistry
+from .state_backend import InMemoryStateBackend
+from .status_cache import StatusCache
+from .tracing import TraceStore
 from .webhook_handler import WebhookHandler
 
 logger = logging.getLogger(__name__)
+# Частые записи о каждом запросе и событии - в отдельных категориях (прореживаются через LOG_DEBUG_SAMPLING)
+poll_logger = logging.getLogger(f"{__name__}.poll")
+send_logger = logging.getLogger(f"{__name__}.send")
+
+# Слот сообщения со статусом стендов
+STANDS_SLOT = "stands"
+
+# get_events: запрос не удался (в отличие от None - пустого long poll)
+POLL_FAILED: Dict[str, Any] = {"ok": False}
 
 class VKTeamsBot:
     """Класс для работы с VK Teams Bot API"""
     
-    def __init__(self, webhook_handler: Optional[WebhookHandler] = None):
+    def __init__(self, webhook_handler: Optional[WebhookHandler] = None,
+                 dead_letters: Optional[DeadLetterStore] = None,
+                 stands: Optional[StandRegistry] = None,
+                 state=None,
+                 hub=None):
         self.token = Config.BOT_TOKEN
         self.api_url = Config.BOT_API_URL
         self.webhook_handler = webhook_handler
-        self.last_event_id = 0
-        self.session = requests.Session()
+        self.dead_letters = dead_letters
+        self.stands = stands  # встроенный движок бронирования стендов (опционально)
+        # Позиция long polling переживает перезапуск через чекпоинт на диске
+        self.checkpoint = EventCheckpoint()
+        self.last_event_id = self.checkpoint.load()
+        # Недавно обработанные eventId (LRU) для отбрасывания повторов
+        self._seen_event_ids: "OrderedDict[int, None]" = OrderedDict()
+        self.duplicate_events = 0
+        # Ошибки опроса: подряд (для паузы перед повтором) и всего
+        self.poll_failures = 0
+        self.poll_errors = 0
+        # Запись сырых событий для последующего воспроизведения (RECORD_EVENTS)
+        self.recorder = EventRecorder()
+        # Пул соединений для исходящих вызовов Bot API (sendText и др.)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(Config.VK_HTTP_TIMEOUT, connect=Config.VK_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=Config.VK_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.VK_HTTP_MAX_CONNECTIONS
+            )
+        )
+        self._send_semaphore = asyncio.Semaphore(Config.VK_SEND_CONCURRENCY)
+        self.rate_limiter = RateLimiter()
+        # Ответы на нажатия кнопок: сразу или текстом от N8N до срока
+        self.callback_answers = CallbackAnswerer(self.answer_callback_query)
+        self.message_slots = MessageSlots()
+        self.callback_debounce = CallbackDebouncer()
+        self.status_cache = StatusCache()
+        self.keyboards = KeyboardTemplateCache()
+        self.commands = create_default_router(self._status_reply, self._echo_reply)
+        self.traces = TraceStore()
+        # Поток изменений для /api/events
+        self.events = EventBus()
+        if webhook_handler:
+            webhook_handler.trace_mark = self.trace_mark
+            webhook_handler.publish_event = self.publish
+        # Отдельный асинхронный клиент для long polling: соединение держится до POLL_TIME секунд
+        self.poll_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(Config.POLL_TIME + 5, connect=10),
+            limits=httpx.Limits(max_connections=2, max_keepalive_connections=2)
+        )
         self.bot_running = True
-        self.active_chats = {}  # Словарь активных чатов: {chat_id: user_info}
+        self.chats = ChatRegistry()  # Реестр активных чатов с LRU/TTL вытеснением
+        # Общее состояние реплик (в памяти или Redis); long polling ведёт только лидер
+        self.state = state or InMemoryStateBackend()
+        counters = {'n8n': webhook_handler.stats} if webhook_handler else {}
+        self.state.attach(self.chats, counters, self.committed_event_id)
+        # Параллельная обработка чатов с сохранением порядка внутри чата (DISPATCH_WORKERS=0 - по одному)
+        self.dispatcher = EventDispatcher(self._handle_event) if Config.DISPATCH_WORKERS > 0 else None
+        # Режим воркера: событий ждём от процесса long polling, отправляем через него же
+        self.hub = hub
+        # Режим hub: события после локальной обработки передаются воркерам;
+        # event_sink_pending - самый ранний eventId, обработку которого воркер ещё не подтвердил
+        self.event_sink = None
+        self.event_sink_pending: Optional[Callable[[], Optional[int]]] = None
+        self._polling_task: Optional[asyncio.Task] = None
+        self._leadership_task: Optional[asyncio.Task] = None
+        REGISTRY.gauge("vk_active_chats", "Chats in the active chat registry", lambda: len(self.chats))
+        REGISTRY.gauge("vk_last_event_id", "Last processed VK Teams eventId", lambda: self.last_event_id)
+        REGISTRY.gauge("event_stream_subscribers", "Connected /api/events subscribers", lambda: len(self.events))
         
-    def get_events(self) -> Optional[Dict[str, Any]]:
-        """Получить события через long polling"""
+    async def get_events(self) -> Optional[Dict[str, Any]]:
+        """Получить события через long polling; None - событий нет, POLL_FAILED - ошибка запроса"""
         url = f"{self.api_url}/events/get"
         params = {
             'token': self.token,
@@ -34,152 +122,275 @@ class VKTeamsBot:
             'pollTime': Config.POLL_TIME
         }
 
+        started = time.perf_counter()
         try:
-            logger.debug(f"📡 Запрос к API: {url} с параметрами: {params}")
-            response = self.session.get(url, params=params, timeout=Config.POLL_TIME + 5)
-            logger.debug(f"📡 Ответ API: статус {response.status_code}, содержимое: {response.text[:500]}...")
+            poll_logger.debug("📡 Запрос к API: %s с параметрами: %s", url, params)
+            try:
+                response = await self.poll_client.get(url, params=params)
+            finally:
+                GET_EVENTS_DURATION.observe(time.perf_counter() - started)
+            if poll_logger.isEnabledFor(logging.DEBUG):
+                poll_logger.debug("📡 Ответ API: статус %s, содержимое: %s...", response.status_code, response.text[:500])
 
             if response.status_code == 200:
-                data = response.json()
-                logger.debug(f"📊 Полученные события: {data}")
-                return data
+                return response.json()
             else:
-                logger.error(f"❌ Ошибка API: статус {response.status_code}, ответ: {response.text}")
-                return None
+                logger.error("❌ Ошибка API: статус %s, ответ: %s", response.status_code, response.text)
+                return POLL_FAILED
 
-        except requests.exceptions.Timeout:
-            logger.debug("⏱️ Таймаут long polling (нормально)")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Ошибка сетевого запроса: {e}")
+        except httpx.TimeoutException:
+            poll_logger.debug("⏱️ Таймаут long polling (нормально)")
             return None
+        except httpx.HTTPError as e:
+            logger.error("❌ Ошибка сетевого запроса: %s", e)
+            return POLL_FAILED
         except json.JSONDecodeError as e:
-            logger.error(f"❌ Ошибка парсинга JSON: {e}, ответ: {response.text}")
-            return None
+            logger.error("❌ Ошибка парсинга JSON: %s, ответ: %s", e, response.text)
+            return POLL_FAILED
+
+    @staticmethod
+    def _is_rate_limited(response: httpx.Response, response_data: Optional[Dict[str, Any]]) -> bool:
+        """Ответ API означает превышение лимита запросов"""
+        if response.status_code == 429:
+            return True
+        if response_data and not response_data.get('ok', True):
+            description = str(response_data.get('description', '')).lower()
+            return 'rate limit' in description or 'too many requests' in description
+        return False
+
+    async def _post_api(self, method: str, data: Dict[str, Any], chat_id: Optional[str] = None) -> Tuple[httpx.Response, Optional[Dict[str, Any]]]:
+        """
+        POST к Bot API через лимитер частоты. При 429 или ошибке лимита
+        ждём Retry-After (или экспоненциальную паузу) и повторяем вызов.
+        Возвращает ответ и разобранный JSON (None, если ответ не JSON)
+        """
+        url = f"{self.api_url}/{method}"
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(chat_id)
+            async with self._send_semaphore:
+                response = await self.client.post(url, data=data)
+
+            try:
+                response_data = response.json()
+            except (json.JSONDecodeError, ValueError):
+                response_data = None
+
+            if not self._is_rate_limited(response, response_data) or attempt >= Config.VK_RATE_LIMIT_MAX_RETRIES:
+                return response, response_data
+
+            retry_after = response.headers.get('Retry-After')
+            try:
+                delay = float(retry_after) if retry_after else Config.VK_RATE_LIMIT_BACKOFF * (2 ** attempt)
+            except ValueError:
+                delay = Config.VK_RATE_LIMIT_BACKOFF * (2 ** attempt)
+            self.rate_limiter.penalize(delay)
+            attempt += 1
 
-    def send_text(self, chat_id: str, text: str, inline_keyboard_markup: Optional[str] = None) -> bool:
-        """Отправить текстовое сообщение с опциональными кнопками"""
-        url = f"{self.api_url}/messages/sendText"
+    async def send_text(self, chat_id: str, text: str, inline_keyboard_markup: Optional[KeyboardMarkup] = None,
+                        dead_letter: bool = True, slot: Optional[str] = None, edit_in_place: bool = False,
+                        msg_id: Optional[str] = None) -> bool:
+        """
+        Отправить текстовое сообщение с опциональными кнопками.
+        Клавиатура - объект {"inlineKeyboard": [...]} или готовая строка inlineKeyboardMarkup.
+        Временные ошибки (сеть, таймаут, 5xx) повторяются с экспоненциальной паузой и jitter;
+        если доставить не удалось, сообщение сохраняется в dead letters (при dead_letter=True).
+        slot - запомнить отправленное сообщение под этим именем в чате; edit_in_place - отредактировать
+        сообщение слота (или msg_id) через editText, а если не вышло - отправить новое
+        """
+        started = time.perf_counter()
+        success = False
+        try:
+            success = await self._send_text(chat_id, text, inline_keyboard_markup, dead_letter,
+                                            slot, edit_in_place, msg_id)
+            return success
+        finally:
+            duration = time.perf_counter() - started
+            SEND_TEXT_DURATION.labels("ok" if success else "failed").observe(duration)
+            # Воркер отправляет через hub, событие публикует hub
+            if not self.hub:
+                self.publish('send', chat_id=chat_id, ok=success, slot=slot, edit_in_place=edit_in_place,
+                             duration_ms=round(duration * 1000, 1))
+
+    async def _send_text(self, chat_id: str, text: str, inline_keyboard_markup: Optional[KeyboardMarkup],
+                         dead_letter: bool, slot: Optional[str] = None, edit_in_place: bool = False,
+                         msg_id: Optional[str] = None) -> bool:
         data = {
             'token': self.token,
             'chatId': chat_id,
             'text': text
         }
         
-        # Добавляем клавиатуру, если она указана
+        # Добавляем клавиатуру, если она указана (сериализуется один раз)
+        keyboard_json = None
         if inline_keyboard_markup:
             try:
-                # Парсим JSON строку в объект
-                keyboard_obj = json.loads(inline_keyboard_markup)
-                
-                # VK Teams ожидает массив кнопок в поле inlineKeyboardMarkup
-                if 'inlineKeyboard' in keyboard_obj:
-                    data['inlineKeyboardMarkup'] = json.dumps(keyboard_obj['inlineKeyboard'])
-                    logger.info(f"🔘 Добавлены кнопки: {len(keyboard_obj['inlineKeyboard'])} рядов")
-                    
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Ошибка парсинга клавиатуры: {e}")
+                keyboard_json = serialize_keyboard(inline_keyboard_markup)
+            except (json.JSONDecodeError, TypeError, ValueError) as e:
+                logger.error("❌ Ошибка парсинга клавиатуры: %s", e)
                 return False
+            if keyboard_json:
+                data['inlineKeyboardMarkup'] = keyboard_json
 
-        try:
-            logger.debug(f"📤 Отправка сообщения: chat_id={chat_id}, text={text[:50]}{'...' if len(text) > 50 else ''}")
+        if self.hub:
+            return await self.hub.send_text(chat_id, text, keyboard_json, dead_letter, slot, edit_in_place, msg_id)
+
+        if edit_in_place:
+            slot = slot or DEFAULT_SLOT
+            msg_id = msg_id or self.message_slots.get(chat_id, slot)
+            if msg_id and await self._edit_once(data, chat_id, msg_id):
+                self.message_slots.stats['edits'] += 1
+                self.message_slots.set(chat_id, slot, msg_id)
+                EDIT_TEXT_TOTAL.labels("edited").inc()
+                return True
+            self.message_slots.stats['edit_fallbacks'] += 1
+            EDIT_TEXT_TOTAL.labels("fallback").inc()
+
+        send_logger.debug("📤 Отправка сообщения: chat_id=%s, text=%.50s", chat_id, text)
+
+        attempt = 0
+        while True:
+            success, transient, error, sent_msg_id = await self._send_once(data, chat_id, bool(keyboard_json))
+            if success:
+                if slot and sent_msg_id:
+                    self.message_slots.set(chat_id, slot, sent_msg_id)
+                    self.message_slots.stats['sends_tracked'] += 1
+                return True
+            if not transient or attempt >= Config.SEND_MAX_RETRIES:
+                break
+            delay = random.uniform(0, min(Config.SEND_RETRY_MAX_DELAY, Config.SEND_RETRY_BASE_DELAY * (2 ** attempt)))
+            attempt += 1
+            logger.warning("🔁 Повтор отправки в чат %s через %.2f с (попытка %s/%s): %s",
+                           chat_id, delay, attempt, Config.SEND_MAX_RETRIES, error)
+            await asyncio.sleep(delay)
+
+        if dead_letter and self.dead_letters:
+            try:
+                await self.dead_letters.add(
+                    'sendText', chat_id,
+                    {'text': text, 'inline_keyboard_markup': keyboard_json},
+                    error, attempt + 1
+                )
+            except Exception as e:
+                logger.error("❌ Не удалось сохранить dead letter: %s", e)
+        return False
 
+    async def _send_once(self, data: Dict[str, Any], chat_id: str, has_keyboard: bool) -> Tuple[bool, bool, str, str]:
+        """Одна попытка sendText: (успех, временная ли ошибка, описание ошибки, msgId)"""
+        try:
             # Всегда используем form data
-            response = self.session.post(url, data=data)
+            response, response_data = await self._post_api('messages/sendText', data, chat_id)
             
-            logger.debug(f"📬 Полный ответ API: статус {response.status_code}, содержимое: {response.text}")
+            if send_logger.isEnabledFor(logging.DEBUG):
+                send_logger.debug("📬 Полный ответ API: статус %s, содержимое: %s", response.status_code, response.text)
 
             if response.status_code == 200:
-                try:
-                    response_data = response.json()
-                    if response_data.get('ok', False):
-                        logger.info(f"✅ Сообщение{'с кнопками ' if inline_keyboard_markup else ''}УСПЕШНО отправлено в чат {chat_id}")
-                        return True
-                    else:
-                        logger.error(f"❌ API вернул ошибку: {response_data}")
-                        return False
-                except json.JSONDecodeError:
-                    logger.warning(f"⚠️ Не удалось парсить JSON ответ: {response.text}")
-                    logger.info(f"✅ Сообщение отправлено в чат {chat_id} (статус 200)")
-                    return True
+                if response_data is None:
+                    logger.warning("⚠️ Не удалось парсить JSON ответ: %s", response.text)
+                    return True, False, "", ""
+                if response_data.get('ok', False):
+                    send_logger.debug("✅ Сообщение %sотправлено в чат %s", "с кнопками " if has_keyboard else "", chat_id)
+                    return True, False, "", str(response_data.get('msgId', ''))
+                else:
+                    logger.error("❌ API вернул ошибку: %s", response_data)
+                    # Ошибка лимита, не снятая повторами лимитера, тоже временная
+                    return False, self._is_rate_limited(response, response_data), f"API error: {response_data}", ""
             else:
-                logger.error(f"❌ Ошибка отправки: статус {response.status_code}, ответ: {response.text}")
-                return False
+                logger.error("❌ Ошибка отправки: статус %s, ответ: %s", response.status_code, response.text)
+                transient = response.status_code >= 500 or response.status_code == 429
+                return False, transient, f"HTTP {response.status_code}: {response.text[:200]}", ""
 
+        except httpx.TransportError as e:
+            logger.error("❌ Сетевая ошибка при отправке: %r", e)
+            return False, True, f"Transport error: {e!r}", ""
         except Exception as e:
-            logger.error(f"❌ Исключение при отправке: {e}")
+            logger.error("❌ Исключение при отправке: %s", e)
+            return False, False, f"Exception: {e}", ""
+
+    async def _edit_once(self, data: Dict[str, Any], chat_id: str, msg_id: str) -> bool:
+        """Одна попытка editText; при любой ошибке вызывающий отправляет новое сообщение"""
+        try:
+            response, response_data = await self._post_api('messages/editText', {**data, 'msgId': msg_id}, chat_id)
+        except httpx.HTTPError as e:
+            logger.warning("⚠️ Сетевая ошибка editText в чате %s: %r", chat_id, e)
             return False
+        if response.status_code == 200 and response_data and response_data.get('ok', False):
+            send_logger.debug("✏️ Сообщение %s в чате %s обновлено", msg_id, chat_id)
+            return True
+        logger.warning("⚠️ editText %s в чате %s не удался (статус %s: %s), отправляем новое сообщение",
+                       msg_id, chat_id, response.status_code, response.text[:200])
+        return False
+
+    async def replay_dead_letter(self, entry: Dict[str, Any]) -> bool:
+        """Переотправить сообщение из dead letters (без повторного сохранения при неудаче)"""
+        payload = entry.get('payload', {})
+        return await self.send_text(
+            entry['chat_id'],
+            payload.get('text', ''),
+            payload.get('inline_keyboard_markup'),
+            dead_letter=False
+        )
+
+    def track_chat(self, event: Dict[str, Any]) -> Tuple[str, str, str]:
+        """Сохранить информацию об активном чате; возвращает chat_id, имя и id отправителя"""
+        payload = event.get('payload', {})
+        sender = payload.get('from', {})
+        chat_id = payload.get('chat', {}).get('chatId', '')
+        user_name = f"{sender.get('firstName', '')} {sender.get('lastName', '')}"
+        user_id = sender.get('userId', '')
+        record, created = self.chats.touch(chat_id, user_name.strip(), user_id)
+        # Воркер ведёт только локальную копию реестра, чаты учитывает hub
+        if not self.hub:
+            self.publish('chat_new' if created else 'chat_message', chat_id=chat_id, user_name=record.user_name,
+                         user_id=user_id, message_count=record.message_count)
+        return chat_id, user_name, user_id
 
-    def handle_message(self, event: Dict[str, Any]):
+    async def handle_message(self, event: Dict[str, Any]):
         """Обработчик сообщений"""
         try:
-            payload = event.get('payload', {})
-            chat = payload.get('chat', {})
-            sender = payload.get('from', {})
+            message_text = event.get('payload', {}).get('text', '')
+            chat_id, user_name, user_id = self.track_chat(event)
 
-            message_text = payload.get('text', '')
-            chat_id = chat.get('chatId', '')
-            user_name = f"{sender.get('firstName', '')} {sender.get('lastName', '')}"
-            user_id = sender.get('userId', '')
+            logger.info("💬 Сообщение от %s в чате %s: %s", user_name, chat_id, message_text)
 
-            logger.info(f"💬 Сообщение от {user_name} в чате {chat_id}: {message_text}")
-            
-            # Сохраняем информацию об активном чате
-            self.active_chats[chat_id] = {
-                'user_name': user_name.strip(),
-                'user_id': user_id,
-                'last_message_time': datetime.now().isoformat(),
-                'message_count': self.active_chats.get(chat_id, {}).get('message_count', 0) + 1
-            }
-
-            # Отправляем сообщение во внешний webhook (если настроен)
-            if self.webhook_handler:
-                self.webhook_handler.send_to_n8n_webhook(event)
-
-            # Игнорируем пустые сообщения
+            trace_id = event.get('traceId')
+
+            # Пустые сообщения (файлы, стикеры) только пересылаются в N8N
             if not message_text:
+                if not await self.forward_to_n8n(event):
+                    self.trace_mark(trace_id, 'discarded')
                 return
 
-            # Обработка команд
-            if message_text == "/start":
-                welcome_text = "Привет! Я VK Teams бот для распределения стендов под тестирование в команде фронтенда ВК Билетов"
-                self.send_text(chat_id, welcome_text)
-
-            elif message_text == "/help":
-                help_text = (
-                    "Доступные команды:\n"
-                    "/start - начать работу с ботом\n"
-                    "/help - показать эту справку\n"
-                    "/status - показать статус бота\n\n"
-                    "Логика работы\n"
-                    "Я отправлю тебе группу кнопок для взаимодействие со стендами.\n"
-                    "- Кнопка 'update' - обновит информацию о стендах и пришлет кнопки с актуальным состоянием.\n"
-                    "- Кнопки с названием стенда отвечают за взаимодействие с ним и имеют цветовую индикацию.\n"
-                    "- Если кнопка зеленая, то стенд доступен, и при клике на неё стенд занимает пользователь\n"
-                    "- Если кнопка желтая, то стенд занят текущим пользователем, и при клике на неё стенд освобождается.\n"
-                    "- Если кнопка красная, то стенд занят другим пользователем, и при клике на неё выведется сообщение о том, кем занят стенд.\n"
-                )
-                self.send_text(chat_id, help_text)
-                
-            elif message_text == "/status":
-                status_text = (
-                    f"🤖 Статус бота: Активен\n"
-                    f"📊 Активных чатов: {len(self.active_chats)}\n"
-                    f"🔗 API URL: {Config.BOT_API_URL}\n"
-                    f"📡 N8N Webhook: {'✅ Настроен' if Config.N8N_WEBHOOK_URL else '❌ Не настроен'}"
-                )
-                self.send_text(chat_id, status_text)
-
-            elif not message_text.startswith("/"):
-                # Эхо-ответ для обычных сообщений
-                echo_text = f"Эхо: {message_text}"
-                self.send_text(chat_id, echo_text)
+            # Команды из таблицы: статические отвечаются сразу, без пересылки в N8N
+            route, args = self.commands.resolve(message_text)
+            forwarded = route.forwards_to_n8n and await self.forward_to_n8n(event)
+            replied = False
+            if route.replies_locally:
+                reply = await route.reply(CommandContext(chat_id, user_id, user_name.strip(), message_text, args, event))
+                if reply:
+                    replied = await self.send_text(chat_id, reply)
+            # Событие, ушедшее в N8N, ждёт его ответа; иначе трасса закрывается локальным ответом
+            if not forwarded:
+                self.trace_mark(trace_id, 'vk_sent' if replied else 'discarded')
 
         except Exception as e:
-            logger.error(f"❌ Ошибка обработки сообщения: {e}")
+            logger.error("❌ Ошибка обработки сообщения: %s", e)
+
+    async def _status_reply(self, context: CommandContext) -> str:
+        """Ответ на /status"""
+        return (
+            f"🤖 Статус бота: Активен\n"
+            f"📊 Активных чатов: {await self.state.chat_count()}\n"
+            f"🔗 API URL: {Config.BOT_API_URL}\n"
+            f"📡 N8N Webhook: {'✅ Настроен' if Config.N8N_WEBHOOK_URL else '❌ Не настроен'}"
+        )
+
+    async def _echo_reply(self, context: CommandContext) -> str:
+        """Эхо-ответ для обычных сообщений"""
+        return f"Эхо: {context.text}"
 
-    def handle_callback_query(self, event: Dict[str, Any]):
-        """Обработчик нажатий на кнопки"""
+    async def handle_callback_query(self, event: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None):
+        """Обработчик нажатий на кнопки (local_action - результат уже выполненной обработки стенда)"""
         try:
             payload = event.get('payload', {})
             callback_data = payload.get('callbackData', '')
@@ -190,60 +401,391 @@ class VKTeamsBot:
             sender = payload.get('from', {})
             user_name = f"{sender.get('firstName', '')} {sender.get('lastName', '')}"
             
-            logger.info(f"🔘 Нажатие кнопки от {user_name} в чате {chat_id}: {callback_data}")
+            logger.info("🔘 Нажатие кнопки от %s в чате %s: %s", user_name, chat_id, callback_data)
+            
+            # Кнопки стендов обрабатываются локально, N8N получает событие для побочных действий.
+            # В режиме воркера это (и отсев повторных нажатий) уже сделал hub
+            if local_action is None and not self.hub:
+                if self.suppress_repeated_click(event) or await self.serve_cached_status(event):
+                    return
+                local_action = await self.process_callback_locally(event)
             
             # Отправляем событие в webhook (если настроен)
-            if self.webhook_handler:
-                self.webhook_handler.send_to_n8n_webhook(event)
+            if not await self.forward_to_n8n(event, local_action):
+                self.trace_mark(event.get('traceId'), 'discarded')
             
             # Простая обработка - отправляем подтверждение
             # self.send_text(chat_id, f"Вы нажали: {callback_data}")
                 
         except Exception as e:
-            logger.error(f"❌ Ошибка обработки callback: {e}")
+            logger.error("❌ Ошибка обработки callback: %s", e)
+
+    async def forward_to_n8n(self, event: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None) -> bool:
+        """Поставить событие в очередь N8N; False - N8N не настроен или очередь переполнена"""
+        if not self.webhook_handler:
+            return False
+        return await self.webhook_handler.send_to_n8n_webhook(event, local_action)
+
+    async def handle_stand_callback(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Обработать нажатие кнопки стенда встроенным движком; None - нажатие не про стенды"""
+        payload = event.get('payload', {})
+        callback_data = payload.get('callbackData', '')
+        if not self.stands or not self.stands.handles(callback_data):
+            return None
+        chat_id = payload.get('message', {}).get('chat', {}).get('chatId', '')
+        sender = payload.get('from', {})
+        user_name = f"{sender.get('firstName', '')} {sender.get('lastName', '')}".strip()
+        result = await self.stands.handle_callback(callback_data, sender.get('userId', ''), user_name)
+        # Всплывающий ответ - первая строка результата, полный статус приходит сообщением
+        self.callback_answers.answer_now(payload.get('queryId', ''), result.text.split('\n', 1)[0])
+        # Статус обновляется в сообщении, кнопку которого нажали
+        if await self.send_text(chat_id, result.text, result.keyboard, slot=STANDS_SLOT,
+                                edit_in_place=Config.STANDS_EDIT_IN_PLACE,
+                                msg_id=payload.get('message', {}).get('msgId')):
+            self.trace_mark(event.get('traceId'), 'vk_sent')
+        return result.to_dict()
+
+    def suppress_repeated_click(self, event: Dict[str, Any]) -> bool:
+        """
+        Повторное нажатие той же кнопки тем же пользователем в окне CALLBACK_DEBOUNCE_MS:
+        подтверждаем его, чтобы пропал индикатор загрузки, но не обрабатываем и не пересылаем в N8N
+        """
+        payload = event.get('payload', {})
+        chat_id = payload.get('message', {}).get('chat', {}).get('chatId', '')
+        user_id = payload.get('from', {}).get('userId', '')
+        callback_data = payload.get('callbackData', '')
+        if not self.callback_debounce.should_suppress(user_id, chat_id, callback_data):
+            return False
+        CALLBACKS_SUPPRESSED.inc()
+        logger.info("🔂 Повторное нажатие %s от %s в чате %s пропущено", callback_data, user_id, chat_id)
+        self.callback_answers.answer_now(payload.get('queryId', ''), Config.CALLBACK_ANSWER_TEXT)
+        self.trace_mark(event.get('traceId'), 'discarded')
+        return True
+
+    async def serve_cached_status(self, event: Dict[str, Any]) -> bool:
+        """
+        Нажатие update при свежем статусе от N8N в кэше: ответить из кэша, не пересылая в N8N.
+        Если стенды ведёт встроенный движок, update обрабатывает он
+        """
+        payload = event.get('payload', {})
+        callback_data = payload.get('callbackData', '')
+        if callback_data != Config.STATUS_CACHE_CALLBACK or (self.stands and self.stands.handles(callback_data)):
+            return False
+        entry = self.status_cache.lookup(payload.get('from', {}).get('userId', ''))
+        if entry is None:
+            return False
+        message = payload.get('message', {})
+        chat_id = message.get('chat', {}).get('chatId', '')
+        logger.info("📦 Статус для чата %s отдан из кэша (возраст %.1f с)", chat_id, entry.age())
+        self.callback_answers.answer_now(payload.get('queryId', ''), Config.CALLBACK_ANSWER_TEXT)
+        if await self.send_text(chat_id, entry.text, entry.keyboard, slot=STANDS_SLOT,
+                                edit_in_place=Config.STANDS_EDIT_IN_PLACE, msg_id=message.get('msgId')):
+            self.trace_mark(event.get('traceId'), 'vk_sent')
+        return True
+
+    def trace_mark(self, trace_id: Optional[str], stage: str, at: Optional[float] = None):
+        """Отметить этап трассы (в режиме воркера трассы хранятся в процессе long polling)"""
+        if not trace_id:
+            return
+        if self.hub:
+            self.hub.notify('trace', trace_id=trace_id, stage=stage, at=at if at is not None else time.time())
+        else:
+            self.traces.mark(trace_id, stage, at)
+
+    def publish(self, event_type: str, **data):
+        """
+        Событие для /api/events. Воркер передаёт его в hub (только пока у кого-то есть подписчики),
+        hub раздаёт события всем воркерам - поток одинаков в любом воркере
+        """
+        if self.hub:
+            if self.hub.events_active:
+                self.hub.notify('publish', event_type=event_type, data=data)
+        else:
+            self.events.publish(event_type, **data)
+
+    async def slow_traces(self, limit: int) -> Dict[str, Any]:
+        """Самые долгие из последних взаимодействий и счётчики трасс"""
+        if self.hub:
+            return await self.hub.request('traces', limit=limit)
+        return {**self.traces.get_stats(), "slowest": self.traces.slowest(limit)}
+
+    async def store_status(self, audience: str, text: str, keyboard: Optional[KeyboardMarkup] = None):
+        """Сохранить ответ N8N в кэш статуса (в режиме воркера - в кэш процесса long polling)"""
+        keyboard_json = serialize_keyboard(keyboard)
+        if self.hub:
+            await self.hub.request('status_cache', action='store', audience=audience, text=text, keyboard=keyboard_json)
+        else:
+            self.status_cache.store(audience, text, keyboard_json)
+
+    async def invalidate_status(self, audience: Optional[str] = None) -> int:
+        """Сбросить запись аудитории или весь кэш статуса"""
+        if self.hub:
+            return await self.hub.request('status_cache', action='invalidate', audience=audience)
+        return self.status_cache.invalidate(audience)
+
+    async def status_cache_stats(self) -> Dict[str, Any]:
+        if self.hub:
+            return await self.hub.request('status_cache', action='stats')
+        return self.status_cache.get_stats()
+
+    async def put_keyboard_template(self, template_id: str, version: int, markup: Dict[str, Any]):
+        """Зарегистрировать шаблон клавиатуры (в режиме воркера - в hub, общий для всех воркеров)"""
+        if self.hub:
+            await self.hub.request('keyboards', action='put', template_id=template_id, version=version, markup=markup)
+        else:
+            self.keyboards.put_template(template_id, version, markup)
+
+    async def render_keyboard(self, ref: KeyboardTemplateRef) -> str:
+        """Готовая строка inlineKeyboardMarkup по шаблону; KeyboardTemplateError - шаблона нет или версия устарела"""
+        if self.hub:
+            result = await self.hub.request('keyboards', action='render', ref=ref.model_dump())
+            if 'error' in result:
+                raise KeyboardTemplateError(result['error'])
+            return result['keyboard']
+        return self.keyboards.render(ref)
+
+    async def keyboard_stats(self) -> Dict[str, Any]:
+        if self.hub:
+            return await self.hub.request('keyboards', action='stats')
+        return self.keyboards.get_stats()
+
+    async def process_callback_locally(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Кнопка стенда обрабатывается сразу, остальные нажатия подтверждаются и ждут N8N"""
+        local_action = await self.handle_stand_callback(event)
+        if local_action is None:
+            self.callback_answers.expect(event.get('payload', {}).get('queryId', ''))
+        return local_action
+
+    async def answer_callback_query(self, query_id: str, text: str = "", show_alert: bool = False,
+                                    url: Optional[str] = None) -> bool:
+        """Ответить на нажатие кнопки (messages/answerCallbackQuery)"""
+        data = {
+            'token': self.token,
+            'queryId': query_id,
+            'text': text,
+            'showAlert': 'true' if show_alert else 'false'
+        }
+        if url:
+            data['url'] = url
+        try:
+            response, response_data = await self._post_api('messages/answerCallbackQuery', data)
+        except httpx.HTTPError as e:
+            logger.error("❌ Сетевая ошибка answerCallbackQuery: %r", e)
+            return False
+        if response.status_code == 200 and response_data and response_data.get('ok', False):
+            send_logger.debug("☑️ Ответ на нажатие %s отправлен", query_id)
+            return True
+        logger.error("❌ answerCallbackQuery: статус %s, ответ: %s", response.status_code, response.text[:200])
+        return False
+
+    async def _dispatch_event(self, event: Dict[str, Any]):
+        """Режим hub: учесть чат и стенды здесь, остальную обработку передать воркеру"""
+        local_action = None
+        try:
+            if event.get('type') == 'newMessage':
+                self.track_chat(event)
+            elif event.get('type') == 'callbackQuery':
+                if self.suppress_repeated_click(event) or await self.serve_cached_status(event):
+                    return
+                local_action = await self.process_callback_locally(event)
+        except Exception as e:
+            logger.error("❌ Ошибка обработки события в hub: %s", e)
+        await self.event_sink(event, local_action)
 
-    def polling_loop(self):
-        """Цикл long polling"""
+    async def _handle_event(self, event: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None):
+        """Обработать событие: в режиме hub - передать воркеру, иначе обработчиком по типу"""
+        event_type = event.get('type', '')
+        try:
+            if self.event_sink:
+                await self._dispatch_event(event)
+            elif event_type == 'newMessage':
+                poll_logger.debug("📩 Обрабатываем новое сообщение: %s", event)
+                await self.handle_message(event)
+            elif event_type == 'callbackQuery':
+                poll_logger.debug("🔘 Обрабатываем нажатие кнопки: %s", event)
+                await self.handle_callback_query(event, local_action)
+        except asyncio.CancelledError:
+            # Воркер остановлен посреди обработки: без подтверждения hub передаст событие повторно
+            raise
+        except Exception:
+            self._ack_event(event)
+            raise
+        self._ack_event(event)
+
+    def _ack_event(self, event: Dict[str, Any]):
+        """Воркер: hub держит событие неподтверждённым (и не сдвигает чекпоинт), пока мы его не обработали"""
+        if self.hub:
+            self.hub.ack(event)
+
+    async def dispatch(self, event: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None):
+        """Передать событие в шард его чата (или обработать сразу, если диспетчер выключен)"""
+        if self.dispatcher:
+            await self.dispatcher.submit(event, local_action)
+        else:
+            await self._handle_event(event, local_action)
+
+    def committed_event_id(self) -> int:
+        """Позиция, до которой все события обработаны (для чекпоинта и общего состояния)"""
+        committed = self.dispatcher.safe_event_id(self.last_event_id) if self.dispatcher else self.last_event_id
+        pending = self.event_sink_pending() if self.event_sink_pending else None
+        if pending is not None:
+            committed = min(committed, pending - 1)
+        return committed
+
+    async def polling_loop(self):
+        """Цикл long polling в event loop приложения"""
         logger.info("🔄 Long polling запущен...")
 
         while self.bot_running:
             try:
-                events = self.get_events()
+                # Следующий long poll стартует сразу после возврата предыдущего:
+                # сервер сам держит запрос до POLL_TIME, пауза между запросами не нужна
+                events = await self.get_events()
+                if events is POLL_FAILED:
+                    await self._poll_backoff()
+                    continue
+                self.poll_failures = 0
 
                 if events and 'events' in events:
-                    logger.debug(f"📨 Получено {len(events['events'])} событий")
+                    poll_logger.debug("📨 Получено %d событий", len(events['events']))
+                    EVENTS_PER_POLL.observe(len(events['events']))
+                    await self.recorder.record(events['events'])
+                    processed = 0
                     for event in events['events']:
                         event_id = event.get('eventId', 0)
                         event_type = event.get('type', '')
 
-                        logger.debug(f"🎯 Событие ID: {event_id}, Тип: {event_type}")
+                        poll_logger.debug("🎯 Событие ID: %s, Тип: %s", event_id, event_type)
+                        EVENTS_TOTAL.labels(event_type).inc()
 
-                        if event_id > self.last_event_id:
-                            self.last_event_id = event_id
+                        if self._is_duplicate(event_id):
+                            poll_logger.debug("♻️ Повтор события ID: %s, пропускаем", event_id)
+                            continue
+                        processed += 1
 
-                        if event_type == 'newMessage':
-                            logger.debug(f"📩 Обрабатываем новое сообщение: {event}")
-                            self.handle_message(event)
-                        elif event_type == 'callbackQuery':
-                            logger.debug(f"🔘 Обрабатываем нажатие кнопки: {event}")
-                            self.handle_callback_query(event)
+                        if event_type in ('newMessage', 'callbackQuery'):
+                            trace_id = self.traces.start(event)
+                            if trace_id:
+                                event['traceId'] = trace_id
+                            await self.dispatch(event)
                         else:
-                            logger.debug(f"⏭️ Пропускаем событие типа: {event_type}")
+                            poll_logger.debug("⏭️ Пропускаем событие типа: %s", event_type)
+
+                        # Позиция сдвигается после передачи: прерванная передача не считается обработанной
+                        if event_id > self.last_event_id:
+                            self.last_event_id = event_id
 
-                time.sleep(1)
+                    await self.checkpoint.advance(self.committed_event_id(), processed)
 
-            except KeyboardInterrupt:
-                logger.info("🛑 Получен сигнал остановки long polling.")
-                self.bot_running = False
-                break
+            except asyncio.CancelledError:
+                logger.info("🛑 Long polling остановлен.")
+                raise
             except Exception as e:
-                logger.error(f"❌ Ошибка в polling loop: {e}")
-                time.sleep(5)
+                logger.error("❌ Ошибка в polling loop: %s", e)
+                await self._poll_backoff()
+
+    async def _poll_backoff(self):
+        """Пауза после неудачного опроса: экспоненциальная по числу ошибок подряд, с jitter"""
+        delay = min(Config.POLL_RETRY_MAX_DELAY, Config.POLL_RETRY_BASE_DELAY * (2 ** self.poll_failures))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.poll_failures += 1
+        self.poll_errors += 1
+        logger.warning("⏳ Повтор long polling через %.1f с (ошибок подряд: %s)", delay, self.poll_failures)
+        await asyncio.sleep(delay)
+
+    def _is_duplicate(self, event_id: int) -> bool:
+        """Событие уже обрабатывалось (проверка по ограниченному LRU недавних eventId)"""
+        if not event_id:
+            return False
+        if event_id in self._seen_event_ids:
+            self._seen_event_ids.move_to_end(event_id)
+            self.duplicate_events += 1
+            return True
+        self._seen_event_ids[event_id] = None
+        if len(self._seen_event_ids) > Config.DEDUP_CACHE_SIZE:
+            self._seen_event_ids.popitem(last=False)
+        return False
+
+    async def start(self):
+        """Запустить long polling как задачу в текущем event loop"""
+        if self._polling_task and not self._polling_task.done():
+            return
+        self.bot_running = True
+        await self.state.start()
+        if self.dispatcher:
+            await self.dispatcher.start()
+        if self.hub:
+            self.hub.attach(self)
+            await self.hub.start()
+            logger.info("🤖 Воркер %s запущен, события приходят от hub", self.hub.worker_id)
+        elif self.state.requires_election:
+            # Несколько реплик: long polling запускает только выбранный лидер
+            self._leadership_task = asyncio.create_task(self._leadership_loop())
+            logger.info("🤖 VK Teams бот запущен, ожидаем выбора лидера long polling")
+        else:
+            self._polling_task = asyncio.create_task(self.polling_loop())
+            logger.info("🤖 VK Teams бот запущен в event loop приложения")
+
+    async def _leadership_loop(self):
+        """Захватывать и продлевать лидерство; при потере - останавливать long polling"""
+        while self.bot_running:
+            if self.state.is_leader:
+                if not await self.state.renew_leadership():
+                    logger.warning("⚠️ Лидерство long polling потеряно, останавливаем опрос")
+                    await self._stop_polling()
+            elif await self.state.try_acquire_leadership():
+                # Продолжаем с позиции предыдущего лидера
+                self.last_event_id = max(self.last_event_id, await self.state.load_offset())
+                self._polling_task = asyncio.create_task(self.polling_loop())
+            await asyncio.sleep(Config.LEADER_RENEW_INTERVAL)
+
+    async def _stop_polling(self):
+        """Остановить задачу long polling"""
+        if self._polling_task:
+            self._polling_task.cancel()
+            try:
+                await self._polling_task
+            except asyncio.CancelledError:
+                pass
+            self._polling_task = None
+
+    async def shutdown(self):
+        """Остановить long polling и закрыть HTTP клиенты"""
+        self.stop()
+        if self._leadership_task:
+            self._leadership_task.cancel()
+            await asyncio.gather(self._leadership_task, return_exceptions=True)
+            self._leadership_task = None
+        await self._stop_polling()
+        if self.dispatcher:
+            await self.dispatcher.close()
+            await self.checkpoint.advance(self.committed_event_id(), 0)
+        if self.hub:
+            await self.hub.close()
+        await self.callback_answers.close()
+        await self.checkpoint.flush()
+        await self.recorder.close()
+        await self.state.close()
+        await self.poll_client.aclose()
+        await self.client.aclose()
 
     def stop(self):
         """Остановить бота"""
         self.bot_running = False
         
+    def get_polling_stats(self) -> Dict[str, Any]:
+        """Состояние long polling: позиция, повторы, чекпоинт"""
+        return {
+            "last_event_id": self.last_event_id,
+            "duplicates_dropped": self.duplicate_events,
+            "poll_errors": self.poll_errors,
+            "poll_failures_in_row": self.poll_failures,
+            "checkpoint": self.checkpoint.get_stats(),
+            "recorder": self.recorder.get_stats(),
+            "dispatcher": self.dispatcher.get_stats() if self.dispatcher else None,
+            "commands": self.commands.get_stats()
+        }
+
     def get_active_chats(self) -> Dict[str, Any]:
-        """Получить информацию об активных чатах"""
-        return self.active_chats.copy()
+        """Полный снимок активных чатов (O(n); для API используйте self.chats.page)"""
+        return self.chats.to_dict()
\ No newline at end of file
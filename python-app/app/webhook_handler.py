@@ -2,16 +2,24 @@
 Webhook Handler - обработка интеграции с N8N
 Упрощенная версия без избыточности
 """
+import asyncio
+import gzip
 import logging
-import requests
+import httpx
 import json
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from pydantic import BaseModel
 
 from .config import Config
+from .keyboards import KeyboardTemplateRef
+from .metrics import REGISTRY, N8N_FORWARD_DURATION
 
 logger = logging.getLogger(__name__)
+# Записи о каждом событии для N8N (прореживаются через LOG_DEBUG_SAMPLING)
+n8n_logger = logging.getLogger(f"{__name__}.n8n")
 
 class IncomingWebhookMessage(BaseModel):
     """Модель для входящего webhook сообщения от N8N"""
@@ -19,85 +27,297 @@ class IncomingWebhookMessage(BaseModel):
     message: str
     message_type: str = "text"
     inline_keyboard_markup: Optional[Dict[str, Any]] = None  # JSON объект с клавиатурой VK Teams
+    keyboard_template: Optional[KeyboardTemplateRef] = None  # Ссылка на шаблон вместо всей клавиатуры
+    edit_in_place: bool = False  # отредактировать последнее сообщение слота вместо отправки нового
+    keyboard_slot: Optional[str] = None  # имя слота сообщения в чате (по умолчанию "default")
+    cache_as: Optional[str] = None  # запомнить как статус аудитории: "shared" или "user:<userId>"
+    trace_id: Optional[str] = None  # trace_id события, на которое отвечает N8N
+
+class StatusCacheEntryRequest(BaseModel):
+    """Статус стендов от N8N для ответа на update из кэша"""
+    message: str
+    inline_keyboard_markup: Optional[Dict[str, Any]] = None
+    keyboard_template: Optional[KeyboardTemplateRef] = None
+
+class CallbackAnswerRequest(BaseModel):
+    """Ответ N8N на нажатие кнопки (query_id из события)"""
+    query_id: str
+    text: str = ""
+    show_alert: bool = False
+    url: Optional[str] = None
+
+# Верхние границы корзин гистограммы размеров пачек
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100)
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль по заранее отсортированной выборке"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
 
 class WebhookHandler:
     """Обработчик webhooks для интеграции с N8N"""
     
     def __init__(self):
         self.n8n_webhook_url = Config.N8N_WEBHOOK_URL
-        self.session = requests.Session()
+        self.client = httpx.AsyncClient(
+            timeout=Config.N8N_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=Config.N8N_WORKERS,
+                max_keepalive_connections=Config.N8N_WORKERS
+            )
+        )
+        # Очередь пересылки: (время постановки, данные для N8N)
+        self.queue: asyncio.Queue[Tuple[float, Dict[str, Any]]] = asyncio.Queue(maxsize=Config.N8N_QUEUE_SIZE)
+        self._workers: List[asyncio.Task] = []
+        self._flush_tasks: set = set()
+        self._flush_slots = asyncio.Semaphore(Config.N8N_WORKERS)
+        self._delivery_latencies = deque(maxlen=1000)  # мс от постановки в очередь до доставки
         self.stats = {
             'messages_sent_to_n8n': 0,
             'messages_received_from_n8n': 0,
+            'n8n_send_errors': 0,
+            'n8n_events_dropped': 0,
             'last_n8n_send': None,
             'last_n8n_receive': None
         }
+        self.batch_stats = {
+            'batches_sent': 0,
+            'flush_reasons': {'size': 0, 'linger': 0, 'shutdown': 0},
+            'size_histogram': {str(bound): 0 for bound in BATCH_SIZE_BUCKETS}
+        }
+        self.batch_stats['size_histogram']['+Inf'] = 0
+        # Отметка этапа трассы (задаёт бот): trace_mark(trace_id, stage, at)
+        self.trace_mark: Optional[Callable[[Optional[str], str, Optional[float]], None]] = None
+        # Публикация событий в /api/events (задаёт бот): publish_event(тип, **данные)
+        self.publish_event: Optional[Callable[..., None]] = None
+        REGISTRY.gauge("n8n_queue_depth", "Events waiting in the N8N forwarding queue", self.queue.qsize)
+        REGISTRY.gauge("n8n_queue_capacity", "Capacity of the N8N forwarding queue", lambda: self.queue.maxsize)
+
+    def build_n8n_payload(self, event_data: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Подготовить структурированные данные события VK Teams для N8N.
+        local_action - действие, уже выполненное ботом локально (например, бронь стенда)
+        """
+        payload = event_data.get('payload', {})
+        event_type = event_data.get('type', 'new_message')  # Используем реальный тип события
+        
+        # Извлекаем chat_id в зависимости от типа события
+        if event_type == 'callbackQuery':
+            chat_id = payload.get('message', {}).get('chat', {}).get('chatId', '')
+        else:
+            chat_id = payload.get('chat', {}).get('chatId', '')
+        
+        webhook_data = {
+            "timestamp": datetime.now().isoformat(),
+            "source": "vk_teams",
+            "event_type": event_type,
+            "trace_id": event_data.get('traceId'),  # вернуть в /api/webhook для замера времени ответа
+            "data": {
+                "text": payload.get('text', ''),
+                "chat_id": chat_id,
+                "user_name": f"{payload.get('from', {}).get('firstName', '')} {payload.get('from', {}).get('lastName', '')}".strip(),
+                "user_id": payload.get('from', {}).get('userId', ''),
+                "timestamp": payload.get('timestamp', 0),
+                "msg_id": payload.get('msgId', ''),
+                "callback_data": payload.get('callbackData'),  # Добавляем данные кнопки
+                "query_id": payload.get('queryId')  # для ответа через /api/callback-answer
+            }
+        }
+        if local_action:
+            webhook_data["local_action"] = local_action
+        return webhook_data
         
-    def send_to_n8n_webhook(self, event_data: Dict[str, Any]) -> bool:
-        """Отправить событие VK Teams в N8N"""
+    async def send_to_n8n_webhook(self, event_data: Dict[str, Any], local_action: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Поставить событие VK Teams в очередь на отправку в N8N.
+        Возвращает True, если событие принято в очередь.
+        """
         if not self.n8n_webhook_url:
             logger.debug("⚠️ N8N_WEBHOOK_URL не настроен, пропускаем отправку")
             return False
 
+        item = (time.monotonic(), self.build_n8n_payload(event_data, local_action))
         try:
-            # Подготавливаем структурированные данные для N8N
-            payload = event_data.get('payload', {})
-            event_type = event_data.get('type', 'new_message')  # Используем реальный тип события
-            
-            # Извлекаем chat_id в зависимости от типа события
-            if event_type == 'callbackQuery':
-                chat_id = payload.get('message', {}).get('chat', {}).get('chatId', '')
-            else:
-                chat_id = payload.get('chat', {}).get('chatId', '')
-            
-            webhook_data = {
-                "timestamp": datetime.now().isoformat(),
-                "source": "vk_teams",
-                "event_type": event_type,
-                "data": {
-                    "text": payload.get('text', ''),
-                    "chat_id": chat_id,
-                    "user_name": f"{payload.get('from', {}).get('firstName', '')} {payload.get('from', {}).get('lastName', '')}".strip(),
-                    "user_id": payload.get('from', {}).get('userId', ''),
-                    "timestamp": payload.get('timestamp', 0),
-                    "msg_id": payload.get('msgId', ''),
-                    "callback_data": payload.get('callbackData')  # Добавляем данные кнопки
-                }
-            }
-            
-            logger.info(f"➡️ Отправляем событие в N8N: {self.n8n_webhook_url}")
-            logger.debug(f"📦 Данные: {json.dumps(webhook_data, ensure_ascii=False, indent=2)[:200]}...")
-            
-            response = self.session.post(
-                self.n8n_webhook_url, 
-                json=webhook_data, 
-                timeout=10,
-                headers={'Content-Type': 'application/json'}
-            )
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        # Очередь заполнена: ограниченно притормаживаем приём, затем отбрасываем событие
+        try:
+            await asyncio.wait_for(self.queue.put(item), timeout=Config.N8N_QUEUE_PUT_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            self.stats['n8n_events_dropped'] += 1
+            logger.warning("⚠️ Очередь N8N переполнена (%s), событие отброшено", self.queue.maxsize)
+            if self.publish_event:
+                self.publish_event('n8n_forward', status='dropped', events=1,
+                                   chat_ids=[item[1]['data']['chat_id']], duration_ms=0.0)
+            return False
+
+    async def _worker_loop(self, worker_id: int):
+        """Воркер: забирает события из очереди и доставляет их в N8N по одному"""
+        while True:
+            enqueued_at, webhook_data = await self.queue.get()
+            try:
+                if await self._deliver(webhook_data):
+                    self._delivery_latencies.append((time.monotonic() - enqueued_at) * 1000)
+            except Exception as e:
+                logger.error("❌ Воркер N8N #%s: неожиданная ошибка: %s", worker_id, e)
+            finally:
+                self.queue.task_done()
+
+    async def _batch_loop(self):
+        """
+        Сборщик пачек: копит события из очереди до N8N_BATCH_MAX_SIZE
+        или до истечения N8N_BATCH_MAX_LINGER_MS с первого события пачки.
+        События берутся из очереди по порядку, поэтому порядок внутри чата сохраняется.
+        """
+        linger = Config.N8N_BATCH_MAX_LINGER_MS / 1000
+        batch: List[Tuple[float, Dict[str, Any]]] = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                deadline = time.monotonic() + linger
+                reason = 'size'
+                while len(batch) < Config.N8N_BATCH_MAX_SIZE:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        reason = 'linger'
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        reason = 'linger'
+                        break
+
+                # Ограничиваем число одновременных отправок пачек размером пула воркеров
+                await self._flush_slots.acquire()
+                ready, batch = batch, []
+                task = asyncio.create_task(self._flush_batch(ready, reason))
+                self._flush_tasks.add(task)
+                task.add_done_callback(self._flush_tasks.discard)
+        except asyncio.CancelledError:
+            if batch:
+                await self._flush_batch(batch, 'shutdown', acquired=False)
+            raise
+
+    async def _flush_batch(self, batch: List[Tuple[float, Dict[str, Any]]], reason: str, acquired: bool = True):
+        """Отправить пачку событий одним JSON массивом"""
+        try:
+            self.batch_stats['batches_sent'] += 1
+            self.batch_stats['flush_reasons'][reason] += 1
+            bucket = next((str(bound) for bound in BATCH_SIZE_BUCKETS if len(batch) <= bound), '+Inf')
+            self.batch_stats['size_histogram'][bucket] += 1
+
+            if await self._deliver([webhook_data for _, webhook_data in batch], events_count=len(batch)):
+                delivered_at = time.monotonic()
+                self._delivery_latencies.extend((delivered_at - enqueued_at) * 1000 for enqueued_at, _ in batch)
+        except Exception as e:
+            logger.error("❌ Ошибка отправки пачки в N8N: %s", e)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+            if acquired:
+                self._flush_slots.release()
+
+    async def _deliver(self, webhook_data: Any, events_count: int = 1) -> bool:
+        """Отправить подготовленное событие (или пачку событий) в N8N"""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            if self.trace_mark:
+                forwarded_at = time.time()
+                for item in webhook_data if isinstance(webhook_data, list) else (webhook_data,):
+                    self.trace_mark(item.get('trace_id'), 'forwarded', forwarded_at)
+
+            body = json.dumps(webhook_data, ensure_ascii=False).encode('utf-8')
+            n8n_logger.debug("➡️ Отправляем в N8N (%d шт.): %s, данные: %.200s...", events_count, self.n8n_webhook_url, webhook_data)
+            headers = {'Content-Type': 'application/json'}
+            if Config.N8N_GZIP:
+                body = gzip.compress(body, compresslevel=5)
+                headers['Content-Encoding'] = 'gzip'
+
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(self.n8n_webhook_url, content=body, headers=headers)
+            except httpx.TimeoutException:
+                N8N_FORWARD_DURATION.labels("timeout").observe(time.perf_counter() - started)
+                raise
+            except httpx.HTTPError:
+                N8N_FORWARD_DURATION.labels("error").observe(time.perf_counter() - started)
+                raise
+            N8N_FORWARD_DURATION.labels(response.status_code).observe(time.perf_counter() - started)
             
+            outcome = 'ok' if response.status_code == 200 else f'http_{response.status_code}'
             if response.status_code == 200:
-                self.stats['messages_sent_to_n8n'] += 1
+                self.stats['messages_sent_to_n8n'] += events_count
                 self.stats['last_n8n_send'] = datetime.now().isoformat()
-                logger.info(f"✅ Событие успешно отправлено в N8N")
+                n8n_logger.debug("✅ Отправлено в N8N: %d шт.", events_count)
                 return True
             else:
-                logger.error(f"❌ N8N вернул ошибку: статус {response.status_code}, ответ: {response.text[:200]}...")
+                self.stats['n8n_send_errors'] += 1
+                logger.error("❌ N8N вернул ошибку: статус %s, ответ: %s...", response.status_code, response.text[:200])
                 return False
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
+            outcome = 'timeout'
+            self.stats['n8n_send_errors'] += 1
             logger.error("❌ Таймаут при отправке в N8N")
             return False
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Сетевая ошибка при отправке в N8N: {e}")
+        except httpx.HTTPError as e:
+            self.stats['n8n_send_errors'] += 1
+            logger.error("❌ Сетевая ошибка при отправке в N8N: %s", e)
             return False
         except Exception as e:
-            logger.error(f"❌ Неожиданная ошибка webhook: {e}")
+            self.stats['n8n_send_errors'] += 1
+            logger.error("❌ Неожиданная ошибка webhook: %s", e)
             return False
+        finally:
+            if self.publish_event:
+                items = webhook_data if isinstance(webhook_data, list) else (webhook_data,)
+                self.publish_event(
+                    'n8n_forward', status=outcome, events=events_count,
+                    chat_ids=sorted({item['data']['chat_id'] for item in items}),
+                    duration_ms=round((time.perf_counter() - started) * 1000, 1)
+                )
+
+    async def start(self):
+        """Запустить пул воркеров пересылки в N8N"""
+        if not self.n8n_webhook_url or self._workers:
+            return
+        if Config.N8N_BATCH_ENABLED:
+            self._workers = [asyncio.create_task(self._batch_loop())]
+            logger.info(
+                "📡 Пакетная отправка в N8N: до %s событий или %s мс, параллельно пачек: %s",
+                Config.N8N_BATCH_MAX_SIZE, Config.N8N_BATCH_MAX_LINGER_MS, Config.N8N_WORKERS
+            )
+        else:
+            self._workers = [
+                asyncio.create_task(self._worker_loop(i)) for i in range(Config.N8N_WORKERS)
+            ]
+            logger.info("📡 Запущено воркеров N8N: %s, размер очереди: %s", Config.N8N_WORKERS, Config.N8N_QUEUE_SIZE)
+
+    async def shutdown(self):
+        """Дождаться отправки очереди (с таймаутом) и остановить воркеры"""
+        if self._workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=Config.N8N_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Не отправлено в N8N при остановке: %s событий", self.queue.qsize())
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+            self._workers = []
+        await self.client.aclose()
 
     def process_incoming_webhook(self, message: IncomingWebhookMessage) -> Dict[str, Any]:
         """Обработать входящий webhook от N8N"""
         try:
-            logger.info(f"📥 Получен webhook от N8N для чата {message.chat_id}: {message.message[:50]}...")
+            n8n_logger.debug("📥 Получен webhook от N8N для чата %s: %.50s", message.chat_id, message.message)
             
             self.stats['messages_received_from_n8n'] += 1
             self.stats['last_n8n_receive'] = datetime.now().isoformat()
@@ -112,7 +332,7 @@ class WebhookHandler:
             }
             
         except Exception as e:
-            logger.error(f"❌ Ошибка обработки входящего webhook: {e}")
+            logger.error("❌ Ошибка обработки входящего webhook: %s", e)
             return {
                 "status": "error",
                 "error": str(e),
@@ -125,5 +345,28 @@ class WebhookHandler:
             "n8n_webhook_configured": bool(self.n8n_webhook_url),
             "n8n_webhook_url": self.n8n_webhook_url if self.n8n_webhook_url else "Not configured",
             "webhook_handler_status": "active",
-            "stats": self.stats.copy()
+            "stats": self.stats.copy(),
+            "queue": self.get_queue_stats(),
+            "batching": {
+                "enabled": Config.N8N_BATCH_ENABLED,
+                "gzip": Config.N8N_GZIP,
+                "batches_sent": self.batch_stats['batches_sent'],
+                "flush_reasons": dict(self.batch_stats['flush_reasons']),
+                "size_histogram": dict(self.batch_stats['size_histogram'])
+            }
+        }
+
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Глубина очереди пересылки и задержка от постановки до доставки"""
+        latencies = sorted(self._delivery_latencies)
+        return {
+            "depth": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "workers": len(self._workers),
+            "enqueue_to_delivery_ms": {
+                "samples": len(latencies),
+                "p50": round(_percentile(latencies, 0.50), 2),
+                "p95": round(_percentile(latencies, 0.95), 2),
+                "max": round(latencies[-1], 2) if latencies else 0.0
+            }
         }
@@ -0,0 +1,3 @@
+"""
+Нагрузочный стенд бота с локальными заглушками VK Teams Bot API и N8N
+"""
@@ -0,0 +1,185 @@
+"""
+Локальные заглушки VK Teams Bot API и N8N для нагрузочного стенда
+Запускаются в отдельном процессе, чтобы не делить event loop с измеряемым ботом
+"""
+import asyncio
+import gzip
+import json
+import random
+import time
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+EVENT_PREFIX = "bench"
+ECHO_PREFIX = "echo"
+
+class MockState:
+    """Сгенерированные события и замеры задержек"""
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        self.events: List[Dict[str, Any]] = []
+        self.new_events = asyncio.Event()
+        self.generating = False
+        self.generated = 0
+        self.n8n_latencies: List[float] = []  # событие -> N8N, секунд
+        self.vk_latencies: List[float] = []  # N8N -> /api/webhook -> sendText, секунд
+        self.counters = {
+            'events_get_calls': 0,
+            'send_text_calls': 0,
+            'send_text_errors_injected': 0,
+            'bot_replies': 0,
+            'n8n_requests': 0,
+            'n8n_events': 0,
+            'echo_requests': 0,
+            'echo_errors': 0
+        }
+        self.first_event_at = 0.0
+        self.last_n8n_at = 0.0
+        self.last_vk_at = 0.0
+
+    async def generate(self, rate: float, duration: float, chats: int):
+        """Создавать события newMessage с заданной частотой"""
+        self.generating = True
+        self.first_event_at = time.time()
+        interval = 1.0 / rate
+        started = time.monotonic()
+        event_id = len(self.events)
+        while time.monotonic() - started < duration:
+            # Догоняем расписание пачкой, если event loop отстал
+            due = int((time.monotonic() - started) / interval) + 1
+            while self.generated < due:
+                event_id += 1
+                self.generated += 1
+                self.events.append({
+                    "eventId": event_id,
+                    "type": "newMessage",
+                    "payload": {
+                        "chat": {"chatId": f"bench-chat-{event_id % chats}", "type": "private"},
+                        "from": {"userId": f"user{event_id % chats}", "firstName": "Bench", "lastName": "User"},
+                        "msgId": str(event_id),
+                        "text": f"{EVENT_PREFIX} {event_id} {time.time():.6f}",
+                        "timestamp": int(time.time())
+                    }
+                })
+            self.new_events.set()
+            await asyncio.sleep(interval if interval > 0.001 else 0.001)
+        self.generating = False
+
+def create_mock_app(params: Dict[str, Any]) -> FastAPI:
+    """
+    Приложение с заглушками:
+    /bot/v1/events/get, /bot/v1/messages/sendText - VK Teams Bot API
+    /n8n/webhook - N8N: фиксирует задержку и отвечает боту через /api/webhook
+    /bench/start, /bench/results - управление прогоном
+    """
+    app = FastAPI()
+    state = MockState(params)
+    echo_client = httpx.AsyncClient(
+        timeout=30, limits=httpx.Limits(max_connections=params["echo_concurrency"])
+    )
+    echo_semaphore = asyncio.Semaphore(params["echo_concurrency"])
+
+    async def maybe_fail(latency_ms: float, error_rate: float):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return error_rate and random.random() < error_rate
+
+    @app.get("/bot/v1/events/get")
+    async def events_get(lastEventId: int = 0, pollTime: int = 30):
+        state.counters['events_get_calls'] += 1
+        deadline = time.monotonic() + pollTime
+        while True:
+            # eventId совпадает с индексом в списке + 1
+            pending = state.events[lastEventId:lastEventId + params["events_per_poll"]]
+            if pending:
+                return {"ok": True, "events": pending}
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {"ok": True, "events": []}
+            state.new_events.clear()
+            try:
+                await asyncio.wait_for(state.new_events.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    @app.post("/bot/v1/messages/sendText")
+    async def send_text(request: Request):
+        state.counters['send_text_calls'] += 1
+        if await maybe_fail(params["vk_latency_ms"], params["vk_error_rate"]):
+            state.counters['send_text_errors_injected'] += 1
+            return JSONResponse({"ok": False, "description": "injected error"}, status_code=500)
+        form = dict(parse_qsl((await request.body()).decode('utf-8')))
+        parts = form.get('text', '').split()
+        if len(parts) == 3 and parts[0] == ECHO_PREFIX:
+            state.vk_latencies.append(time.time() - float(parts[2]))
+            state.last_vk_at = time.time()
+        else:
+            state.counters['bot_replies'] += 1
+        return {"ok": True, "msgId": str(state.counters['send_text_calls'])}
+
+    async def echo(chat_id: str, event_id: str, trace_id: Optional[str]):
+        """Ответ N8N -> бот, как это делает workflow через /api/webhook"""
+        async with echo_semaphore:
+            try:
+                response = await echo_client.post(params["bot_webhook_url"], json={
+                    "chat_id": chat_id,
+                    "message": f"{ECHO_PREFIX} {event_id} {time.time():.6f}",
+                    "trace_id": trace_id
+                })
+                if response.status_code != 200:
+                    state.counters['echo_errors'] += 1
+            except httpx.HTTPError:
+                state.counters['echo_errors'] += 1
+
+    @app.post("/n8n/webhook")
+    async def n8n_webhook(request: Request):
+        state.counters['n8n_requests'] += 1
+        body = await request.body()
+        if request.headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        events = data if isinstance(data, list) else [data]
+        now = time.time()
+        for event in events:
+            parts = event.get("data", {}).get("text", "").split()
+            if len(parts) != 3 or parts[0] != EVENT_PREFIX:
+                continue
+            state.counters['n8n_events'] += 1
+            state.n8n_latencies.append(now - float(parts[2]))
+            state.last_n8n_at = now
+            if params["echo"]:
+                state.counters['echo_requests'] += 1
+                asyncio.create_task(echo(event["data"]["chat_id"], parts[1], event.get("trace_id")))
+        if await maybe_fail(params["n8n_latency_ms"], params["n8n_error_rate"]):
+            return JSONResponse({"error": "injected error"}, status_code=500)
+        return {"ok": True}
+
+    @app.post("/bench/start")
+    async def start(rate: float, duration: float, chats: int = 100):
+        asyncio.create_task(state.generate(rate, duration, chats))
+        return {"status": "started"}
+
+    @app.get("/bench/results")
+    async def results():
+        return {
+            "generating": state.generating,
+            "generated": state.generated,
+            "first_event_at": state.first_event_at,
+            "last_n8n_at": state.last_n8n_at,
+            "last_vk_at": state.last_vk_at,
+            "counters": state.counters,
+            "event_to_n8n": state.n8n_latencies,
+            "n8n_to_vk": state.vk_latencies
+        }
+
+    return app
+
+def run_mocks(params: Dict[str, Any]):
+    """Точка входа процесса заглушек"""
+    uvicorn.run(create_mock_app(params), host="127.0.0.1", port=params["mock_port"], log_level="warning")
@@ -0,0 +1,85 @@
+"""
+Проверка лимитера исходящих вызовов без сети: один чат с очередью вызовов и несколько тихих чатов
+
+    cd python-app
+    python -m bench.rate_limiter
+
+Проверяются два свойства:
+    тихие чаты не ждут, пока лимит чата придерживает вызовы занятого чата;
+    вызовы всех чатов вместе не превышают глобальный лимит (rate и burst)
+Код возврата 1 - свойство нарушено
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List, Tuple
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Проверка лимитера VK Teams API")
+    parser.add_argument("--global-rps", type=float, default=100)
+    parser.add_argument("--global-burst", type=float, default=1)
+    parser.add_argument("--chat-rps", type=float, default=10)
+    parser.add_argument("--chat-burst", type=float, default=1)
+    parser.add_argument("--busy-calls", type=int, default=20, help="вызовов в очереди занятого чата")
+    parser.add_argument("--quiet-chats", type=int, default=5, help="чатов с одним вызовом")
+    return parser.parse_args(argv)
+
+def configure_env(args: argparse.Namespace):
+    """Настройки лимитера задаются до импорта app.config"""
+    os.environ.update({
+        "VK_TEAMS_BOT_TOKEN": os.environ.get("VK_TEAMS_BOT_TOKEN", "bench"),
+        "VK_RATE_LIMIT_ENABLED": "true",
+        "VK_RATE_LIMIT_GLOBAL_RPS": str(args.global_rps),
+        "VK_RATE_LIMIT_GLOBAL_BURST": str(args.global_burst),
+        "VK_RATE_LIMIT_CHAT_RPS": str(args.chat_rps),
+        "VK_RATE_LIMIT_CHAT_BURST": str(args.chat_burst)
+    })
+
+def global_violations(fired: List[float], rate: float, burst: float) -> List[Tuple[int, int]]:
+    """Пары вызовов (i, j), между которыми ушло больше, чем burst + rate * (t_j - t_i)"""
+    tolerance = 0.002  # точность таймеров event loop
+    violations = []
+    for i in range(len(fired)):
+        for j in range(i + 1, len(fired)):
+            allowed = burst + rate * (fired[j] - fired[i] + tolerance)
+            if j - i + 1 > allowed:
+                violations.append((i, j))
+    return violations
+
+async def run_check(args: argparse.Namespace) -> bool:
+    from app.rate_limiter import RateLimiter
+
+    limiter = RateLimiter()
+    fired: List[float] = []
+
+    async def call(chat_id: str) -> float:
+        started = time.monotonic()
+        await limiter.acquire(chat_id)
+        fired.append(time.monotonic())
+        return fired[-1] - started
+
+    busy = [asyncio.create_task(call("busy")) for _ in range(args.busy_calls)]
+    await asyncio.sleep(0)
+    quiet_waits = await asyncio.gather(*(call(f"quiet-{index}") for index in range(args.quiet_chats)))
+    await asyncio.gather(*busy)
+
+    # Тихим чатам достаточно своей доли глобального лимита (плюс шаг на вызов занятого чата, ушедший первым)
+    quiet_limit = (args.quiet_chats + 1) / args.global_rps + 0.05
+    violations = global_violations(sorted(fired), args.global_rps, args.global_burst)
+
+    print(f"quiet chats max wait: {max(quiet_waits):.3f} s (limit {quiet_limit:.3f} s)")
+    print(f"busy chat finished after: {max(fired) - min(fired):.3f} s")
+    print(f"global rate violations: {len(violations)}")
+    return max(quiet_waits) <= quiet_limit and not violations
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_env(args)
+    ok = asyncio.run(run_check(args))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
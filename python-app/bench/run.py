@@ -0,0 +1,229 @@
+"""
+Нагрузочный стенд: VKTeamsBot + APIServer против локальных заглушек VK Teams и N8N
+
+    cd python-app
+    python -m bench.run --rate 200 --duration 30 --output bench/results/baseline.json
+
+Замеряются два пути:
+    event_to_n8n - событие появилось в events/get -> пришло в N8N
+    n8n_to_vk    - N8N вызвал /api/webhook -> бот вызвал sendText
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List
+
+import httpx
+
+from .mocks import run_mocks
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд VK Teams бота")
+    parser.add_argument("--rate", type=float, default=100, help="событий в секунду")
+    parser.add_argument("--duration", type=float, default=20, help="длительность генерации, секунд")
+    parser.add_argument("--chats", type=int, default=100, help="число разных чатов")
+    parser.add_argument("--events-per-poll", type=int, default=100, help="максимум событий в ответе events/get")
+    parser.add_argument("--vk-latency-ms", type=float, default=0, help="задержка заглушки sendText")
+    parser.add_argument("--vk-error-rate", type=float, default=0, help="доля ответов 500 от sendText")
+    parser.add_argument("--n8n-latency-ms", type=float, default=0, help="задержка заглушки N8N")
+    parser.add_argument("--n8n-error-rate", type=float, default=0, help="доля ответов 500 от N8N")
+    parser.add_argument("--no-echo", action="store_true", help="N8N не отвечает боту через /api/webhook")
+    parser.add_argument("--echo-concurrency", type=int, default=50, help="параллельных ответов N8N -> бот")
+    parser.add_argument("--drain", type=float, default=3, help="ждать хвост после генерации, секунд без новых ответов")
+    parser.add_argument("--bot-port", type=int, default=18000)
+    parser.add_argument("--mock-port", type=int, default=18001)
+    parser.add_argument("--log-level", default="WARNING", help="уровень логов бота во время прогона")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределить настройку бота (можно несколько раз)")
+    parser.add_argument("--output", help="файл JSON с результатами (по умолчанию bench/results/<время>.json)")
+    return parser.parse_args(argv)
+
+def configure_env(args: argparse.Namespace, data_dir: str) -> Dict[str, str]:
+    """Настройки бота для прогона; задаются до импорта app.config"""
+    env = {
+        "VK_TEAMS_BOT_TOKEN": "bench-token",
+        "VK_TEAMS_API_URL": f"http://127.0.0.1:{args.mock_port}/bot/v1",
+        "N8N_WEBHOOK_URL": f"http://127.0.0.1:{args.mock_port}/n8n/webhook",
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_PORT": str(args.bot_port),
+        "POLL_TIME": "5",
+        "DATA_DIR": data_dir,
+        "DEAD_LETTER_DB": os.path.join(data_dir, "dead_letters.db"),
+        "CHECKPOINT_PATH": os.path.join(data_dir, "checkpoint.json"),
+        "IPC_SOCKET_PATH": os.path.join(data_dir, "poller.sock"),
+        "SEND_RETRY_BASE_DELAY": "0.05",
+        # Лимитер частоты настроен на продовый VK Teams и ограничил бы прогон; включается через --env
+        "VK_RATE_LIMIT_ENABLED": "false"
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.environ.update(env)
+    return env
+
+def percentiles(samples: List[float]) -> Dict[str, Any]:
+    """Количество и перцентили задержки в миллисекундах"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3)
+    }
+
+async def wait_http(url: str, timeout: float = 15):
+    async with httpx.AsyncClient() as client:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} не ответил за {timeout} с")
+                await asyncio.sleep(0.1)
+
+async def drive(args: argparse.Namespace) -> Dict[str, Any]:
+    """Поднять бота в этом процессе, запустить генерацию и собрать результаты"""
+    import uvicorn
+
+    from app.api_server import APIServer
+    from app.dead_letter import DeadLetterStore
+    from app.vk_teams_bot import VKTeamsBot
+    from app.webhook_handler import WebhookHandler
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    webhook_handler = WebhookHandler()
+    dead_letters = DeadLetterStore()
+    vk_bot = VKTeamsBot(webhook_handler, dead_letters)
+    api_server = APIServer(webhook_handler)
+    api_server.set_bot_instance(vk_bot)
+
+    server = uvicorn.Server(uvicorn.Config(
+        api_server.get_app(), host="127.0.0.1", port=args.bot_port, log_level="warning"
+    ))
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    bot_url = f"http://127.0.0.1:{args.bot_port}"
+    await wait_http(f"{mock_url}/bench/results")
+    server_task = asyncio.create_task(server.serve())
+    try:
+        await wait_http(f"{bot_url}/health")
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            await client.post(f"{mock_url}/bench/start", params={
+                "rate": args.rate, "duration": args.duration, "chats": args.chats
+            })
+            await asyncio.sleep(args.duration)
+
+            # Ждём хвост: пока приходят новые ответы, но не дольше duration
+            expected = int(args.rate * args.duration)
+            drain_deadline = time.monotonic() + max(args.duration, 10)
+            last_progress, idle_since = -1, time.monotonic()
+            while time.monotonic() < drain_deadline:
+                results = (await client.get(f"{mock_url}/bench/results")).json()
+                progress = len(results["event_to_n8n"]) + len(results["n8n_to_vk"])
+                done = len(results["event_to_n8n"]) >= expected and (
+                    args.no_echo or len(results["n8n_to_vk"]) >= expected
+                )
+                if done and not results["generating"]:
+                    break
+                if progress != last_progress:
+                    last_progress, idle_since = progress, time.monotonic()
+                elif time.monotonic() - idle_since > args.drain:
+                    break
+                await asyncio.sleep(0.2)
+
+            results = (await client.get(f"{mock_url}/bench/results")).json()
+            bot_stats = (await client.get(f"{bot_url}/api/stats")).json()
+    finally:
+        server.should_exit = True
+        await server_task
+        dead_letters.close()
+
+    first = results["first_event_at"]
+    to_n8n, to_vk = results["event_to_n8n"], results["n8n_to_vk"]
+    return {
+        "event_to_n8n": {
+            **percentiles(to_n8n),
+            "throughput_per_s": round(len(to_n8n) / (results["last_n8n_at"] - first), 2)
+            if to_n8n and results["last_n8n_at"] > first else 0
+        },
+        "n8n_to_vk": {
+            **percentiles(to_vk),
+            "throughput_per_s": round(len(to_vk) / (results["last_vk_at"] - first), 2)
+            if to_vk and results["last_vk_at"] > first else 0
+        },
+        "generated_events": results["generated"],
+        "mock_counters": results["counters"],
+        "bot": {
+            "polling": bot_stats.get("polling"),
+            "n8n_integration": bot_stats.get("n8n_integration"),
+            "rate_limiter": bot_stats.get("vk_api", {}).get("rate_limiter")
+        }
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    data_dir = tempfile.mkdtemp(prefix="stands-bench-")
+    env = configure_env(args, data_dir)
+
+    mock_params = {
+        "mock_port": args.mock_port,
+        "events_per_poll": args.events_per_poll,
+        "vk_latency_ms": args.vk_latency_ms,
+        "vk_error_rate": args.vk_error_rate,
+        "n8n_latency_ms": args.n8n_latency_ms,
+        "n8n_error_rate": args.n8n_error_rate,
+        "echo": not args.no_echo,
+        "echo_concurrency": args.echo_concurrency,
+        "bot_webhook_url": f"http://127.0.0.1:{args.bot_port}/api/webhook"
+    }
+    mocks = multiprocessing.get_context("spawn").Process(target=run_mocks, args=(mock_params,), daemon=True)
+    mocks.start()
+    try:
+        results = asyncio.run(drive(args))
+    finally:
+        mocks.terminate()
+        mocks.join(5)
+
+    report = {
+        "started_at": datetime.now().isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "bot_env": {key: value for key, value in env.items() if key != "VK_TEAMS_BOT_TOKEN"},
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results
+    }
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for path in ("event_to_n8n", "n8n_to_vk"):
+        stats = results[path]
+        if stats["count"]:
+            print(f"{path:13} n={stats['count']:6} {stats['throughput_per_s']:9.1f}/s "
+                  f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+        else:
+            print(f"{path:13} n=0")
+    print(f"📄 Результаты: {output}")
+
+if __name__ == "__main__":
+    main()